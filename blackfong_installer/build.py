@@ -2,13 +2,16 @@ from __future__ import annotations
 
 import argparse
 import logging
+import sys
 from pathlib import Path
 from typing import Any, Dict, Optional
 
-from .build_config import load_build_config
+from .build_config import BuildConfig, load_build_config
 from .build_state import ensure_build_defaults, load_build_state, save_build_state
 from .build_steps import ALL_STEPS, BuildCtx
+from .lib.apt_proxy import DEFAULT_PORT, parse_size, resolve_apt_proxy, serve
 from .lib.command import run_cmd
+from .lib.storage import write_image
 from .logging_utils import configure_logging
 
 logger = logging.getLogger(__name__)
@@ -44,16 +47,80 @@ def run_build(
     if not targets:
         raise RuntimeError("No build targets specified")
 
+    apt_proxy = resolve_apt_proxy(cfg.apt_proxy)
+
     for t in targets:
-        ctx = BuildCtx(cfg=cfg, target=t, state_path=state_path, dry_run=dry_run)
+        ctx = BuildCtx(cfg=cfg, target=t, state_path=state_path, dry_run=dry_run, apt_proxy=apt_proxy)
         logger.info("=== Build target: %s ===", t)
         for fn in ALL_STEPS:
             fn(ctx=ctx, state=state, force=force)
             save_build_state(state_path, state)
 
 
+def cache_proxy_main(argv: list[str]) -> int:
+    p = argparse.ArgumentParser(prog="blackfong-build cache-proxy", description="Caching HTTP proxy for APT")
+    p.add_argument("--listen", default=f"0.0.0.0:{DEFAULT_PORT}", help="host:port to listen on")
+    p.add_argument("--cache-dir", default="build/apt-cache")
+    p.add_argument("--max-size", default="20G", help="Store size cap (e.g. 20G, 512M)")
+    p.add_argument("--config", default=DEFAULT_BUILD_CONFIG, help="Build config whose Debian mirrors are allowed")
+    p.add_argument(
+        "--allow-host",
+        action="append",
+        default=[],
+        help="Additional upstream host to proxy (repeatable); others get 403",
+    )
+    p.add_argument("--log", default="logs/blackfong-apt-proxy.log")
+
+    args = p.parse_args(argv)
+    configure_logging(log_path=args.log)
+
+    cfg = load_build_config(args.config) if Path(args.config).exists() else BuildConfig(raw={})
+    allowed = [cfg.debian_mirror, cfg.debian_security_mirror, *args.allow_host]
+
+    host, _, port = args.listen.rpartition(":")
+    try:
+        serve(
+            host or "0.0.0.0",
+            int(port),
+            cache_dir=args.cache_dir,
+            max_bytes=parse_size(args.max_size),
+            allowed_hosts=allowed,
+        )
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def flash_main(argv: list[str]) -> int:
+    p = argparse.ArgumentParser(prog="blackfong-build flash", description="Write an image to a disk or file")
+    p.add_argument("image", help="Raw image or .zst (e.g. output/blackfong-installer-arm64.img)")
+    p.add_argument("device", help="Block device or file to write")
+    p.add_argument("--jobs", type=int, default=4, help="Writer threads")
+    p.add_argument("--no-verify", action="store_true", help="Skip the read-back SHA256 check")
+    p.add_argument("--log", default="logs/blackfong-flash.log")
+
+    args = p.parse_args(argv)
+    configure_logging(log_path=args.log)
+
+    def _progress(done: int, total: Optional[int]) -> None:
+        pct = f" {done * 100 // total}%" if total else ""
+        print(f"\r{done >> 20} MiB{pct}", end="", file=sys.stderr, flush=True)
+
+    result = write_image(args.image, args.device, jobs=args.jobs, verify=not args.no_verify, progress=_progress)
+    print(file=sys.stderr)
+    for k, v in result.summary().items():
+        print(f"{k}: {v}")
+    return 0
+
+
 def main(argv: Optional[list[str]] = None) -> int:
-    p = argparse.ArgumentParser(prog="blackfong-build")
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ["cache-proxy"]:
+        return cache_proxy_main(argv[1:])
+    if argv[:1] == ["flash"]:
+        return flash_main(argv[1:])
+
+    p = argparse.ArgumentParser(prog="blackfong-build", epilog="Subcommands: cache-proxy, flash (see <subcommand> --help)")
     p.add_argument("--config", default=DEFAULT_BUILD_CONFIG)
     p.add_argument("--state", default=DEFAULT_BUILD_STATE)
     p.add_argument("--log", default=DEFAULT_BUILD_LOG)
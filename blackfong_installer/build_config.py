@@ -45,6 +45,35 @@ class BuildConfig:
     def debian_mirror(self) -> str:
         return str(((self.raw.get("debian") or {}).get("mirror")) or "http://deb.debian.org/debian")
 
+    @property
+    def debian_security_mirror(self) -> str:
+        return str(
+            ((self.raw.get("debian") or {}).get("security_mirror")) or "http://security.debian.org/debian-security"
+        )
+
+    @property
+    def bootstrap_cache_dir(self) -> str:
+        """Cached debootstrap tarballs for the live rootfs ("" disables)."""
+        value = (self.raw.get("debian") or {}).get("bootstrap_cache_dir", "build/bootstrap-cache")
+        return str(value or "")
+
+    @property
+    def apt_proxy(self) -> str:
+        """APT cache proxy URL, "auto" (probe for `blackfong-build cache-proxy`), or "" for none."""
+        return str(((self.raw.get("debian") or {}).get("apt_proxy")) or "")
+
+    @property
+    def golden_images(self) -> List[str]:
+        """Profile ids to build golden root images for ("all" = every profile of the target)."""
+        value = (self.raw.get("images") or {}).get("golden") or []
+        if isinstance(value, str):
+            return [value]
+        return [str(v) for v in value]
+
+    @property
+    def images_dir(self) -> str:
+        return str(((self.raw.get("images") or {}).get("output_dir")) or "output/images")
+
 
 def load_build_config(path: str) -> BuildConfig:
     p = Path(path)
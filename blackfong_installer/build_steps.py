@@ -1,17 +1,27 @@
 from __future__ import annotations
 
 import hashlib
+import json
 import logging
 import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Sequence
+from typing import Any, Dict, List, Mapping, Optional, Sequence
 
 from .build_config import BuildConfig
 from .build_state import is_completed, mark_completed
 from .lib.assets import copy_tree
+from .lib.apt_index import PackageIndex, find_packages_file
+from .lib.apt_proxy import proxy_env
 from .lib.apt_repo import build_file_repo_from_debs
+from .lib.resolver import list_profiles, resolve_plan
 from .lib.command import run_cmd
+from .lib.fetch import installed_versions
+from .lib.manifests import load_features_manifest
+from .lib.pkg import PackageSet, apt_package_info, debootstrap_rootfs
+from .lib.rootfs_image import build_root_image, prepare_rootfs_for_image
+from .state_store import ensure_defaults
+from .steps import InstallPackagesStep
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +32,12 @@ class BuildCtx:
     target: str
     state_path: str
     dry_run: bool
+    apt_proxy: Optional[str] = None
+
+    @property
+    def apt_env(self) -> Dict[str, str]:
+        """Environment for debootstrap/apt-get (routes through the APT cache proxy if any)."""
+        return proxy_env(self.apt_proxy)
 
     @property
     def work_target_dir(self) -> Path:
@@ -110,19 +126,18 @@ def step_01_prepare_live_rootfs(*, ctx: BuildCtx, state: Dict[str, Any], force:
     rootfs = ctx.rootfs_dir
     rootfs.mkdir(parents=True, exist_ok=True)
 
-    # debootstrap (native or foreign)
+    # debootstrap (native or foreign), unpacked from the bootstrap cache when warm.
     # NOTE: cross-arch builds require qemu-user-static/binfmt and a 2nd stage.
-    run_cmd(
-        [
-            "debootstrap",
-            "--arch",
-            ctx.target,
-            ctx.cfg.debian_suite,
-            str(rootfs),
-            ctx.cfg.debian_mirror,
-        ],
+    bootstrap = debootstrap_rootfs(
+        target_root=str(rootfs),
+        suite=ctx.cfg.debian_suite,
+        mirror=ctx.cfg.debian_mirror,
+        arch=ctx.target,
+        env=ctx.apt_env,
+        cache_dir=ctx.cfg.bootstrap_cache_dir or None,
         dry_run=ctx.dry_run,
     )
+    logger.info("[%s] bootstrap: %s", ctx.target, bootstrap)
 
     # minimal base packages (inside chroot)
     run_cmd(["mount", "--bind", "/dev", str(rootfs / "dev")], dry_run=ctx.dry_run)
@@ -130,7 +145,7 @@ def step_01_prepare_live_rootfs(*, ctx: BuildCtx, state: Dict[str, Any], force:
     run_cmd(["mount", "--bind", "/sys", str(rootfs / "sys")], dry_run=ctx.dry_run)
 
     try:
-        run_cmd(["chroot", str(rootfs), "apt-get", "update"], dry_run=ctx.dry_run)
+        run_cmd(["chroot", str(rootfs), "apt-get", "update"], env=ctx.apt_env, apt_status=True, dry_run=ctx.dry_run)
         run_cmd(
             [
                 "chroot",
@@ -146,6 +161,8 @@ def step_01_prepare_live_rootfs(*, ctx: BuildCtx, state: Dict[str, Any], force:
                 "iputils-ping",
                 "ca-certificates",
             ],
+            env=ctx.apt_env,
+            apt_status=True,
             dry_run=ctx.dry_run,
         )
     finally:
@@ -217,7 +234,7 @@ def step_03_configure_boot(*, ctx: BuildCtx, state: Dict[str, Any], force: bool)
     run_cmd(["mount", "--bind", "/sys", str(rootfs / "sys")], dry_run=ctx.dry_run)
 
     try:
-        run_cmd(["chroot", str(rootfs), "apt-get", "update"], dry_run=ctx.dry_run)
+        run_cmd(["chroot", str(rootfs), "apt-get", "update"], env=ctx.apt_env, apt_status=True, dry_run=ctx.dry_run)
 
         # kernel package from config
         kernel_pkg = (((ctx.cfg.raw.get("arch") or {}).get(ctx.target)) or {}).get("kernel_package")
@@ -238,6 +255,8 @@ def step_03_configure_boot(*, ctx: BuildCtx, state: Dict[str, Any], force: bool)
                 "initramfs-tools",
                 *list(extra),
             ],
+            env=ctx.apt_env,
+            apt_status=True,
             dry_run=ctx.dry_run,
         )
     finally:
@@ -248,6 +267,43 @@ def step_03_configure_boot(*, ctx: BuildCtx, state: Dict[str, Any], force: bool)
     mark_completed(state, target=ctx.target, step_id=step_id)
 
 
+def _write_closure_report(ctx: BuildCtx, repo_dir: Path) -> None:
+    """Resolve every profile for this arch against the built repo; write closure-report.json."""
+
+    files = []
+    for arch in (ctx.target, "all"):
+        found = find_packages_file(
+            str(repo_dir), suite=ctx.cfg.offline_repo_suite, component=ctx.cfg.offline_repo_component, arch=arch
+        )
+        if found:
+            files.append(found)
+    if not files:
+        logger.warning("[%s] built repo has no Packages index; skipping closure report", ctx.target)
+        return
+
+    report: Dict[str, Any] = {}
+    with PackageIndex.from_files(files, cache_dir=str(ctx.work_target_dir / "apt-index")) as index:
+        for profile in list_profiles():
+            if str(profile.get("arch")) != ctx.target:
+                continue
+            res = resolve_plan(index, _closure_plan(ctx, profile))
+            report[str(profile["id"])] = res.summary()
+            for g in res.gaps:
+                logger.warning("[%s] %s: unsatisfiable %s (required by %s)", ctx.target, profile["id"], g.requirement, g.required_by)
+            logger.info(
+                "[%s] %s closure: %d packages, %.1f MiB download, %.1f MiB installed, %d gaps",
+                ctx.target,
+                profile["id"],
+                len(res.packages),
+                res.download_bytes / (1 << 20),
+                res.installed_bytes / (1 << 20),
+                len(res.gaps),
+            )
+
+    out = ctx.work_target_dir / "closure-report.json"
+    out.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+
+
 def step_04_integrate_offline_repo(*, ctx: BuildCtx, state: Dict[str, Any], force: bool) -> None:
     step_id = "04_integrate_offline_repo"
     if (not force) and is_completed(state, target=ctx.target, step_id=step_id):
@@ -270,6 +326,9 @@ def step_04_integrate_offline_repo(*, ctx: BuildCtx, state: Dict[str, Any], forc
         dry_run=ctx.dry_run,
     )
 
+    if not ctx.dry_run:
+        _write_closure_report(ctx, built_repo)
+
     if ctx.dry_run:
         logger.info(
             "[%s] would copy built repo -> %s and write blackfong.list",
@@ -310,7 +369,7 @@ def step_05_optional_network_config(*, ctx: BuildCtx, state: Dict[str, Any], for
     run_cmd(["mount", "--bind", "/sys", str(rootfs / "sys")], dry_run=ctx.dry_run)
 
     try:
-        run_cmd(["chroot", str(rootfs), "apt-get", "update"], dry_run=ctx.dry_run)
+        run_cmd(["chroot", str(rootfs), "apt-get", "update"], env=ctx.apt_env, apt_status=True, dry_run=ctx.dry_run)
         run_cmd(
             [
                 "chroot",
@@ -322,6 +381,8 @@ def step_05_optional_network_config(*, ctx: BuildCtx, state: Dict[str, Any], for
                 "network-manager",
                 "wget",
             ],
+            env=ctx.apt_env,
+            apt_status=True,
             dry_run=ctx.dry_run,
         )
     finally:
@@ -332,6 +393,150 @@ def step_05_optional_network_config(*, ctx: BuildCtx, state: Dict[str, Any], for
     mark_completed(state, target=ctx.target, step_id=step_id)
 
 
+def _golden_profiles(ctx: BuildCtx) -> List[Mapping[str, Any]]:
+    wanted = ctx.cfg.golden_images
+    if not wanted:
+        return []
+    profiles = [p for p in list_profiles() if str(p.get("arch")) == ctx.target]
+    if "all" in wanted:
+        return profiles
+    return [p for p in profiles if str(p.get("id")) in wanted]
+
+
+def _profile_plan(ctx: BuildCtx, profile: Mapping[str, Any]) -> List[PackageSet]:
+    """What a package-mode install of the profile would install, minus hardware-gated features.
+
+    The installer's own planners run against a synthetic state with no GPU or
+    camera and an offline source; images.config overrides installer config keys
+    (desktop_base, code_warden_enabled, ...).
+    """
+
+    overrides = (ctx.cfg.raw.get("images") or {}).get("config") or {}
+    state = ensure_defaults(
+        {
+            "config": {"install_source": "offline", **overrides},
+            "hardware": {
+                "arch": ctx.target,
+                "firmware": profile.get("firmware"),
+                "gpu": {"present": False},
+                "camera": {"present": False},
+            },
+            "profile": dict(profile),
+        }
+    )
+    plan = [PackageSet(source="profile", packages=tuple(str(p) for p in profile.get("packages") or []))]
+    return plan + InstallPackagesStep().plan(state)
+
+
+def _closure_plan(ctx: BuildCtx, profile: Mapping[str, Any]) -> List[PackageSet]:
+    """_profile_plan plus every feature group as optional (hardware picks the groups at install time)."""
+
+    groups = (load_features_manifest().get("feature_groups") or {}).values()
+    features = tuple(dict.fromkeys(str(p) for g in groups for p in (g or {}).get("packages") or []))
+    return _profile_plan(ctx, profile) + [PackageSet(source="features", packages=features, optional=True)]
+
+
+def _build_golden_image(ctx: BuildCtx, profile: Mapping[str, Any]) -> None:
+    profile_id = str(profile["id"])
+    rootfs = ctx.work_target_dir / "golden" / profile_id
+    _rm_rf(rootfs, dry_run=ctx.dry_run)
+    rootfs.mkdir(parents=True, exist_ok=True)
+
+    debootstrap_rootfs(
+        target_root=str(rootfs),
+        suite=ctx.cfg.debian_suite,
+        mirror=ctx.cfg.debian_mirror,
+        arch=ctx.target,
+        env=ctx.apt_env,
+        cache_dir=ctx.cfg.bootstrap_cache_dir or None,
+        dry_run=ctx.dry_run,
+    )
+
+    # The built offline repo is visible to apt during the build only; installs write their own sources.
+    repo_mnt = rootfs / ctx.cfg.offline_repo_live_path.lstrip("/")
+    build_list = rootfs / "etc/apt/sources.list.d/blackfong-build.list"
+    plan = _profile_plan(ctx, profile)
+
+    run_cmd(["mkdir", "-p", str(repo_mnt)], dry_run=ctx.dry_run)
+    run_cmd(["mount", "--bind", str(ctx.work_target_dir / "apt-repo-built"), str(repo_mnt)], dry_run=ctx.dry_run)
+    run_cmd(["mount", "--bind", "/dev", str(rootfs / "dev")], dry_run=ctx.dry_run)
+    run_cmd(["mount", "--bind", "/proc", str(rootfs / "proc")], dry_run=ctx.dry_run)
+    run_cmd(["mount", "--bind", "/sys", str(rootfs / "sys")], dry_run=ctx.dry_run)
+    try:
+        if not ctx.dry_run:
+            build_list.parent.mkdir(parents=True, exist_ok=True)
+            build_list.write_text(
+                f"deb [trusted=yes] file:{ctx.cfg.offline_repo_live_path} "
+                f"{ctx.cfg.offline_repo_suite} {ctx.cfg.offline_repo_component}\n",
+                encoding="utf-8",
+            )
+        run_cmd(["chroot", str(rootfs), "apt-get", "update"], env=ctx.apt_env, apt_status=True, dry_run=ctx.dry_run)
+
+        info = apt_package_info(
+            str(rootfs), [p for ps in plan if ps.optional for p in ps.packages], dry_run=ctx.dry_run
+        )
+        for with_recommends in (False, True):
+            packages: list[str] = []
+            for ps in plan:
+                if ps.with_recommends != with_recommends:
+                    continue
+                for p in ps.packages:
+                    if (not ps.optional or info[p].available) and p not in packages:
+                        packages.append(p)
+            if not packages:
+                continue
+            argv = ["chroot", str(rootfs), "apt-get", "install", "-y"]
+            if not with_recommends:
+                argv.append("--no-install-recommends")
+            run_cmd([*argv, *packages], env=ctx.apt_env, apt_status=True, dry_run=ctx.dry_run)
+    finally:
+        if not ctx.dry_run:
+            build_list.unlink(missing_ok=True)
+        run_cmd(["umount", "-lf", str(rootfs / "sys")], check=False, dry_run=ctx.dry_run)
+        run_cmd(["umount", "-lf", str(rootfs / "proc")], check=False, dry_run=ctx.dry_run)
+        run_cmd(["umount", "-lf", str(rootfs / "dev")], check=False, dry_run=ctx.dry_run)
+        run_cmd(["umount", "-lf", str(repo_mnt)], check=False, dry_run=ctx.dry_run)
+
+    prepare_rootfs_for_image(str(rootfs), dry_run=ctx.dry_run)
+    build_root_image(
+        str(rootfs),
+        ctx.cfg.images_dir,
+        profile_id=profile_id,
+        arch=ctx.target,
+        packages=sorted(installed_versions(str(rootfs))),
+        extra={"suite": ctx.cfg.debian_suite, "mirror": ctx.cfg.debian_mirror},
+        dry_run=ctx.dry_run,
+    )
+    _rm_rf(rootfs, dry_run=ctx.dry_run)
+
+
+def step_05b_build_golden_images(*, ctx: BuildCtx, state: Dict[str, Any], force: bool) -> None:
+    step_id = "05b_build_golden_images"
+    if (not force) and is_completed(state, target=ctx.target, step_id=step_id):
+        logger.info("[%s] skip %s", ctx.target, step_id)
+        return
+
+    profiles = _golden_profiles(ctx)
+    if not profiles:
+        logger.info("[%s] no golden images configured (images.golden)", ctx.target)
+    for profile in profiles:
+        logger.info("[%s] building golden image for %s", ctx.target, profile["id"])
+        _build_golden_image(ctx, profile)
+
+    mark_completed(state, target=ctx.target, step_id=step_id)
+
+
+def _copy_golden_images(ctx: BuildCtx, dst: Path) -> None:
+    """Put this target's golden images (and manifests) on the installer medium under /images."""
+
+    for profile in _golden_profiles(ctx):
+        for name in (f"{profile['id']}.ext4.zst", f"{profile['id']}.json"):
+            src = Path(ctx.cfg.images_dir) / name
+            if ctx.dry_run or src.is_file():
+                dst.mkdir(parents=True, exist_ok=True)
+                run_cmd(["cp", "-a", str(src), str(dst / name)], dry_run=ctx.dry_run)
+
+
 def step_06_create_artifact(*, ctx: BuildCtx, state: Dict[str, Any], force: bool) -> None:
     step_id = "06_create_artifact"
     if (not force) and is_completed(state, target=ctx.target, step_id=step_id):
@@ -357,6 +562,7 @@ def step_06_create_artifact(*, ctx: BuildCtx, state: Dict[str, Any], force: bool
 
         squash = iso_dir / "live/filesystem.squashfs"
         run_cmd(["mksquashfs", str(rootfs), str(squash), "-e", "boot"], dry_run=ctx.dry_run)
+        _copy_golden_images(ctx, iso_dir / "images")
 
         # Copy kernel/initrd (best-effort: pick newest)
         boot_src = rootfs / "boot"
@@ -468,6 +674,7 @@ ALL_STEPS = [
     step_03_configure_boot,
     step_04_integrate_offline_repo,
     step_05_optional_network_config,
+    step_05b_build_golden_images,
     step_06_create_artifact,
     step_07_verify,
     step_08_package_outputs,
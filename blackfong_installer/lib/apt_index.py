@@ -0,0 +1,555 @@
+from __future__ import annotations
+
+import bz2
+import functools
+import gzip
+import hashlib
+import logging
+import lzma
+import mmap
+import os
+import re
+import struct
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Fields kept from each Packages stanza (everything else is dropped at build time).
+FIELDS = (
+    "Package",
+    "Version",
+    "Architecture",
+    "Depends",
+    "Pre-Depends",
+    "Recommends",
+    "Provides",
+    "Filename",
+    "Size",
+    "Installed-Size",
+    "SHA256",
+    "Multi-Arch",
+)
+
+DEFAULT_CACHE_DIR = "/var/cache/blackfong-installer/apt-index"
+SIDECAR_NAME = "Packages.bfidx"
+
+_MAGIC = b"BFAPTIX1"
+# magic, key (sha256), n_packages, n_provides, packages table off, provides table off, blob off
+_HEADER = struct.Struct("<8s32sIIQQQ")
+# key off, key len, value off, value len (offsets relative to blob)
+_ENTRY = struct.Struct("<IIII")
+_FS = b"\x1f"  # field separator within a record
+_RS = b"\x1e"  # record separator within a value block
+
+_COMPRESSED = {".gz": gzip.open, ".xz": lzma.open, ".bz2": bz2.open}
+
+
+# ---------------------------------------------------------------------------
+# Debian version comparison (deb-version(7))
+# ---------------------------------------------------------------------------
+
+
+def _order(c: str) -> int:
+    if c == "~":
+        return -1
+    if c.isdigit():
+        return 0
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+def _cmp_part(a: str, b: str) -> int:
+    i = j = 0
+    while i < len(a) or j < len(b):
+        first_diff = 0
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            ac = _order(a[i]) if i < len(a) else 0
+            bc = _order(b[j]) if j < len(b) else 0
+            if ac != bc:
+                return ac - bc
+            i += 1
+            j += 1
+        while i < len(a) and a[i] == "0":
+            i += 1
+        while j < len(b) and b[j] == "0":
+            j += 1
+        while i < len(a) and a[i].isdigit() and j < len(b) and b[j].isdigit():
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+        if i < len(a) and a[i].isdigit():
+            return 1
+        if j < len(b) and b[j].isdigit():
+            return -1
+        if first_diff:
+            return first_diff
+    return 0
+
+
+def _split_version(v: str) -> Tuple[int, str, str]:
+    epoch = 0
+    if ":" in v:
+        e, v = v.split(":", 1)
+        epoch = int(e or 0)
+    upstream, _, revision = v.rpartition("-") if "-" in v else (v, "", "")
+    return epoch, upstream, revision
+
+
+def version_compare(a: str, b: str) -> int:
+    """Compare two Debian versions; negative, zero or positive like cmp()."""
+
+    ea, ua, ra = _split_version(a)
+    eb, ub, rb = _split_version(b)
+    if ea != eb:
+        return ea - eb
+    return _cmp_part(ua, ub) or _cmp_part(ra, rb)
+
+
+# ---------------------------------------------------------------------------
+# Packages files
+# ---------------------------------------------------------------------------
+
+
+def open_packages_file(path: str) -> IO[bytes]:
+    opener = _COMPRESSED.get(Path(path).suffix)
+    if opener is not None:
+        return opener(path, "rb")  # type: ignore[operator]
+    return open(path, "rb")
+
+
+def iter_stanzas(fp: IO[bytes], fields: Sequence[str] = FIELDS) -> Iterator[Dict[str, str]]:
+    """Stream deb822 stanzas, keeping only `fields` (continuation lines are folded)."""
+
+    wanted = set(fields)
+    stanza: Dict[str, str] = {}
+    current: Optional[str] = None
+    for raw in fp:
+        line = raw.decode("utf-8", "replace").rstrip("\n")
+        if not line.strip():
+            if stanza:
+                yield stanza
+            stanza, current = {}, None
+            continue
+        if line[0] in " \t":
+            if current is not None:
+                stanza[current] += " " + line.strip()
+            continue
+        key, sep, value = line.partition(":")
+        if not sep or key not in wanted:
+            current = None
+            continue
+        current = key
+        stanza[key] = value.strip()
+    if stanza:
+        yield stanza
+
+
+def parse_provides(value: str) -> List[Tuple[str, Optional[str]]]:
+    """Parse a Provides field into (name, version or None)."""
+
+    out: List[Tuple[str, Optional[str]]] = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        m = re.match(r"^([^\s(:]+)(?::\S+)?\s*(?:\(\s*=\s*([^)\s]+)\s*\))?", item)
+        if m:
+            out.append((m.group(1), m.group(2)))
+    return out
+
+
+def find_packages_file(repo_dir: str, *, suite: str, component: str, arch: str) -> Optional[str]:
+    """Locate dists/<suite>/<component>/binary-<arch>/Packages[.xz|.gz|.bz2] in a repo tree."""
+
+    base = Path(repo_dir) / "dists" / suite / component / f"binary-{arch}"
+    for name in ("Packages", "Packages.xz", "Packages.gz", "Packages.bz2"):
+        if (base / name).is_file():
+            return str(base / name)
+    return None
+
+
+_LIST_ARCH_RE = re.compile(r"_binary-([^_]+)_Packages(?:\.\w+)?$")
+
+
+def apt_lists_packages_files(root: str = "/", *, arch: Optional[str] = None) -> List[str]:
+    """Packages indexes apt downloaded for `root` (var/lib/apt/lists) that apt would install from.
+
+    With `arch`, lists for other architectures (multiarch foreign arches such as
+    i386) are skipped; binary-all is always kept. Suites whose Release is marked
+    NotAutomatic (experimental, backports) are skipped too: apt pins them below
+    the default release, so they never supply a candidate unless asked for.
+    """
+
+    lists = Path(root) / "var/lib/apt/lists"
+    if not lists.is_dir():
+        return []
+    out: List[str] = []
+    for p in sorted(lists.iterdir()):
+        name = p.name
+        if "_Packages" not in name or not p.is_file():
+            continue
+        if not (name.endswith("_Packages") or Path(name).suffix in _COMPRESSED):
+            logger.debug("Skipping unsupported apt list compression: %s", name)
+            continue
+        m = _LIST_ARCH_RE.search(name)
+        if arch is not None and m is not None and m.group(1) not in {arch, "all"}:
+            continue
+        release, _ = _release_for(p)
+        if release is not None and release_fields(release).get("NotAutomatic", "").lower() == "yes":
+            logger.debug("Skipping NotAutomatic suite: %s", name)
+            continue
+        out.append(str(p))
+    return out
+
+
+def release_fields(release: Path) -> Dict[str, str]:
+    """Top-level fields of a Release/InRelease file (Suite, Codename, NotAutomatic, ...)."""
+
+    fields: Dict[str, str] = {}
+    try:
+        with open(release, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line[:1].isspace() and line.strip():
+                    break  # checksum lists: the header fields are all above them
+                if ":" in line and not line.startswith("-----"):
+                    key, _, value = line.partition(":")
+                    fields.setdefault(key.strip(), value.strip())
+    except OSError:
+        pass
+    return fields
+
+
+def _release_for(path: Path) -> Tuple[Optional[Path], Optional[str]]:
+    """Find the Release file covering a Packages file and the path it is listed under."""
+
+    # Repo tree: .../dists/<suite>/<component>/binary-<arch>/Packages
+    parts = path.parts
+    if "dists" in parts:
+        i = len(parts) - 1 - parts[::-1].index("dists")
+        if i + 2 < len(parts):
+            suite_dir = Path(*parts[: i + 2])
+            rel = "/".join(parts[i + 2 :])
+            for name in ("InRelease", "Release"):
+                if (suite_dir / name).is_file():
+                    return suite_dir / name, rel
+    # apt lists: <host>_<path>_dists_<suite>_<component>_binary-<arch>_Packages
+    m = re.match(r"^(.*_dists_[^_]+)_(.+)$", path.name)
+    if m:
+        for name in ("InRelease", "Release"):
+            rel_file = path.with_name(f"{m.group(1)}_{name}")
+            if rel_file.is_file():
+                return rel_file, m.group(2).replace("_", "/")
+    return None, None
+
+
+def _release_sha256(release: Path, rel: str) -> Optional[Tuple[str, int]]:
+    in_sha = False
+    for line in release.read_text(encoding="utf-8", errors="replace").splitlines():
+        if not line.startswith(" "):
+            in_sha = line.startswith("SHA256:")
+            continue
+        if in_sha:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == rel:
+                return fields[0], int(fields[1])
+    return None
+
+
+def cache_key(packages_path: str) -> bytes:
+    """Content key for a Packages file.
+
+    Uses the SHA256 the covering Release/InRelease lists for it when that matches
+    the file size (cheap), otherwise hashes the file itself.
+    """
+
+    p = Path(packages_path)
+    size = p.stat().st_size
+    release, rel = _release_for(p)
+    if release is not None and rel is not None:
+        listed = _release_sha256(release, rel)
+        if listed is not None and listed[1] == size:
+            return bytes.fromhex(listed[0])
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+# ---------------------------------------------------------------------------
+# Records and the on-disk cache
+# ---------------------------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class PackageRecord:
+    name: str
+    version: str
+    architecture: str = ""
+    depends: str = ""
+    pre_depends: str = ""
+    recommends: str = ""
+    provides: str = ""
+    filename: str = ""
+    size: int = 0
+    installed_size_kb: int = 0
+    sha256: str = ""
+    multi_arch: str = ""
+
+    @classmethod
+    def _decode(cls, data: bytes) -> "PackageRecord":
+        v = data.decode("utf-8").split("\x1f")
+        return cls(
+            name=v[0],
+            version=v[1],
+            architecture=v[2],
+            depends=v[3],
+            pre_depends=v[4],
+            recommends=v[5],
+            provides=v[6],
+            filename=v[7],
+            size=int(v[8] or 0),
+            installed_size_kb=int(v[9] or 0),
+            sha256=v[10],
+            multi_arch=v[11],
+        )
+
+
+def build_cache(packages_path: str, out_path: str, *, key: Optional[bytes] = None) -> None:
+    """Parse a Packages file and write the compact index (atomically)."""
+
+    key = key or cache_key(packages_path)
+    by_name: Dict[str, List[bytes]] = {}
+    versions: Dict[bytes, str] = {}
+    provides: Dict[str, List[bytes]] = {}
+
+    with open_packages_file(packages_path) as fp:
+        for st in iter_stanzas(fp):
+            name = st.get("Package")
+            version = st.get("Version")
+            if not name or not version:
+                continue
+            rec = _FS.join(st.get(f, "").replace("\x1f", " ").encode("utf-8") for f in FIELDS)
+            versions[rec] = version
+            by_name.setdefault(name, []).append(rec)
+            for prov, prov_ver in parse_provides(st.get("Provides", "")):
+                provides.setdefault(prov, []).append(_FS.join([name.encode(), (prov_ver or "").encode()]))
+
+    newest_first = functools.cmp_to_key(lambda a, b: version_compare(versions[b], versions[a]))
+
+    blob = bytearray()
+
+    def _table(items: Mapping[str, List[bytes]], sort_values: bool) -> bytes:
+        out = bytearray()
+        for name in sorted(items, key=lambda n: n.encode("utf-8")):
+            values = sorted(items[name], key=newest_first) if sort_values else items[name]
+            kb = name.encode("utf-8")
+            key_off = len(blob)
+            blob.extend(kb)
+            val = _RS.join(values)
+            val_off = len(blob)
+            blob.extend(val)
+            out += _ENTRY.pack(key_off, len(kb), val_off, len(val))
+        return bytes(out)
+
+    pkg_table = _table(by_name, True)
+    prov_table = _table(provides, False)
+
+    pkg_off = _HEADER.size
+    prov_off = pkg_off + len(pkg_table)
+    blob_off = prov_off + len(prov_table)
+    header = _HEADER.pack(_MAGIC, key, len(by_name), len(provides), pkg_off, prov_off, blob_off)
+
+    out = Path(out_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".bfidx-", dir=str(out.parent))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(pkg_table)
+            f.write(prov_table)
+            f.write(blob)
+        os.replace(tmp, out)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    logger.info("Indexed %s: %d packages, %d virtual names -> %s", packages_path, len(by_name), len(provides), out)
+
+
+class PackagesCache:
+    """Read-only, memory-mapped view of one indexed Packages file.
+
+    Lookups binary-search the mapped tables; nothing is loaded up front, so
+    opening is constant time and resident memory stays small on 1 GB boards.
+    """
+
+    def __init__(self, path: str, *, label: str = "") -> None:
+        self.path = path
+        self.label = label
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, self.key, self._n_pkgs, self._n_prov, self._pkg_off, self._prov_off, self._blob_off = (
+                _HEADER.unpack_from(self._mm, 0)
+            )
+        except struct.error:
+            magic = b""
+        if magic != _MAGIC:
+            self._mm.close()
+            raise ValueError(f"Not a package index cache: {path}")
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def _lookup(self, table_off: int, count: int, name: str) -> Optional[bytes]:
+        target = name.encode("utf-8")
+        mm, base = self._mm, self._blob_off
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key_off, key_len, val_off, val_len = _ENTRY.unpack_from(mm, table_off + mid * _ENTRY.size)
+            key = mm[base + key_off : base + key_off + key_len]
+            if key < target:
+                lo = mid + 1
+            elif key > target:
+                hi = mid
+            else:
+                return mm[base + val_off : base + val_off + val_len]
+        return None
+
+    def versions(self, name: str) -> List[PackageRecord]:
+        """All records for a real package name, newest version first."""
+
+        raw = self._lookup(self._pkg_off, self._n_pkgs, name)
+        if raw is None:
+            return []
+        return [PackageRecord._decode(r) for r in raw.split(_RS)]
+
+    def providers(self, name: str) -> List[Tuple[str, Optional[str]]]:
+        """(package, provided version or None) for packages that Provide `name`."""
+
+        raw = self._lookup(self._prov_off, self._n_prov, name)
+        if raw is None:
+            return []
+        out: List[Tuple[str, Optional[str]]] = []
+        for r in raw.split(_RS):
+            pkg, ver = r.decode("utf-8").split("\x1f")
+            out.append((pkg, ver or None))
+        return out
+
+    def __len__(self) -> int:
+        return self._n_pkgs
+
+
+def open_cache(packages_path: str, *, cache_dir: str = DEFAULT_CACHE_DIR, label: str = "") -> PackagesCache:
+    """Open the index for a Packages file, building it on first use.
+
+    Looks for a sidecar next to the Packages file (shipped on read-only media by
+    build_file_repo_from_debs) before the cache directory. Stale caches are
+    detected by key and rebuilt.
+    """
+
+    key = cache_key(packages_path)
+    sidecar = Path(packages_path).with_name(SIDECAR_NAME)
+    cached = Path(cache_dir) / f"{key.hex()}.bfidx"
+    for candidate in (sidecar, cached):
+        if candidate.is_file():
+            try:
+                c = PackagesCache(str(candidate), label=label or packages_path)
+            except (ValueError, OSError, struct.error):
+                continue
+            if c.key == key:
+                return c
+            c.close()
+
+    build_cache(packages_path, str(cached), key=key)
+    return PackagesCache(str(cached), label=label or packages_path)
+
+
+class PackageIndex:
+    """Merged view over several Packages caches (offline repo, mirrors)."""
+
+    def __init__(self, caches: Sequence[PackagesCache]) -> None:
+        self.caches = list(caches)
+
+    @classmethod
+    def from_files(cls, paths: Iterable[str], *, cache_dir: str = DEFAULT_CACHE_DIR) -> "PackageIndex":
+        return cls([open_cache(p, cache_dir=cache_dir) for p in paths])
+
+    def close(self) -> None:
+        for c in self.caches:
+            c.close()
+
+    def __enter__(self) -> "PackageIndex":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def versions(self, name: str) -> List[Tuple[PackageRecord, PackagesCache]]:
+        """All versions of a real package across sources, newest first."""
+
+        out = [(r, c) for c in self.caches for r in c.versions(name)]
+        out.sort(key=functools.cmp_to_key(lambda a, b: version_compare(b[0].version, a[0].version)))
+        return out
+
+    def candidate(self, name: str) -> Optional[Tuple[PackageRecord, PackagesCache]]:
+        """Newest version of a real package (apt pinning is not modelled)."""
+
+        versions = self.versions(name)
+        return versions[0] if versions else None
+
+    def providers(self, name: str) -> List[Tuple[str, Optional[str]]]:
+        seen: Dict[Tuple[str, Optional[str]], None] = {}
+        for c in self.caches:
+            for p in c.providers(name):
+                seen.setdefault(p, None)
+        return list(seen)
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and any(c.versions(name) for c in self.caches)
+
+
+@contextmanager
+def package_index(state: Mapping[str, Any]) -> Iterator[Optional[PackageIndex]]:
+    """PackageIndex for the install target, or None when there is nothing to index.
+
+    Prefers the target's apt lists (exactly what its sources.list resolved to);
+    before the first apt-get update, falls back to the configured offline repo.
+    """
+
+    cfg = state.get("config") or {}
+    hw = state.get("hardware") or {}
+    target_root = ((state.get("execution") or {}).get("mounts") or {}).get("target_root")
+    cache_dir = str(cfg.get("apt_index_cache_dir") or DEFAULT_CACHE_DIR)
+
+    files = apt_lists_packages_files(target_root, arch=hw.get("arch")) if target_root else []
+    if not files and cfg.get("offline_repo_path") and hw.get("arch"):
+        suite = str(cfg.get("offline_repo_suite", "bookworm"))
+        component = str(cfg.get("offline_repo_component", "main"))
+        for arch in (str(hw["arch"]), "all"):
+            found = find_packages_file(str(cfg["offline_repo_path"]), suite=suite, component=component, arch=arch)
+            if found:
+                files.append(found)
+
+    index: Optional[PackageIndex] = None
+    if files:
+        try:
+            index = PackageIndex.from_files(files, cache_dir=cache_dir)
+        except OSError as e:
+            logger.warning("Package index unavailable (%s); falling back to apt-cache", e)
+    try:
+        yield index
+    finally:
+        if index is not None:
+            index.close()
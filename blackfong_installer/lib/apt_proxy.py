@@ -0,0 +1,451 @@
+from __future__ import annotations
+
+import http.client
+import json
+import logging
+import os
+import posixpath
+import socket
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 3142
+APT_CONF_NAME = "01blackfong-proxy"
+
+_CHUNK = 1 << 16
+_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "proxy-connection", "te", "upgrade"}
+
+
+def classify(path: str) -> str:
+    """"immutable" for content-addressed files (pool/, by-hash/), else "volatile".
+
+    Volatile files (Release/InRelease and index files at fixed paths) are
+    revalidated with the upstream on every request.
+    """
+
+    if "/by-hash/" in path or "/pool/" in path:
+        return "immutable"
+    name = posixpath.basename(path)
+    if name.endswith((".deb", ".udeb", ".dsc")) or ".orig.tar." in name:
+        return "immutable"
+    return "volatile"
+
+
+def upstream_host(value: str) -> str:
+    """"http://deb.debian.org/debian" or "deb.debian.org:80" -> "deb.debian.org" (allowlist form)."""
+
+    value = value.strip().lower()
+    netloc = urlsplit(value).netloc if "://" in value else value.split("/", 1)[0]
+    return netloc[: -len(":80")] if netloc.endswith(":80") else netloc
+
+
+def parse_size(value: str) -> int:
+    """"20G", "512M", "100000" -> bytes."""
+
+    value = value.strip().upper()
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class CacheStore:
+    """On-disk object store with an LRU size cap.
+
+    Objects live at <root>/<host>/<path>; validators for revalidation (ETag,
+    Last-Modified) sit next to them in <file>.meta. Recency is tracked in
+    memory and seeded from mtimes on startup (hits touch the file).
+    """
+
+    def __init__(self, root: str, *, max_bytes: int) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lru: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        # key -> [lock, holders and waiters]; dropped when the count reaches zero.
+        self._key_locks: Dict[str, List[Any]] = {}
+
+        found: List[Tuple[float, str, int]] = []
+        for p in [p for p in self.root.rglob("*") if p.is_file()]:
+            if p.name.endswith(".part"):
+                # Interrupted download from a previous run.
+                p.unlink(missing_ok=True)
+            elif not p.name.endswith(".meta"):
+                st = p.stat()
+                found.append((st.st_mtime, str(p.relative_to(self.root)), st.st_size))
+        for _, key, size in sorted(found):
+            self._lru[key] = size
+            self._total += size
+        logger.info("Cache store %s: %d objects, %.1f MiB", self.root, len(self._lru), self._total / (1 << 20))
+
+    @staticmethod
+    def key_for(host: str, path: str) -> Optional[str]:
+        """Store key for an upstream URL, or None if it would escape the cache root.
+
+        Any ".." segment is refused outright: normalising it away would store the
+        upstream's answer for one path under the key of another.
+        """
+
+        if ".." in path.split("/") or "\0" in path:
+            return None
+        norm = posixpath.normpath("/" + path.lstrip("/"))
+        if host in {"", ".", ".."} or any(c in host for c in "/\\\0"):
+            return None
+        return f"{host}{norm}"
+
+    @contextmanager
+    def key_lock(self, key: str) -> Iterator[None]:
+        """Hold the per-object fetch lock; the entry is dropped when nobody holds or waits for it."""
+
+        with self._lock:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = self._key_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def conflicts(self, key: str) -> bool:
+        """True if key cannot be stored as a file: it is a directory of other
+        objects (.../dists/bookworm vs .../dists/bookworm/InRelease) or lies
+        below an object that is already a file."""
+
+        if self.path(key).is_dir():
+            return True
+        return any(self.path(str(d)).is_file() for d in Path(key).parents if d != Path("."))
+
+    def lookup(self, key: str) -> Optional[Path]:
+        with self._lock:
+            if key not in self._lru:
+                return None
+            self._lru.move_to_end(key)
+        p = self.path(key)
+        try:
+            os.utime(p)
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._lru.pop(key, 0)
+            return None
+        return p
+
+    def meta(self, key: str) -> Dict[str, str]:
+        try:
+            return json.loads(self.path(key).with_name(self.path(key).name + ".meta").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def new_part(self, key: str) -> Tuple[BinaryIO, str]:
+        dst = self.path(key)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".", suffix=".part", dir=str(dst.parent))
+        return os.fdopen(fd, "wb"), tmp
+
+    def commit(self, key: str, tmp: str, meta: Dict[str, str]) -> None:
+        dst = self.path(key)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, dst)
+        dst.with_name(dst.name + ".meta").write_text(json.dumps(meta), encoding="utf-8")
+        with self._lock:
+            self._total += size - self._lru.pop(key, 0)
+            self._lru[key] = size
+        self._evict()
+
+    def _evict(self) -> None:
+        while True:
+            with self._lock:
+                if self._total <= self.max_bytes or len(self._lru) <= 1:
+                    return
+                key, size = self._lru.popitem(last=False)
+                self._total -= size
+            p = self.path(key)
+            p.unlink(missing_ok=True)
+            p.with_name(p.name + ".meta").unlink(missing_ok=True)
+            logger.debug("Evicted %s (%d bytes)", key, size)
+
+
+class _Upstreams(threading.local):
+    """Per-handler-thread keep-alive connections to upstream mirrors."""
+
+    def __init__(self) -> None:
+        self.conns: Dict[str, http.client.HTTPConnection] = {}
+
+    def request(self, host: str, path: str, headers: Dict[str, str]) -> http.client.HTTPResponse:
+        for attempt in (1, 2):
+            conn = self.conns.get(host)
+            if conn is None:
+                conn = self.conns[host] = http.client.HTTPConnection(host, timeout=60)
+            try:
+                conn.request("GET", path, headers=headers)
+                return conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self.conns.pop(host, None)
+                if attempt == 2:
+                    raise
+        raise AssertionError("unreachable")
+
+
+class AptProxyHandler(BaseHTTPRequestHandler):
+    """APT caching proxy.
+
+    Accepts proxy-style requests (Acquire::http::Proxy, http_proxy=) with an
+    absolute URI, and apt-cacher-ng style direct requests where the first path
+    segment is the upstream host (http://proxy:3142/deb.debian.org/debian/...).
+    Only plain-HTTP upstreams are cached; CONNECT is refused, and so is any
+    upstream host outside allowed_hosts (see upstream_host) so the proxy is not
+    an open relay.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "blackfong-apt-proxy"
+    store: CacheStore
+    allowed_hosts: frozenset = frozenset()
+    upstreams = _Upstreams()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _target(self) -> Optional[Tuple[str, str]]:
+        if self.path.startswith("http://"):
+            u = urlsplit(self.path)
+            return u.netloc, u.path or "/"
+        if self.path.startswith("/"):
+            host, _, rest = self.path.lstrip("/").partition("/")
+            return host, "/" + rest.split("?", 1)[0]
+        return None
+
+    def do_CONNECT(self) -> None:
+        self.send_error(405, "HTTPS is not proxied; use an http:// mirror")
+
+    def do_HEAD(self) -> None:
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool = False) -> None:
+        target = self._target()
+        key = CacheStore.key_for(*target) if target else None
+        if target is None or key is None:
+            self.send_error(400, "Bad request path")
+            return
+        host, path = target
+        if upstream_host(host) not in self.allowed_hosts:
+            self.send_error(403, f"Upstream {host} is not allowed")
+            return
+        if self.store.conflicts(key):
+            self.send_error(409, "Path conflicts with a cached object")
+            return
+
+        immutable = classify(path) == "immutable"
+        if immutable:
+            cached = self.store.lookup(key)
+            if cached is not None:
+                self._send_file(cached, head=head, cache="HIT")
+                return
+
+        # One upstream fetch per object; concurrent requests wait and then hit the cache.
+        with self.store.key_lock(key):
+            cached = self.store.lookup(key)
+            if cached is not None and immutable:
+                self._send_file(cached, head=head, cache="HIT")
+                return
+
+            headers = {"Host": host, "User-Agent": self.headers.get("User-Agent", "apt")}
+            meta = self.store.meta(key) if cached is not None else {}
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+            try:
+                resp = self.upstreams.request(host, path, headers)
+            except (http.client.HTTPException, OSError) as e:
+                if cached is not None:
+                    logger.warning("Upstream %s unreachable (%s); serving stale %s", host, e, key)
+                    self._send_file(cached, head=head, cache="STALE")
+                else:
+                    self.send_error(502, f"Upstream error: {e}")
+                return
+
+            if resp.status == 304 and cached is not None:
+                resp.read()
+                self._send_file(cached, head=head, cache="REVALIDATED")
+                return
+            if resp.status != 200:
+                self._relay(resp, head=head)
+                return
+            self._fetch_and_send(key, resp, head=head)
+
+    def _send_file(self, path: Path, *, head: bool, cache: str) -> None:
+        size = path.stat().st_size
+        self.send_response(200)
+        self.send_header("Content-Length", str(size))
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("X-Cache", cache)
+        self.end_headers()
+        if head:
+            return
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK), b""):
+                self.wfile.write(chunk)
+
+    def _relay(self, resp: http.client.HTTPResponse, *, head: bool) -> None:
+        body = resp.read()
+        self.send_response(resp.status)
+        for k, v in resp.getheaders():
+            if k.lower() not in _HOP_HEADERS and k.lower() != "content-length":
+                self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _fetch_and_send(self, key: str, resp: http.client.HTTPResponse, *, head: bool) -> None:
+        """Tee the upstream body into the store and to the client."""
+
+        try:
+            f, tmp = self.store.new_part(key)
+        except OSError as e:
+            # Lost a race with a conflicting key (see CacheStore.conflicts); nothing sent yet.
+            resp.close()
+            self.close_connection = True
+            self.send_error(409, f"Cannot cache {key}: {e}")
+            return
+
+        length = resp.getheader("Content-Length")
+        self.send_response(200)
+        if length is not None:
+            self.send_header("Content-Length", length)
+        else:
+            self.close_connection = True
+        for k in ("Content-Type", "Last-Modified", "ETag"):
+            v = resp.getheader(k)
+            if v:
+                self.send_header(k, v)
+        self.send_header("X-Cache", "MISS")
+        self.end_headers()
+
+        client_ok = not head
+        try:
+            with f:
+                for chunk in iter(lambda: resp.read(_CHUNK), b""):
+                    f.write(chunk)
+                    if client_ok:
+                        try:
+                            self.wfile.write(chunk)
+                        except OSError:
+                            # Client went away; finish the download for the cache anyway.
+                            client_ok = False
+            if length is not None and os.path.getsize(tmp) != int(length):
+                raise OSError(f"short upstream read for {key}")
+            meta = {"etag": resp.getheader("ETag") or "", "last_modified": resp.getheader("Last-Modified") or ""}
+            self.store.commit(key, tmp, meta)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            self.close_connection = True
+            raise
+
+
+def make_server(
+    host: str, port: int, *, cache_dir: str, max_bytes: int, allowed_hosts: Iterable[str]
+) -> ThreadingHTTPServer:
+    store = CacheStore(cache_dir, max_bytes=max_bytes)
+    allowed = frozenset(upstream_host(h) for h in allowed_hosts)
+    handler = type("BoundAptProxyHandler", (AptProxyHandler,), {"store": store, "allowed_hosts": allowed})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(host: str, port: int, *, cache_dir: str, max_bytes: int, allowed_hosts: Iterable[str]) -> None:
+    server = make_server(host, port, cache_dir=cache_dir, max_bytes=max_bytes, allowed_hosts=allowed_hosts)
+    logger.info("APT cache proxy on http://%s:%d (store %s, cap %.1f GiB)", host, port, cache_dir, max_bytes / (1 << 30))
+    logger.info("Allowed upstreams: %s", ", ".join(sorted(server.RequestHandlerClass.allowed_hosts)))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+# ---------------------------------------------------------------------------
+# Client side: finding a proxy and pointing apt/debootstrap at it
+# ---------------------------------------------------------------------------
+
+
+def default_gateway() -> Optional[str]:
+    try:
+        for line in Path("/proc/net/route").read_text(encoding="utf-8").splitlines()[1:]:
+            fields = line.split()
+            if len(fields) > 2 and fields[1] == "00000000":
+                return socket.inet_ntoa(int(fields[2], 16).to_bytes(4, "little"))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reachable(url: str, timeout: float = 0.3) -> bool:
+    u = urlsplit(url)
+    try:
+        with socket.create_connection((u.hostname or "", u.port or 80), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _candidates() -> Iterator[str]:
+    yield f"http://127.0.0.1:{DEFAULT_PORT}"
+    gw = default_gateway()
+    if gw:
+        yield f"http://{gw}:{DEFAULT_PORT}"
+
+
+def resolve_apt_proxy(value: Any) -> Optional[str]:
+    """Config apt_proxy -> proxy URL or None.
+
+    "auto" probes a local proxy, then one on the default gateway (port 3142).
+    """
+
+    if not value or str(value).strip().lower() in {"none", "off", "false"}:
+        return None
+    value = str(value).strip()
+    if value.lower() != "auto":
+        return value
+    for url in _candidates():
+        if _reachable(url):
+            logger.info("Using APT cache proxy %s", url)
+            return url
+    return None
+
+
+def proxy_env(proxy: Optional[str]) -> Dict[str, str]:
+    """Environment for debootstrap/apt-get runs (chroot keeps the environment)."""
+
+    return {"http_proxy": proxy} if proxy else {}
+
+
+def write_apt_proxy_conf(target_root: str, proxy: str) -> Path:
+    p = Path(target_root) / "etc/apt/apt.conf.d" / APT_CONF_NAME
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(f'Acquire::http::Proxy "{proxy}";\n', encoding="utf-8")
+    return p
+
+
+def remove_apt_proxy_conf(target_root: str) -> None:
+    (Path(target_root) / "etc/apt/apt.conf.d" / APT_CONF_NAME).unlink(missing_ok=True)
@@ -4,6 +4,7 @@ import gzip
 import logging
 from pathlib import Path
 
+from .apt_index import SIDECAR_NAME, build_cache, find_packages_file
 from .command import run_cmd
 
 logger = logging.getLogger(__name__)
@@ -85,3 +86,10 @@ def build_file_repo_from_debs(
             (out / "dists" / suite / "Release").write_text(rel.stdout, encoding="utf-8")
     except Exception:
         logger.warning("apt-ftparchive not available; skipping Release generation")
+
+    # Pre-parsed package index shipped with the repo, so installers load it without parsing.
+    # Keyed on the file open_cache() will be handed (find_packages_file), or it never matches.
+    if not dry_run:
+        indexed = find_packages_file(str(out), suite=suite, component=component, arch=arch)
+        if indexed is not None:
+            build_cache(indexed, str(packages_dir / SIDECAR_NAME))
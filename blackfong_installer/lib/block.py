@@ -1,12 +1,32 @@
 from __future__ import annotations
 
+import errno
+import fcntl
 import logging
+import os
+import socket
+import time
 from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
 
-from .command import run_cmd
+from .command import run_cmd, run_cmds
 
 logger = logging.getLogger(__name__)
 
+SYSFS_ROOT = "/sys"
+# sysfs reports sizes and partition offsets in 512-byte units, whatever the device's block size.
+_SYSFS_SECTOR = 512
+# linux/fs.h: BLKRRPART = _IO(0x12, 95); re-read the partition table.
+_BLKRRPART = 0x125F
+# linux/netlink.h
+_NETLINK_KOBJECT_UEVENT = 15
+_UEVENT_KERNEL_GROUP = 1
+PARTITION_WAIT_S = 10.0
+# BLKRRPART fails with EBUSY while anything holds a partition open; udev probes
+# the disk right after the partition table writer closes it, so retry briefly.
+RESCAN_RETRY_S = 5.0
+
 
 @dataclass(frozen=True)
 class BlockIds:
@@ -21,3 +41,348 @@ def get_uuid(dev: str, *, dry_run: bool = False) -> str:
     if not uuid and not dry_run:
         raise RuntimeError(f"Unable to determine UUID for {dev}")
     return uuid
+
+
+def get_uuids(devs: Sequence[str], *, dry_run: bool = False) -> Dict[str, str]:
+    """get_uuid for several devices, probed concurrently."""
+
+    results = run_cmds([["blkid", "-s", "UUID", "-o", "value", dev] for dev in devs], dry_run=dry_run)
+    uuids: Dict[str, str] = {}
+    for dev, r in zip(devs, results):
+        uuid = (r.stdout or "").strip()
+        if not uuid and not dry_run:
+            raise RuntimeError(f"Unable to determine UUID for {dev}")
+        uuids[dev] = uuid
+    return uuids
+
+
+# ---------------------------------------------------------------------------
+# Disk inventory (sysfs; no lsblk/udev dependency)
+# ---------------------------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class PartitionInfo:
+    name: str
+    number: int
+    start: int  # bytes
+    size: int  # bytes
+    holders: Tuple[str, ...] = ()  # dm/md devices built on this partition (LVM PV, LUKS, RAID member)
+
+
+@dataclass(frozen=True)
+class BlockDevice:
+    """One whole disk as the kernel reports it under /sys/block/<name>."""
+
+    name: str
+    size: int  # bytes
+    rotational: bool = False
+    removable: bool = False
+    read_only: bool = False
+    transport: Optional[str] = None  # nvme|mmc|usb|sata|virtio|scsi
+    model: Optional[str] = None
+    logical_block_size: int = 512
+    physical_block_size: int = 512
+    minimum_io_size: int = 512
+    optimal_io_size: int = 0  # 0: device does not report one
+    discard_granularity: int = 0
+    discard_max_bytes: int = 0  # 0: no discard/TRIM support
+    erase_size: int = 0  # flash erase block (MMC/SD preferred_erase_size); 0: unknown
+    partitions: Tuple[PartitionInfo, ...] = ()
+    holders: Tuple[str, ...] = ()  # dm/md devices built on the whole disk
+
+    @property
+    def path(self) -> str:
+        return f"/dev/{self.name}"
+
+    def partition(self, number: int) -> Optional[PartitionInfo]:
+        return next((p for p in self.partitions if p.number == number), None)
+
+    def all_holders(self) -> List[str]:
+        """Holders of the disk and of each partition, as "holder" or "partition->holder"."""
+
+        out = list(self.holders)
+        for p in self.partitions:
+            out += [f"{p.name}->{h}" for h in p.holders]
+        return out
+
+    def to_dict(self) -> Dict[str, Any]:
+        d: Dict[str, Any] = {f: getattr(self, f) for f in self.__dataclass_fields__ if f not in ("partitions", "holders")}
+        d["partitions"] = [vars(p).copy() for p in self.partitions]
+        d["holders"] = list(self.holders)
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any]) -> "BlockDevice":
+        kw = {k: v for k, v in d.items() if k in cls.__dataclass_fields__}
+        kw["partitions"] = tuple(
+            PartitionInfo(**{**dict(p), "holders": tuple(p.get("holders") or ())}) for p in d.get("partitions") or ()
+        )
+        kw["holders"] = tuple(d.get("holders") or ())
+        return cls(**kw)
+
+
+def _holders(node: Path) -> Tuple[str, ...]:
+    holders = node / "holders"
+    return tuple(sorted(h.name for h in holders.iterdir())) if holders.is_dir() else ()
+
+
+def _read(path: Path) -> Optional[str]:
+    try:
+        return path.read_text(encoding="utf-8", errors="ignore").strip()
+    except OSError:
+        return None
+
+
+def _read_int(path: Path, default: int = 0) -> int:
+    txt = _read(path)
+    try:
+        return int(txt) if txt else default
+    except ValueError:
+        return default
+
+
+def _transport(name: str, devpath: str) -> Optional[str]:
+    if name.startswith("nvme"):
+        return "nvme"
+    if name.startswith("mmcblk"):
+        return "mmc"
+    for marker, tran in (("/usb", "usb"), ("/ata", "sata"), ("/virtio", "virtio"), ("/host", "scsi")):
+        if marker in devpath:
+            return tran
+    return None
+
+
+def device_name(dev: str) -> str:
+    """Kernel name for a device path: /dev/nvme0n1 or a /dev/disk/by-id link -> nvme0n1."""
+
+    return os.path.basename(os.path.realpath(dev)) if dev.startswith("/") else dev
+
+
+def partition_name(disk: str, number: int) -> str:
+    """Kernel name of partition `number` of `disk` (a kernel name or any path to the disk).
+
+    Disks whose name ends in a digit get a "p" separator: nvme0n1p1, mmcblk0p1,
+    loop0p1, md0p1; others append the number: sda1, vdb2.
+    """
+
+    name = device_name(disk)
+    return f"{name}p{number}" if name[-1:].isdigit() else f"{name}{number}"
+
+
+def partition_path(disk: str, number: int) -> str:
+    return f"/dev/{partition_name(disk, number)}"
+
+
+def _uevent_socket() -> Optional[socket.socket]:
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, _NETLINK_KOBJECT_UEVENT)
+    except (OSError, AttributeError):
+        return None
+    try:
+        sock.bind((0, _UEVENT_KERNEL_GROUP))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _parse_uevent(data: bytes) -> Dict[str, str]:
+    # Kernel uevents: "ACTION@DEVPATH\0KEY=VALUE\0..."
+    event: Dict[str, str] = {}
+    for field in data.split(b"\0")[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            event[key.decode(errors="replace")] = value.decode(errors="replace")
+    return event
+
+
+def reread_partitions(
+    disk: str, expected: Sequence[str], *, timeout: float = PARTITION_WAIT_S, sysfs_root: str = SYSFS_ROOT
+) -> None:
+    """Make the kernel rescan disk's partition table and wait until the expected partitions exist.
+
+    `expected` are kernel names (see partition_name). The kernel announces each
+    partition with an "add" uevent; we listen for those (subscribed before the
+    rescan, so none are missed) and return once every partition is in sysfs and
+    its /dev node exists (devtmpfs creates it before the event is sent). Where
+    uevents are unavailable (e.g. some containers) sysfs is polled instead.
+    A rescan refused with EBUSY is retried for up to RESCAN_RETRY_S.
+    """
+
+    sock = _uevent_socket()
+    try:
+        fd = os.open(disk, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            delay, give_up = 0.05, time.monotonic() + RESCAN_RETRY_S
+            while True:
+                try:
+                    fcntl.ioctl(fd, _BLKRRPART)
+                    break
+                except OSError as e:
+                    if e.errno == errno.EBUSY and time.monotonic() + delay < give_up:
+                        logger.debug("%s busy (udev probing?); retrying partition rescan in %.2fs", disk, delay)
+                        time.sleep(delay)
+                        delay = min(delay * 2, 0.5)
+                        continue
+                    raise RuntimeError(f"Kernel refused to re-read the partition table of {disk}: {e}") from e
+        finally:
+            os.close(fd)
+
+        def _ready(name: str) -> bool:
+            return (Path(sysfs_root) / "class/block" / name / "partition").exists() and os.path.exists(f"/dev/{name}")
+
+        pending = {n for n in expected if not _ready(n)}
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"Partitions of {disk} did not appear within {timeout:.0f}s: {', '.join(sorted(pending))}")
+            if sock is not None:
+                sock.settimeout(min(remaining, 0.5))
+                try:
+                    event = _parse_uevent(sock.recv(1 << 16))
+                except socket.timeout:
+                    event = {}
+                if event and event.get("DEVNAME") not in pending:
+                    continue
+            else:
+                time.sleep(min(remaining, 0.05))
+            pending = {n for n in pending if not _ready(n)}
+    finally:
+        if sock is not None:
+            sock.close()
+
+
+def parent_disk(name: str, *, sysfs_root: str = SYSFS_ROOT) -> Optional[str]:
+    """The whole disk a partition belongs to (None if `name` is not a partition)."""
+
+    node = Path(sysfs_root) / "class/block" / name
+    if not (node / "partition").exists():
+        return None
+    return node.resolve().parent.name
+
+
+def read_block_device(name: str, *, sysfs_root: str = SYSFS_ROOT) -> Optional[BlockDevice]:
+    """Inventory one disk; None if it does not exist. Cheap enough to call after every partition change."""
+
+    base = Path(sysfs_root) / "block" / name
+    if not base.is_dir():
+        return None
+    q = base / "queue"
+    partitions = []
+    for child in base.iterdir():
+        if (child / "partition").is_file():
+            partitions.append(
+                PartitionInfo(
+                    name=child.name,
+                    number=_read_int(child / "partition"),
+                    start=_read_int(child / "start") * _SYSFS_SECTOR,
+                    size=_read_int(child / "size") * _SYSFS_SECTOR,
+                    holders=_holders(child),
+                )
+            )
+    return BlockDevice(
+        name=name,
+        size=_read_int(base / "size") * _SYSFS_SECTOR,
+        rotational=_read_int(q / "rotational") == 1,
+        removable=_read_int(base / "removable") == 1,
+        read_only=_read_int(base / "ro") == 1,
+        transport=_transport(name, str(base.resolve())),
+        model=_read(base / "device/model") or None,
+        logical_block_size=_read_int(q / "logical_block_size", 512),
+        physical_block_size=_read_int(q / "physical_block_size", 512),
+        minimum_io_size=_read_int(q / "minimum_io_size", 512),
+        optimal_io_size=_read_int(q / "optimal_io_size"),
+        discard_granularity=_read_int(q / "discard_granularity"),
+        discard_max_bytes=_read_int(q / "discard_max_bytes"),
+        erase_size=_read_int(base / "device/preferred_erase_size"),
+        partitions=tuple(sorted(partitions, key=lambda p: p.number)),
+        holders=_holders(base),
+    )
+
+
+def mounted_partitions(dev: BlockDevice, *, mounts: str = "/proc/self/mounts") -> List[str]:
+    """Names of dev (or its partitions) that are currently mounted."""
+
+    names = {dev.name, *(p.name for p in dev.partitions)}
+    found = []
+    try:
+        lines = Path(mounts).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    for line in lines:
+        src = line.split(" ", 1)[0]
+        if src.startswith("/dev/") and device_name(src) in names:
+            found.append(device_name(src))
+    return sorted(set(found))
+
+
+# (offset, magic, what) for signatures that mean "this disk holds data", checked on disks without
+# partitions: partition tables (MBR/GPT; also FAT/NTFS boot sectors) and whole-disk filesystems/PVs.
+_SIGNATURES = (
+    (510, b"\x55\xaa", "partition table or boot sector"),
+    (512, b"EFI PART", "GPT"),
+    (0, b"LUKS\xba\xbe", "LUKS"),
+    (0, b"XFSB", "xfs"),
+    (536, b"LVM2 001", "LVM PV"),
+    (1080, b"\x53\xef", "ext2/3/4"),
+    (4086, b"SWAPSPACE2", "swap"),
+    (65600, b"_BHRfS_M", "btrfs"),
+)
+_SIGNATURE_SPAN = max(off + len(magic) for off, magic, _ in _SIGNATURES)
+
+
+def existing_data(dev: BlockDevice, *, dev_dir: str = "/dev") -> Optional[str]:
+    """What already lives on dev ("partitions sda1, sda2", "ext2/3/4 signature"), or None if it looks blank.
+
+    Partitions come from the inventory; a disk without them has its first
+    sectors read for partition table and whole-disk filesystem signatures.
+    Unreadable disks (e.g. not root) are reported as blank: this is a
+    safety net for automatic disk selection, not a guarantee.
+    """
+
+    if dev.partitions:
+        return "partitions " + ", ".join(p.name for p in dev.partitions)
+    try:
+        fd = os.open(os.path.join(dev_dir, dev.name), os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+        return None
+    try:
+        head = os.pread(fd, _SIGNATURE_SPAN, 0)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    for off, magic, what in _SIGNATURES:
+        if head[off : off + len(magic)] == magic:
+            return f"{what} signature"
+    return None
+
+
+def active_swaps(dev: BlockDevice, *, swaps: str = "/proc/swaps") -> List[str]:
+    """Names of dev (or its partitions) currently used as swap."""
+
+    names = {dev.name, *(p.name for p in dev.partitions)}
+    try:
+        lines = Path(swaps).read_text(encoding="utf-8").splitlines()[1:]  # skip the header
+    except OSError:
+        return []
+    found = {device_name(line.split()[0]) for line in lines if line.startswith("/dev/")}
+    return sorted(found & names)
+
+
+def inventory_disks(*, sysfs_root: str = SYSFS_ROOT) -> List[BlockDevice]:
+    """Every real, non-empty disk (loop/ram/zram/dm/md and empty card readers are skipped)."""
+
+    block = Path(sysfs_root) / "block"
+    if not block.is_dir():
+        return []
+    disks: List[BlockDevice] = []
+    for entry in sorted(block.iterdir()):
+        if "/devices/virtual/" in str(entry.resolve()):
+            continue
+        dev = read_block_device(entry.name, sysfs_root=sysfs_root)
+        if dev is not None and dev.size > 0:
+            disks.append(dev)
+    return disks
@@ -8,6 +8,9 @@ from .chroot import chroot_cmd
 
 logger = logging.getLogger(__name__)
 
+# grub-install/update-grub finish in well under a minute; a hang is usually a stuck os-prober or device.
+GRUB_TIMEOUT_S = 600.0
+
 
 def install_grub_efi(
     *,
@@ -27,9 +30,10 @@ def install_grub_efi(
             "--bootloader-id=BlackfongOS",
             "--recheck",
         ],
+        timeout=GRUB_TIMEOUT_S,
         dry_run=dry_run,
     )
-    chroot_cmd(target_root, ["update-grub"], dry_run=dry_run)
+    chroot_cmd(target_root, ["update-grub"], timeout=GRUB_TIMEOUT_S, dry_run=dry_run)
     logger.info("GRUB EFI installed")
 
 
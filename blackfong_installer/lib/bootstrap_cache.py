@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import shutil
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Sequence
+from urllib.parse import urlsplit
+
+from .command import run_cmd
+
+logger = logging.getLogger(__name__)
+
+
+def release_digest(mirror: str, suite: str, *, proxy: Optional[str] = None, timeout: float = 10.0) -> Optional[str]:
+    """SHA256 of the suite's InRelease (or Release) on the mirror, or None if unreachable."""
+
+    u = urlsplit(mirror)
+    for name in ("InRelease", "Release"):
+        rel = f"dists/{suite}/{name}"
+        try:
+            if u.scheme in {"http", "https"}:
+                handlers = [urllib.request.ProxyHandler({"http": proxy} if proxy else {})]
+                opener = urllib.request.build_opener(*handlers)
+                with opener.open(f"{mirror.rstrip('/')}/{rel}", timeout=timeout) as resp:
+                    data = resp.read()
+            else:
+                data = (Path(u.path if u.scheme == "file" else mirror) / rel).read_bytes()
+        except Exception as e:
+            logger.debug("No %s from %s: %s", rel, mirror, e)
+            continue
+        return hashlib.sha256(data).hexdigest()
+    return None
+
+
+def _params(suite: str, arch: str, mirror: str, variant: Optional[str], include: Sequence[str]) -> Dict[str, Any]:
+    return {
+        "suite": suite,
+        "arch": arch,
+        "mirror": mirror.rstrip("/"),
+        "variant": variant or "",
+        "include": sorted(set(include)),
+    }
+
+
+def _digest(obj: Mapping[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _compressor() -> tuple[str, str]:
+    """(tar compress program, file suffix): zstd when available, else gzip."""
+
+    if shutil.which("zstd"):
+        return "zstd -T0 -3", ".tar.zst"
+    return "gzip -1", ".tar.gz"
+
+
+class BootstrapCache:
+    """debootstrap results stored as tarballs.
+
+    Entries are keyed by suite, arch, mirror, variant, extra packages and the
+    SHA256 of the mirror's InRelease, so a mirror update invalidates them. When
+    the Release file cannot be fetched (offline lab), the newest entry for the
+    same parameters is used unvalidated.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.dir = Path(cache_dir)
+
+    def _latest_path(self, params_key: str) -> Path:
+        return self.dir / f"{params_key}.latest"
+
+    def lookup(self, params: Mapping[str, Any], release: Optional[str]) -> Optional[Path]:
+        params_key = _digest(params)
+        if release is not None:
+            key = _digest({**params, "release_sha256": release})
+        else:
+            try:
+                key = self._latest_path(params_key).read_text(encoding="utf-8").strip()
+            except OSError:
+                return None
+            logger.warning("Mirror Release unavailable; using unvalidated bootstrap cache %s", key)
+        for suffix in (".tar.zst", ".tar.gz"):
+            p = self.dir / f"{key}{suffix}"
+            if p.is_file():
+                return p
+        return None
+
+    def save(
+        self, target_root: str, params: Mapping[str, Any], release: Optional[str], *, dry_run: bool = False
+    ) -> Optional[Path]:
+        if release is None:
+            # Cannot key it; a later run could not tell whether it is current.
+            logger.info("Mirror Release unavailable; not caching bootstrap")
+            return None
+
+        params_key = _digest(params)
+        key = _digest({**params, "release_sha256": release})
+        program, suffix = _compressor()
+        out = self.dir / f"{key}{suffix}"
+        tmp = self.dir / f".{key}{suffix}.part"
+        if not dry_run:
+            self.dir.mkdir(parents=True, exist_ok=True)
+
+        run_cmd(
+            [
+                "tar",
+                "--numeric-owner",
+                "--xattrs",
+                "--xattrs-include=*",
+                "--acls",
+                "--one-file-system",
+                "--exclude=./lost+found",
+                "-I",
+                program,
+                "-C",
+                target_root,
+                "-cf",
+                str(tmp),
+                ".",
+            ],
+            dry_run=dry_run,
+        )
+        if dry_run:
+            return out
+
+        tmp.replace(out)
+        (self.dir / f"{key}.json").write_text(
+            json.dumps({**params, "release_sha256": release, "created": time.time(), "size": out.stat().st_size}, indent=2)
+            + "\n",
+            encoding="utf-8",
+        )
+
+        # Entries for the same parameters but an older Release are dead weight.
+        latest = self._latest_path(params_key)
+        try:
+            previous = latest.read_text(encoding="utf-8").strip()
+        except OSError:
+            previous = ""
+        latest.write_text(key + "\n", encoding="utf-8")
+        if previous and previous != key:
+            for p in self.dir.glob(f"{previous}.*"):
+                p.unlink(missing_ok=True)
+
+        logger.info("Cached bootstrap %s (%.1f MiB)", out.name, out.stat().st_size / (1 << 20))
+        return out
+
+    def extract(self, tarball: Path, target_root: str, *, dry_run: bool = False) -> None:
+        program = "zstd -d -T0" if tarball.name.endswith(".zst") else "gzip -d"
+        run_cmd(
+            [
+                "tar",
+                "--numeric-owner",
+                "--xattrs",
+                "--xattrs-include=*",
+                "--acls",
+                "-I",
+                program,
+                "-C",
+                target_root,
+                "-xpf",
+                str(tarball),
+            ],
+            dry_run=dry_run,
+        )
+
+
+def cached_debootstrap(
+    *,
+    cache_dir: str,
+    target_root: str,
+    suite: str,
+    arch: str,
+    mirror: str,
+    variant: Optional[str] = None,
+    include: Sequence[str] = (),
+    proxy: Optional[str] = None,
+    run_debootstrap: Any,
+    dry_run: bool = False,
+) -> str:
+    """Unpack a cached bootstrap into target_root, or run debootstrap and cache it.
+
+    run_debootstrap: zero-argument callable doing the real debootstrap.
+    Returns "hit" or "miss".
+    """
+
+    cache = BootstrapCache(cache_dir)
+    params = _params(suite, arch, mirror, variant, include)
+    release = release_digest(mirror, suite, proxy=proxy)
+
+    hit = cache.lookup(params, release)
+    if hit is not None:
+        logger.info("Bootstrap cache hit: %s", hit.name)
+        cache.extract(hit, target_root, dry_run=dry_run)
+        return "hit"
+
+    run_debootstrap()
+    cache.save(target_root, params, release, dry_run=dry_run)
+    return "miss"
@@ -1,20 +1,365 @@
 from __future__ import annotations
 
+import json
 import logging
-from typing import Sequence
+import os
+import re
+import struct
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence
 
-from .command import run_cmd
+from .command import CmdResult, complete_cmd, log_cmd, run_cmd
+from .events import emit
 
 logger = logging.getLogger(__name__)
 
+# (source, path relative to target root). Order matters: parents before children.
+SESSION_BINDS = (
+    ("/dev", "dev"),
+    ("/dev/pts", "dev/pts"),
+    ("/proc", "proc"),
+    ("/sys", "sys"),
+    ("/run", "run"),
+)
 
-def chroot_cmd(target_root: str, argv: Sequence[str], *, dry_run: bool = False) -> None:
-    """Run a command inside target root."""
+_ACTIVE_SESSION: Optional["ChrootSession"] = None
 
-    run_cmd(["chroot", target_root, *argv], dry_run=dry_run)
+
+# Helper run by ChrootExecutor: chroot once, then serve commands over stdin/stdout.
+# Everything it needs is imported before os.chroot(); the host's Python tree is
+# not reachable afterwards.
+_EXECUTOR_SRC = r"""
+import json, os, struct, subprocess, sys, threading
+
+rd, wr = sys.stdin.buffer, sys.stdout.buffer
+
+def send(obj):
+    data = json.dumps(obj).encode("utf-8")
+    wr.write(struct.pack(">I", len(data)) + data)
+    wr.flush()
+
+def run(argv, env, stdin):
+    p = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    err = []
+
+    def feed():
+        try:
+            p.stdin.write(stdin)
+            p.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    threads = [threading.Thread(target=feed), threading.Thread(target=lambda: err.append(p.stderr.read()))]
+    for t in threads:
+        t.start()
+    out = p.stdout.read()
+    for t in threads:
+        t.join()
+    p.stdout.close()
+    p.stderr.close()
+    # wait4 (not Popen.wait) so the rusage is this command's own, peak RSS included.
+    _, status, ru = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    return p.returncode, out, err[0], {"user_s": ru.ru_utime, "sys_s": ru.ru_stime, "max_rss_kb": ru.ru_maxrss}
+
+try:
+    os.chroot(sys.argv[1])
+    os.chdir("/")
+except OSError as e:
+    send({"ok": False, "error": str(e)})
+    sys.exit(1)
+send({"ok": True})
+
+while True:
+    hdr = rd.read(4)
+    if len(hdr) < 4:
+        break
+    req = json.loads(rd.read(struct.unpack(">I", hdr)[0]))
+    env = dict(os.environ, **req["env"])
+    stdin = req["input"].encode("utf-8") if req["input"] is not None else b""
+    try:
+        rc, out, err, usage = run(req["argv"], env, stdin)
+    except OSError as e:
+        rc, out, err, usage = 127, b"", str(e).encode("utf-8"), None
+    send({"rc": rc, "stdout": out.decode("utf-8", "replace"), "stderr": err.decode("utf-8", "replace"), "usage": usage})
+"""
+
+
+class ChrootExecutor:
+    """Long-lived helper process chrooted into a target root.
+
+    Commands are sent as length-prefixed JSON over a pipe and run by the helper,
+    which saves spawning a `chroot` binary (and its dynamic loading) per command.
+    Needs CAP_SYS_CHROOT; when the helper cannot chroot, run() returns None and
+    callers fall back to the `chroot` binary.
+    """
+
+    def __init__(self, target_root: str) -> None:
+        self.target_root = target_root
+        self._proc: Optional[subprocess.Popen] = None
+        self._unavailable = False
+        self._lock = threading.Lock()
+
+    def _recv(self) -> Dict[str, Any]:
+        assert self._proc is not None and self._proc.stdout is not None
+        hdr = self._proc.stdout.read(4)
+        if len(hdr) < 4:
+            raise EOFError("chroot executor exited")
+        return json.loads(self._proc.stdout.read(struct.unpack(">I", hdr)[0]))
+
+    def _start(self) -> bool:
+        self._proc = subprocess.Popen(
+            [sys.executable, "-I", "-c", _EXECUTOR_SRC, self.target_root],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            status = self._recv()
+        except (EOFError, ValueError):
+            status = {"ok": False, "error": "helper exited during startup"}
+        if not status.get("ok"):
+            logger.info("Chroot executor unavailable for %s (%s); using chroot binary", self.target_root, status.get("error"))
+            self.close()
+            self._unavailable = True
+            return False
+        logger.debug("Chroot executor started for %s (pid %d)", self.target_root, self._proc.pid)
+        return True
+
+    def usable(self) -> bool:
+        """Start the helper if needed; False if this root must use the chroot binary."""
+
+        with self._lock:
+            if self._unavailable:
+                return False
+            return self._proc is not None or self._start()
+
+    def run(
+        self, argv: Sequence[str], *, env: Mapping[str, str] | None = None, input_text: str | None = None
+    ) -> Optional[tuple[int, str, str, Optional[Dict[str, float]]]]:
+        """Run argv inside the root; returns (returncode, stdout, stderr, usage), or None if unavailable."""
+
+        with self._lock:
+            if self._unavailable:
+                return None
+            if self._proc is None and not self._start():
+                return None
+            assert self._proc is not None and self._proc.stdin is not None
+            data = json.dumps({"argv": list(argv), "env": dict(env or {}), "input": input_text}).encode("utf-8")
+            try:
+                self._proc.stdin.write(struct.pack(">I", len(data)) + data)
+                self._proc.stdin.flush()
+            except BrokenPipeError:
+                # Died while idle; the command was not sent, so a fresh helper can take it.
+                self.close()
+                if not self._start():
+                    return None
+                self._proc.stdin.write(struct.pack(">I", len(data)) + data)
+                self._proc.stdin.flush()
+            try:
+                resp = self._recv()
+            except (EOFError, ValueError) as e:
+                self.close()
+                raise RuntimeError(f"Chroot executor died while running: {' '.join(argv)}") from e
+            usage = resp.get("usage")
+            if usage is not None:
+                usage = {k: round(float(v), 6) if k != "max_rss_kb" else int(v) for k, v in usage.items()}
+            return int(resp["rc"]), str(resp["stdout"]), str(resp["stderr"]), usage
+
+    def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            if proc.stdin is not None:
+                proc.stdin.close()
+            proc.wait(timeout=5)
+        except Exception:
+            proc.kill()
+            proc.wait()
+        finally:
+            if proc.stdout is not None:
+                proc.stdout.close()
+
+
+def chroot_cmd(
+    target_root: str,
+    argv: Sequence[str],
+    *,
+    check: bool = True,
+    env: Mapping[str, str] | None = None,
+    input_text: str | None = None,
+    stream: bool = False,
+    apt_status: bool = False,
+    timeout: float | None = None,
+    stall_timeout: float | None = None,
+    stall_abort: bool = False,
+    dry_run: bool = False,
+) -> CmdResult:
+    """Run a command inside target root.
+
+    Inside an active ChrootSession the command goes through the session's
+    persistent executor; otherwise (or if it cannot chroot) via `chroot`.
+    Streaming and time-limited commands (see run_cmd) always use `chroot`.
+    """
+
+    full_argv = ["chroot", target_root, *argv]
+    if stream or apt_status or timeout or stall_timeout:
+        return run_cmd(
+            full_argv,
+            check=check,
+            env=env,
+            input_text=input_text,
+            stream=stream,
+            apt_status=apt_status,
+            timeout=timeout,
+            stall_timeout=stall_timeout,
+            stall_abort=stall_abort,
+            dry_run=dry_run,
+        )
+    executor = None if dry_run or _ACTIVE_SESSION is None else _ACTIVE_SESSION.executor(target_root)
+    if executor is not None and executor.usable():
+        cmd_id = log_cmd(full_argv)
+        started = time.time()
+        t0 = time.monotonic()
+        out = executor.run(argv, env=env, input_text=input_text)
+        if out is not None:
+            rc, stdout, stderr, usage = out
+            return complete_cmd(
+                full_argv,
+                rc,
+                stdout,
+                stderr,
+                check=check,
+                started=started,
+                wall_s=time.monotonic() - t0,
+                cmd_id=cmd_id,
+                usage=usage,
+            )
+        # Helper lost and could not be restarted; the command was not run, retry with the binary.
+        emit("cmd.end", id=cmd_id, returncode=None, wall_s=0.0, fallback=True)
+    return run_cmd(full_argv, check=check, env=env, input_text=input_text, dry_run=dry_run)
+
+
+def _unescape_mountinfo(field: str) -> str:
+    # mountinfo escapes space, tab, newline and backslash as octal (\040 etc.)
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+
+def current_mountpoints() -> set[str]:
+    """Mount points of this mount namespace (from /proc/self/mountinfo)."""
+
+    points: set[str] = set()
+    try:
+        for line in Path("/proc/self/mountinfo").read_text(encoding="utf-8").splitlines():
+            fields = line.split()
+            if len(fields) > 4:
+                points.add(_unescape_mountinfo(fields[4]))
+    except Exception:
+        pass
+    return points
+
+
+class ChrootSession:
+    """Bind mounts for a target root, established once and kept up across steps.
+
+    The pipeline owns one session (see main.run). While it is active,
+    mount_chroot_binds() becomes "ensure mounted" and umount_chroot_binds() is a
+    no-op, so steps keep their existing call pattern without paying for a
+    mount/umount cycle each time. ensure() re-checks /proc/self/mountinfo, so a
+    resumed run adopts mounts left behind by a crashed one and re-creates any
+    that went missing. close() unmounts everything in reverse order.
+
+    The session also owns one ChrootExecutor per root, used by chroot_cmd().
+    """
+
+    def __init__(self, *, dry_run: bool = False) -> None:
+        self.dry_run = dry_run
+        self._mounted: Dict[str, List[str]] = {}
+        self._executors: Dict[str, ChrootExecutor] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "ChrootSession":
+        global _ACTIVE_SESSION
+        if _ACTIVE_SESSION is not None and _ACTIVE_SESSION is not self:
+            raise RuntimeError("Another chroot session is already active")
+        _ACTIVE_SESSION = self
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        global _ACTIVE_SESSION
+        try:
+            self.close()
+        finally:
+            if _ACTIVE_SESSION is self:
+                _ACTIVE_SESSION = None
+
+    def ensure(self, target_root: str) -> None:
+        root = os.path.normpath(target_root)
+        with self._lock:
+            if self.dry_run:
+                if root in self._mounted:
+                    return
+                mounted_now: set[str] = set()
+            else:
+                mounted_now = current_mountpoints()
+
+            mounted = self._mounted.setdefault(root, [])
+            for src, rel in SESSION_BINDS:
+                dst = os.path.join(root, rel)
+                if dst in mounted_now:
+                    if dst not in mounted:
+                        logger.info("Adopting existing chroot mount %s", dst)
+                        mounted.append(dst)
+                    continue
+                if not self.dry_run:
+                    if not os.path.exists(src):
+                        continue
+                    os.makedirs(dst, exist_ok=True)
+                run_cmd(["mount", "--bind", src, dst], dry_run=self.dry_run)
+                if dst not in mounted:
+                    mounted.append(dst)
+
+    def executor(self, target_root: str) -> ChrootExecutor:
+        root = os.path.normpath(target_root)
+        with self._lock:
+            ex = self._executors.get(root)
+            if ex is None:
+                ex = self._executors[root] = ChrootExecutor(root)
+            return ex
+
+    def release(self, target_root: str) -> None:
+        root = os.path.normpath(target_root)
+        with self._lock:
+            # The executor's cwd is inside the root; stop it before unmounting.
+            ex = self._executors.pop(root, None)
+            if ex is not None:
+                ex.close()
+            mounted = self._mounted.pop(root, [])
+            for dst in reversed(mounted):
+                r = run_cmd(["umount", dst], check=False, dry_run=self.dry_run)
+                if r.returncode != 0:
+                    # Busy (e.g. a stray process in the chroot): fall back to a lazy unmount.
+                    run_cmd(["umount", "-lf", dst], check=False, dry_run=self.dry_run)
+
+    def close(self) -> None:
+        for root in set(self._mounted) | set(self._executors):
+            self.release(root)
+
+
+def active_session() -> Optional[ChrootSession]:
+    return _ACTIVE_SESSION
 
 
 def mount_chroot_binds(target_root: str, *, dry_run: bool = False) -> None:
+    if _ACTIVE_SESSION is not None:
+        _ACTIVE_SESSION.ensure(target_root)
+        return
+
     # Minimal bind mounts for apt, grub-install, initramfs tooling
     for src, dst in [
         ("/dev", f"{target_root}/dev"),
@@ -25,5 +370,18 @@ def mount_chroot_binds(target_root: str, *, dry_run: bool = False) -> None:
 
 
 def umount_chroot_binds(target_root: str, *, dry_run: bool = False) -> None:
+    if _ACTIVE_SESSION is not None:
+        # Session-owned mounts stay up until the session closes (or release_chroot_binds).
+        return
+
     for p in [f"{target_root}/sys", f"{target_root}/proc", f"{target_root}/dev"]:
         run_cmd(["umount", "-lf", p], check=False, dry_run=dry_run)
+
+
+def release_chroot_binds(target_root: str, *, dry_run: bool = False) -> None:
+    """Tear down bind mounts now, including session-owned ones (e.g. before unmounting the target)."""
+
+    if _ACTIVE_SESSION is not None:
+        _ACTIVE_SESSION.release(target_root)
+        return
+    umount_chroot_binds(target_root, dry_run=dry_run)
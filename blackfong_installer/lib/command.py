@@ -1,14 +1,53 @@
 from __future__ import annotations
 
+import asyncio
+import collections
+import functools
+import itertools
 import logging
 import os
+import selectors
 import shlex
+import signal
 import subprocess
+import threading
+import time
+from contextlib import AsyncExitStack, contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
-from typing import Iterable, Mapping, Sequence
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
+
+from .events import emit
 
 logger = logging.getLogger(__name__)
 
+# Per-context command ledger (see track_commands). Context-local so concurrently
+# running pipeline steps each see only their own commands.
+_LEDGER: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("blackfong_cmd_ledger", default=None)
+
+# Pairs cmd.start/cmd.end events.
+_CMD_IDS = itertools.count(1)
+
+# Streaming commands keep only this many trailing lines of each stream.
+STREAM_TAIL_LINES = 200
+_READ_SIZE = 64 * 1024
+# Longer lines (e.g. \r progress bars) are forwarded in pieces.
+_MAX_LINE = 16 * 1024
+
+# Streaming commands that print nothing for this long get a diagnostic warning
+# (unless the caller sets its own stall_timeout).
+STALL_WARN_S = 300.0
+# SIGTERM -> SIGKILL grace period when a command is aborted.
+_KILL_GRACE_S = 5.0
+
+# pid -> runs in its own process group; commands currently running (see terminate_running).
+_LIVE: Dict[int, bool] = {}
+_LIVE_LOCK = threading.Lock()
+
+
+class CommandTimeout(RuntimeError):
+    """A command ran past its timeout, or stalled with stall_abort set."""
+
 
 @dataclass(frozen=True)
 class CmdResult:
@@ -16,12 +55,46 @@ class CmdResult:
     returncode: int
     stdout: str
     stderr: str
+    # Streamed output lines not kept in stdout/stderr (only the tail is).
+    dropped_lines: int = 0
+    # Child rusage from wait4: user_s, sys_s, max_rss_kb (None in dry-run).
+    usage: Optional[Dict[str, float]] = None
+    # "timeout" or "stall" if the command was killed (only returned with check=False).
+    aborted: Optional[str] = None
 
 
 def _fmt_argv(argv: Sequence[str]) -> str:
     return " ".join(shlex.quote(a) for a in argv)
 
 
+def log_cmd(argv: Sequence[str], *, dry_run: bool = False) -> int:
+    """Log a command about to run and emit its cmd.start event; returns the id for complete_cmd."""
+
+    cmd = _fmt_argv(argv)
+    logger.info("CMD %s", cmd)
+    cmd_id = next(_CMD_IDS)
+    emit("cmd.start", id=cmd_id, cmd=cmd, dry_run=dry_run)
+    return cmd_id
+
+
+@contextmanager
+def track_commands() -> Iterator[List[Dict[str, Any]]]:
+    """Collect a ledger entry for every command executed in this context."""
+
+    ledger: List[Dict[str, Any]] = []
+    token = _LEDGER.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _LEDGER.reset(token)
+
+
+def _record(entry: Dict[str, Any]) -> None:
+    ledger = _LEDGER.get()
+    if ledger is not None:
+        ledger.append(entry)
+
+
 def run_cmd(
     argv: Sequence[str],
     *,
@@ -29,37 +102,623 @@ def run_cmd(
     env: Mapping[str, str] | None = None,
     cwd: str | None = None,
     input_text: str | None = None,
+    stream: bool = False,
+    apt_status: bool = False,
+    tail_lines: int = STREAM_TAIL_LINES,
+    timeout: float | None = None,
+    stall_timeout: float | None = None,
+    stall_abort: bool = False,
     dry_run: bool = False,
 ) -> CmdResult:
     """Run a command with consistent logging.
 
     - Always logs the command.
     - Captures stdout/stderr for state recording if desired.
+    - stream=True logs output line by line while the command runs and keeps
+      only the last tail_lines lines of each stream (memory stays flat).
+    - apt_status=True (implies stream) adds -o APT::Status-Fd=<fd> to an
+      apt-get command line and turns its status lines into apt.progress events.
+    - timeout kills the command (and its process group) after that many
+      seconds. stall_timeout logs the process tree when the command prints
+      nothing for that long (streaming commands default to STALL_WARN_S);
+      with stall_abort it is killed instead. A killed command raises
+      CommandTimeout (with check=False: result.aborted is set).
+    - Wall time and the child's rusage are recorded in the command ledger.
     - dry_run logs but does not execute.
     """
 
     argv_list = list(argv)
-    logger.info("CMD %s", _fmt_argv(argv_list))
+    stream = stream or apt_status
+    status_r = status_w = -1
+    if apt_status and not dry_run:
+        status_r, status_w = os.pipe()
+        argv_list += ["-o", f"APT::Status-Fd={status_w}"]
+    cmd_id = log_cmd(argv_list, dry_run=dry_run)
 
     if dry_run:
+        emit("cmd.end", id=cmd_id, returncode=0, wall_s=0.0, dry_run=True)
         return CmdResult(argv=argv_list, returncode=0, stdout="", stderr="")
 
-    p = subprocess.run(
+    if stall_timeout is None and stream:
+        stall_timeout = STALL_WARN_S
+
+    started = time.time()
+    t0 = time.monotonic()
+    out = _run_process(
         argv_list,
-        input=input_text,
-        text=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        env=env,
         cwd=cwd,
-        env=dict(os.environ, **(env or {})),
+        input_text=input_text,
+        stream=stream,
+        tail_lines=tail_lines,
+        status_fds=(status_r, status_w) if apt_status else None,
+        timeout=timeout,
+        stall_timeout=stall_timeout,
+        stall_abort=stall_abort,
+    )
+    return complete_cmd(
+        argv_list,
+        out.returncode,
+        out.stdout,
+        out.stderr,
+        check=check,
+        started=started,
+        wall_s=time.monotonic() - t0,
+        cmd_id=cmd_id,
+        dropped_lines=out.dropped,
+        streamed=stream,
+        usage=out.usage,
+        aborted=out.aborted,
     )
 
-    if p.stdout:
-        logger.debug("STDOUT %s", p.stdout.strip())
-    if p.stderr:
-        logger.debug("STDERR %s", p.stderr.strip())
 
-    if check and p.returncode != 0:
-        raise RuntimeError(f"Command failed ({p.returncode}): {_fmt_argv(argv_list)}\n{p.stderr}")
+class _LineTail:
+    """Split a byte stream into lines, hand each to on_line and keep the last few."""
+
+    def __init__(self, on_line: Callable[[str], None], maxlen: int) -> None:
+        self.on_line = on_line
+        self.tail: Deque[str] = collections.deque(maxlen=maxlen)
+        self.lines = 0
+        self._partial = b""
+
+    def _line(self, raw: bytes) -> None:
+        line = raw.decode("utf-8", "replace").rstrip("\r")
+        self.lines += 1
+        self.tail.append(line)
+        self.on_line(line)
+
+    def feed(self, data: bytes) -> None:
+        buf = self._partial + data
+        *lines, self._partial = buf.split(b"\n")
+        for raw in lines:
+            self._line(raw)
+        while len(self._partial) > _MAX_LINE:
+            self._line(self._partial[:_MAX_LINE])
+            self._partial = self._partial[_MAX_LINE:]
+
+    def close(self) -> None:
+        if self._partial:
+            self._line(self._partial)
+            self._partial = b""
+
+    def text(self) -> str:
+        return "\n".join(self.tail) + ("\n" if self.tail else "")
+
+    def last(self, n: int) -> List[str]:
+        return list(self.tail)[-n:]
+
+    @property
+    def dropped(self) -> int:
+        return self.lines - len(self.tail)
+
+
+class _Capture:
+    """Keep a stream whole (the non-streaming default; callers parse it)."""
+
+    dropped = 0
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def feed(self, data: bytes) -> None:
+        self._chunks.append(data)
+
+    def close(self) -> None:
+        pass
+
+    def text(self) -> str:
+        # Same newline handling as subprocess text mode.
+        text = b"".join(self._chunks).decode("utf-8", "replace")
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+    def last(self, n: int) -> List[str]:
+        return self.text().splitlines()[-n:]
+
+
+class AptStatusParser:
+    """Turn APT::Status-Fd lines into apt.progress events.
+
+    Lines look like "dlstatus:3:27.27:Retrieving file 3 of 11" (downloads) and
+    "pmstatus:libc6:amd64:41.6667:Unpacking libc6 (amd64)" (dpkg runs; the
+    package name may carry an :arch). Events are throttled to whole-percent
+    steps per phase; pmerror/pmconffile/media-change become log warnings.
+    """
+
+    PHASES = {"dlstatus": "download", "pmstatus": "install"}
+
+    def __init__(self) -> None:
+        self._last: Dict[str, int] = {}
+
+    def feed_line(self, line: str) -> None:
+        kind, _, rest = line.partition(":")
+        fields = rest.split(":")
+        # The percentage is the first numeric field after the item (file index or package).
+        for i in range(1, len(fields)):
+            try:
+                percent = float(fields[i])
+            except ValueError:
+                continue
+            item, message = ":".join(fields[:i]), ":".join(fields[i + 1 :])
+            break
+        else:
+            if line.strip():
+                logger.debug("Unparsed apt status line: %s", line)
+            return
+
+        phase = self.PHASES.get(kind)
+        if phase is None:
+            if kind in {"pmerror", "pmconffile", "media-change"}:
+                logger.warning("apt %s: %s %s", kind, item, message)
+            return
+        whole = int(percent)
+        if self._last.get(phase) == whole and whole < 100:
+            return
+        self._last[phase] = whole
+        emit("apt.progress", phase=phase, percent=round(percent, 2), item=item, message=message)
+
+
+def _prog_name(argv: Sequence[str]) -> str:
+    if len(argv) > 2 and os.path.basename(argv[0]) == "chroot":
+        argv = argv[2:]
+    return os.path.basename(argv[0]) if argv else "?"
+
+
+def _process_tree(pid: int) -> List[str]:
+    """'pid state wchan cmdline' for pid and its descendants (stall diagnostics)."""
+
+    parents: Dict[int, int] = {}
+    info: Dict[int, str] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = open(f"/proc/{entry}/stat", encoding="utf-8", errors="replace").read()
+        except OSError:
+            continue
+        # comm may contain spaces and parentheses; the fields after the last ")" are fixed.
+        fields = stat[stat.rfind(")") + 2 :].split()
+        parents[int(entry)] = int(fields[1])
+        info[int(entry)] = fields[0]
+
+    tree = [pid]
+    for p in tree:
+        tree.extend(c for c, pp in parents.items() if pp == p)
+
+    lines = []
+    for p in tree:
+        try:
+            wchan = open(f"/proc/{p}/wchan", encoding="utf-8").read().strip() or "-"
+            cmdline = open(f"/proc/{p}/cmdline", "rb").read().replace(b"\0", b" ").decode("utf-8", "replace")
+        except OSError:
+            continue
+        lines.append(f"{p} {info.get(p, '?')} {wchan} {cmdline.strip()[:200]}")
+    return lines
+
+
+@dataclass
+class _Outcome:
+    returncode: int
+    stdout: str
+    stderr: str
+    dropped: int
+    usage: Optional[Dict[str, float]]
+    aborted: Optional[str]
+
+
+def _signal_pid(pid: int, sig: int, group: bool) -> None:
+    try:
+        if group:
+            os.killpg(pid, sig)
+        else:
+            os.kill(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def _signal_tree(proc: subprocess.Popen, sig: int, group: bool) -> None:
+    _signal_pid(proc.pid, sig, group)
+
+
+def _track(pid: int, group: bool) -> None:
+    with _LIVE_LOCK:
+        _LIVE[pid] = group
+
+
+def _untrack(pid: int) -> None:
+    with _LIVE_LOCK:
+        _LIVE.pop(pid, None)
+
+
+def terminate_running(sig: int = signal.SIGTERM) -> int:
+    """Signal every command run_cmd/run_cmd_async still has running, from any thread.
+
+    Commands with their own session get the whole process group signalled.
+    Used when the pipeline is interrupted while steps run on worker threads
+    (their commands would otherwise outlive it). Returns how many were signalled.
+    """
+
+    with _LIVE_LOCK:
+        live = list(_LIVE.items())
+    for pid, group in live:
+        _signal_pid(pid, sig, group)
+    return len(live)
+
+
+def _reap(
+    proc: subprocess.Popen, deadline: Optional[float], *, group: bool
+) -> tuple[int, Optional[Any], bool]:
+    """wait4() the child; kill it if deadline passes first. Returns (status, rusage, killed)."""
+
+    killed = False
+    delay = 0.001
+    term_at: Optional[float] = None
+    while True:
+        pid, status, ru = os.wait4(proc.pid, os.WNOHANG if deadline is not None else 0)
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)  # reaped here, not by Popen
+            return status, ru, killed
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            if term_at is None:
+                _signal_tree(proc, signal.SIGTERM, group)
+                term_at = now
+                killed = True
+            elif now - term_at >= _KILL_GRACE_S:
+                _signal_tree(proc, signal.SIGKILL, group)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+def _run_process(
+    argv: List[str],
+    *,
+    env: Mapping[str, str] | None,
+    cwd: str | None,
+    input_text: str | None,
+    stream: bool,
+    tail_lines: int,
+    status_fds: Optional[tuple[int, int]],
+    timeout: float | None,
+    stall_timeout: float | None,
+    stall_abort: bool,
+    session: bool = False,
+    on_spawn: Optional[Callable[[int], None]] = None,
+) -> _Outcome:
+    """Run argv, pumping its output through one selector loop, and reap it with wait4.
+
+    Takes ownership of status_fds (the APT::Status-Fd pipe) and closes both ends.
+    Commands that may be killed (timeout/stall_abort, or session=True) get their
+    own session so the whole process tree (apt -> dpkg -> maintainer scripts) is
+    signalled. on_spawn(pid) is called once the child exists.
+    """
+
+    prog = _prog_name(argv)
+    group = bool(session or timeout or stall_abort)
+    try:
+        proc = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=dict(os.environ, **(env or {})),
+            pass_fds=(status_fds[1],) if status_fds else (),
+            start_new_session=group,
+        )
+    except BaseException:
+        if status_fds:
+            os.close(status_fds[0])
+        raise
+    finally:
+        if status_fds:
+            os.close(status_fds[1])  # the child holds its own copy of the write end
+
+    t0 = time.monotonic()
+    deadline = t0 + timeout if timeout else None
+
+    writer: Optional[threading.Thread] = None
+    if input_text is not None:
+
+        def _write_input() -> None:
+            assert proc.stdin is not None
+            try:
+                proc.stdin.write(input_text.encode("utf-8"))
+                proc.stdin.close()
+            except (BrokenPipeError, ValueError):
+                pass
+
+        writer = threading.Thread(target=_write_input, daemon=True)
+        writer.start()
+
+    out: Any
+    err: Any
+    if stream:
+        out = _LineTail(lambda line: logger.info("%s| %s", prog, line), tail_lines)
+        err = _LineTail(lambda line: logger.info("%s! %s", prog, line), tail_lines)
+    else:
+        out, err = _Capture(), _Capture()
+    sel = selectors.DefaultSelector()
+    assert proc.stdout is not None and proc.stderr is not None
+    sel.register(proc.stdout.fileno(), selectors.EVENT_READ, out)
+    sel.register(proc.stderr.fileno(), selectors.EVENT_READ, err)
+    if status_fds:
+        sel.register(status_fds[0], selectors.EVENT_READ, _LineTail(AptStatusParser().feed_line, 0))
+
+    aborted: Optional[str] = None
+    last_output = stall_mark = t0
+    _track(proc.pid, group)
+    if on_spawn is not None:
+        on_spawn(proc.pid)
+    try:
+        while sel.get_map():
+            now = time.monotonic()
+            waits = []
+            if deadline is not None:
+                waits.append(deadline - now)
+            if stall_timeout:
+                waits.append(max(last_output, stall_mark) + stall_timeout - now)
+            ready = sel.select(max(0.0, min(waits)) if waits else None)
+            for key, _ in ready:
+                data = os.read(key.fd, _READ_SIZE)
+                if data:
+                    key.data.feed(data)
+                else:
+                    sel.unregister(key.fd)
+                    key.data.close()
+            now = time.monotonic()
+            if ready:
+                last_output = now
+            if deadline is not None and now >= deadline:
+                logger.warning("Command timed out after %.1fs: %s", timeout, _fmt_argv(argv))
+                aborted = "timeout"
+                break
+            if stall_timeout and now - max(last_output, stall_mark) >= stall_timeout:
+                stall_mark = now
+                logger.warning(
+                    "Command silent for %.1fs: %s\nprocess tree (pid state wchan cmd):\n%s\nlast output:\n%s",
+                    now - last_output,
+                    _fmt_argv(argv),
+                    "\n".join(_process_tree(proc.pid)),
+                    "\n".join(out.last(5) + err.last(5)),
+                )
+                if stall_abort:
+                    aborted = "stall"
+                    break
+        _, ru, killed = _reap(proc, time.monotonic() if aborted else deadline, group=group)
+        if killed and aborted is None:
+            logger.warning("Command timed out after %.1fs (output closed): %s", timeout, _fmt_argv(argv))
+            aborted = "timeout"
+    except BaseException:
+        _signal_tree(proc, signal.SIGKILL, group)
+        proc.wait()
+        raise
+    finally:
+        _untrack(proc.pid)
+        sel.close()
+        proc.stdout.close()
+        proc.stderr.close()
+        if status_fds:
+            os.close(status_fds[0])
+        if writer is not None:
+            writer.join(timeout=_KILL_GRACE_S)
+
+    for sink in (out, err):
+        sink.close()
+    usage = {
+        "user_s": round(ru.ru_utime, 6),
+        "sys_s": round(ru.ru_stime, 6),
+        "max_rss_kb": ru.ru_maxrss,
+    }
+    return _Outcome(
+        returncode=proc.returncode,
+        stdout=out.text(),
+        stderr=err.text(),
+        dropped=out.dropped + err.dropped,
+        usage=usage,
+        aborted=aborted,
+    )
+
+
+def complete_cmd(
+    argv: Sequence[str],
+    returncode: int,
+    stdout: str,
+    stderr: str,
+    *,
+    check: bool,
+    started: float,
+    wall_s: float,
+    cmd_id: Optional[int] = None,
+    dropped_lines: int = 0,
+    streamed: bool = False,
+    usage: Optional[Dict[str, float]] = None,
+    aborted: Optional[str] = None,
+) -> CmdResult:
+    """Ledger, log and check a finished command (shared by run_cmd and other executors).
+
+    cmd_id is the value log_cmd returned when the command started; streamed
+    output was already logged line by line.
+    """
+
+    argv_list = list(argv)
+    emit("cmd.end", id=cmd_id, returncode=returncode, wall_s=round(wall_s, 6), aborted=aborted)
+    entry: Dict[str, Any] = {
+        "cmd": _fmt_argv(argv_list),
+        "returncode": returncode,
+        "start": started,
+        "wall_s": round(wall_s, 6),
+    }
+    if usage is not None:
+        entry.update(usage)
+    if aborted is not None:
+        entry["aborted"] = aborted
+    _record(entry)
+
+    if stdout and not streamed:
+        logger.debug("STDOUT %s", stdout.strip())
+    if stderr and not streamed:
+        logger.debug("STDERR %s", stderr.strip())
+
+    if check and aborted is not None:
+        raise CommandTimeout(f"Command killed ({aborted}): {_fmt_argv(argv_list)}\n{stderr}")
+    if check and returncode != 0:
+        raise RuntimeError(f"Command failed ({returncode}): {_fmt_argv(argv_list)}\n{stderr}")
+
+    return CmdResult(
+        argv=argv_list,
+        returncode=returncode,
+        stdout=stdout,
+        stderr=stderr,
+        dropped_lines=dropped_lines,
+        usage=usage,
+        aborted=aborted,
+    )
+
+
+# Default concurrency for run_cmds(): enough to overlap I/O-bound probes on small boards.
+ASYNC_JOBS = 4
+
+
+async def run_cmd_async(
+    argv: Sequence[str],
+    *,
+    check: bool = True,
+    env: Mapping[str, str] | None = None,
+    cwd: str | None = None,
+    input_text: str | None = None,
+    timeout: float | None = None,
+    limiter: asyncio.Semaphore | None = None,
+    dry_run: bool = False,
+) -> CmdResult:
+    """asyncio counterpart of run_cmd (same logging, ledger, events, dry-run and errors).
+
+    The command runs on an executor thread through the same path as run_cmd,
+    so it is reaped with wait4 and its rusage lands in the ledger. limiter
+    bounds how many commands run at once (see gather_cmds). On timeout or task
+    cancellation the command's whole process group is killed and reaped; a
+    timeout raises CommandTimeout, cancellation re-raises CancelledError.
+    """
+
+    argv_list = list(argv)
+    async with AsyncExitStack() as stack:
+        if limiter is not None:
+            await stack.enter_async_context(limiter)
+
+        cmd_id = log_cmd(argv_list, dry_run=dry_run)
+        if dry_run:
+            emit("cmd.end", id=cmd_id, returncode=0, wall_s=0.0, dry_run=True)
+            return CmdResult(argv=argv_list, returncode=0, stdout="", stderr="")
+
+        spawned: List[int] = []
+        cancelled = threading.Event()
+
+        def _on_spawn(pid: int) -> None:
+            spawned.append(pid)
+            if cancelled.is_set():
+                _signal_pid(pid, signal.SIGKILL, True)
+
+        started = time.time()
+        t0 = time.monotonic()
+        fut = asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                _run_process,
+                argv_list,
+                env=env,
+                cwd=cwd,
+                input_text=input_text,
+                stream=False,
+                tail_lines=0,
+                status_fds=None,
+                timeout=timeout,
+                stall_timeout=None,
+                stall_abort=False,
+                session=True,
+                on_spawn=_on_spawn,
+            ),
+        )
+        try:
+            out = await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            cancelled.set()
+            for pid in spawned:
+                _signal_pid(pid, signal.SIGKILL, True)
+            try:
+                killed = await asyncio.shield(fut)
+            except Exception:
+                killed = None
+            complete_cmd(
+                argv_list,
+                -signal.SIGKILL,
+                "",
+                "",
+                check=False,
+                started=started,
+                wall_s=time.monotonic() - t0,
+                cmd_id=cmd_id,
+                usage=killed.usage if killed is not None else None,
+                aborted="cancelled",
+            )
+            raise
+
+        return complete_cmd(
+            argv_list,
+            out.returncode,
+            out.stdout,
+            out.stderr,
+            check=check,
+            started=started,
+            wall_s=time.monotonic() - t0,
+            cmd_id=cmd_id,
+            usage=out.usage,
+            aborted=out.aborted,
+        )
+
+
+async def gather_cmds(
+    cmds: Iterable[Sequence[str]], *, jobs: int = ASYNC_JOBS, **kwargs: Any
+) -> List[CmdResult]:
+    """Run commands concurrently (at most `jobs` at a time); results in input order.
+
+    The first failure (with check=True) cancels, kills and reaps the rest before it propagates.
+    """
+
+    limiter = asyncio.Semaphore(max(1, jobs))
+    tasks = [asyncio.ensure_future(run_cmd_async(argv, limiter=limiter, **kwargs)) for argv in cmds]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def run_cmds(cmds: Iterable[Sequence[str]], *, jobs: int = ASYNC_JOBS, **kwargs: Any) -> List[CmdResult]:
+    """Blocking wrapper around gather_cmds for synchronous steps (runs its own event loop).
+
+    Commands run in the caller's context, so they land in the current step's
+    ledger and events.
+    """
 
-    return CmdResult(argv=argv_list, returncode=p.returncode, stdout=p.stdout, stderr=p.stderr)
+    return asyncio.run(gather_cmds(cmds, jobs=jobs, **kwargs))
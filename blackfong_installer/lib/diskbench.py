@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import logging
+import math
+import mmap
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+from .block import BlockDevice, existing_data
+from .storage import disk_problem
+
+logger = logging.getLogger(__name__)
+
+# Read-only disk micro-benchmark used to pick (or sanity-check) the target disk.
+#
+# Never writes: the device is opened O_RDONLY, with O_DIRECT by default so the
+# page cache neither helps nor gets polluted. Each phase stops at whichever of
+# its byte/op cap or time budget comes first, so a slow SD card costs about the
+# same wall time as an NVMe drive.
+
+SEQ_CHUNK = 1 << 20
+SEQ_BYTES = 256 << 20
+RAND_BLOCK = 4096
+RAND_OPS = 2048
+PHASE_BUDGET_S = 1.0
+_ALIGN = 4096
+
+
+@dataclass
+class BenchResult:
+    device: str
+    size: int = 0
+    direct: bool = True
+    seq_bytes: int = 0
+    seq_s: float = 0.0
+    rand_ops: int = 0
+    rand_s: float = 0.0
+    rand_lat_us: List[float] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def seq_mib_s(self) -> float:
+        return self.seq_bytes / (1 << 20) / self.seq_s if self.seq_s else 0.0
+
+    @property
+    def rand_iops(self) -> float:
+        return self.rand_ops / self.rand_s if self.rand_s else 0.0
+
+    def _pct(self, q: float) -> float:
+        if not self.rand_lat_us:
+            return 0.0
+        lat = sorted(self.rand_lat_us)
+        return lat[min(len(lat) - 1, int(q * len(lat)))]
+
+    def summary(self) -> Dict[str, Any]:
+        if self.error:
+            return {"device": self.device, "error": self.error}
+        return {
+            "device": self.device,
+            "direct": self.direct,
+            "seq_mib_s": round(self.seq_mib_s, 1),
+            "seq_bytes": self.seq_bytes,
+            "rand4k_iops": round(self.rand_iops, 1),
+            "rand4k_ops": self.rand_ops,
+            "rand4k_lat_p50_us": round(self._pct(0.50), 1),
+            "rand4k_lat_p99_us": round(self._pct(0.99), 1),
+            "score": round(score(self), 1),
+        }
+
+
+def score(result: BenchResult) -> float:
+    """Single figure of merit (higher is better).
+
+    A geometric blend weighted towards 4K random reads: package unpacking,
+    boot and application start-up are dominated by small random I/O, which is
+    exactly where SD cards and USB sticks fall apart.
+    """
+
+    if result.error or not result.rand_iops or not result.seq_mib_s:
+        return 0.0
+    return math.exp(0.6 * math.log(result.rand_iops) + 0.4 * math.log(result.seq_mib_s))
+
+
+def bench_device(
+    path: str,
+    *,
+    direct: bool = True,
+    seq_bytes: int = SEQ_BYTES,
+    rand_ops: int = RAND_OPS,
+    budget_s: float = PHASE_BUDGET_S,
+    seed: int = 0,
+) -> BenchResult:
+    """Measure sequential and 4K random read throughput/latency of a device or file.
+
+    direct=False reads through the page cache; only meant for file-backed
+    fixtures on filesystems without O_DIRECT (e.g. tmpfs).
+    """
+
+    res = BenchResult(device=path, direct=direct)
+    flags = os.O_RDONLY | getattr(os, "O_CLOEXEC", 0) | (os.O_DIRECT if direct else 0)
+    try:
+        fd = os.open(path, flags)
+    except OSError as e:
+        res.error = f"open: {e}"
+        return res
+    bufs: List[mmap.mmap] = []
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+        res.size = size
+        if size < RAND_BLOCK:
+            res.error = "device too small to benchmark"
+            return res
+
+        # Sequential: large reads from the start of the device.
+        # Anonymous mmaps are page-aligned, as O_DIRECT requires.
+        chunk = min(SEQ_CHUNK, seq_bytes, size) // _ALIGN * _ALIGN
+        limit = min(seq_bytes, size) // chunk * chunk
+        seq_buf = mmap.mmap(-1, chunk)
+        bufs.append(seq_buf)
+        off = 0
+        t0 = time.perf_counter()
+        deadline = t0 + budget_s
+        while off < limit and time.perf_counter() < deadline:
+            n = os.preadv(fd, [seq_buf], off)
+            if n <= 0:
+                break
+            off += n
+        res.seq_s = time.perf_counter() - t0
+        res.seq_bytes = off
+
+        # Random: aligned 4K reads spread over the whole device.
+        rng = random.Random(seed)
+        blocks = size // RAND_BLOCK
+        rand_buf = mmap.mmap(-1, RAND_BLOCK)
+        bufs.append(rand_buf)
+        lat: List[float] = []
+        t0 = time.perf_counter()
+        deadline = t0 + budget_s
+        while len(lat) < rand_ops:
+            start = time.perf_counter()
+            if start >= deadline:
+                break
+            os.preadv(fd, [rand_buf], rng.randrange(blocks) * RAND_BLOCK)
+            lat.append((time.perf_counter() - start) * 1e6)
+        res.rand_s = time.perf_counter() - t0
+        res.rand_ops = len(lat)
+        res.rand_lat_us = lat
+    except OSError as e:
+        res.error = f"read: {e}"
+    finally:
+        for b in bufs:
+            b.close()
+        os.close(fd)
+    return res
+
+
+def benchmark_disks(
+    disks: Sequence[BlockDevice], *, dev_dir: str = "/dev", direct: bool = True, **kw: Any
+) -> Dict[str, Dict[str, Any]]:
+    """bench_device for each disk, one at a time (disks may share a bus or hub).
+
+    Returns {disk name: BenchResult.summary()}. dev_dir points at device nodes
+    (or, for tests, a directory of file-backed fixtures named like the disks).
+    """
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for dev in disks:
+        r = bench_device(os.path.join(dev_dir, dev.name), direct=direct, **kw)
+        out[dev.name] = r.summary()
+        if r.error:
+            logger.warning("Disk benchmark %s failed: %s", dev.path, r.error)
+        else:
+            s = out[dev.name]
+            logger.info(
+                "Disk benchmark %s: seq %.1f MiB/s, 4K random %.0f IOPS (p50 %.0fus, p99 %.0fus)",
+                dev.path,
+                s["seq_mib_s"],
+                s["rand4k_iops"],
+                s["rand4k_lat_p50_us"],
+                s["rand4k_lat_p99_us"],
+            )
+    return out
+
+
+# Static preference when no benchmark is available: (transport, rotational) -> rank.
+def _static_rank(dev: BlockDevice) -> int:
+    if dev.transport == "nvme":
+        return 5
+    if dev.transport in {"sata", "scsi", "virtio"}:
+        return 2 if dev.rotational else 4
+    if dev.transport == "mmc":
+        return 3
+    return 1  # usb and unknown
+
+
+def recommend_target_disk(
+    disks: Sequence[BlockDevice],
+    bench: Optional[Mapping[str, Mapping[str, Any]]] = None,
+    *,
+    allow_existing: bool = False,
+    dev_dir: str = "/dev",
+) -> Dict[str, Any]:
+    """Rank usable disks and recommend one as the install target.
+
+    Disks that cannot be installed to (read-only, in use, too small) are listed
+    with the reason and never recommended. Neither are disks that already hold
+    partitions or a filesystem (a second OS, someone's data) unless
+    allow_existing (config.target_disk_auto_wipe) is set. With benchmark results
+    the score decides; without, a static transport ranking does. Removable disks
+    are ranked below fixed ones either way: they are usually the installer
+    medium or something the operator will unplug.
+    """
+
+    candidates: List[Dict[str, Any]] = []
+    for dev in disks:
+        entry: Dict[str, Any] = {"disk": dev.path, "size": dev.size, "transport": dev.transport}
+        problem = disk_problem(dev)
+        existing = None if problem else existing_data(dev, dev_dir=dev_dir)
+        if existing:
+            entry["existing"] = existing
+            if not allow_existing:
+                problem = f"holds existing data ({existing}); not selected automatically without target_disk_auto_wipe"
+        if problem:
+            entry["problem"] = problem
+        else:
+            b = (bench or {}).get(dev.name) or {}
+            entry["score"] = float(b.get("score") or 0.0) if bench else float(_static_rank(dev))
+            if dev.removable:
+                entry["score"] *= 0.5
+        candidates.append(entry)
+
+    usable = [c for c in candidates if "problem" not in c]
+    best = max(usable, key=lambda c: (c["score"], c["size"]), default=None)
+    if best is None:
+        reason = "no usable disk"
+    else:
+        reason = f"highest {'benchmark score' if bench else 'transport rank'} of {len(usable)} usable disk(s)"
+        if "existing" in best:
+            reason += f"; its existing data ({best['existing']}) will be wiped (target_disk_auto_wipe)"
+    return {
+        "disk": best["disk"] if best else None,
+        "basis": "benchmark" if bench else "static",
+        "reason": reason,
+        "candidates": candidates,
+    }
@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import collections
+import itertools
+import json
+import logging
+import os
+import selectors
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Structured progress events shared by the CLI and GUI frontends.
+#
+# Every event is a flat JSON object: {"seq", "ts", "type", "step"?, ...}.
+# Types emitted by the installer:
+#   pipeline.start / pipeline.end    steps, ran/skipped, ok
+#   step.start / step.end            step, ok, wall_s (step.skip for resumed steps)
+#   cmd.start / cmd.end              id, cmd, returncode, wall_s, aborted (timeout|stall)
+#   apt.progress                     phase (download|install), percent, item, message
+#   warning                          message, logger (WARNING+ log records)
+# "step" is filled in from the step context, so commands and warnings raised by
+# concurrently running steps are attributed correctly.
+
+Event = Dict[str, Any]
+Subscriber = Callable[[Event], None]
+
+_STEP: ContextVar[Optional[str]] = ContextVar("blackfong_event_step", default=None)
+
+
+class EventBus:
+    """In-process fan-out of events to subscribers.
+
+    emit() is cheap with no subscribers and never raises: a failing subscriber
+    is logged and skipped. The last `backlog` events are kept so late
+    subscribers (e.g. a GUI attaching mid-install) can catch up.
+    """
+
+    def __init__(self, *, backlog: int = 256) -> None:
+        self._subscribers: List[Subscriber] = []
+        self._recent: Deque[Event] = collections.deque(maxlen=backlog)
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def subscribe(self, fn: Subscriber, *, replay: bool = False) -> Callable[[], None]:
+        """Register fn; returns a function that unsubscribes it."""
+
+        with self._lock:
+            backlog = list(self._recent) if replay else []
+            self._subscribers = [*self._subscribers, fn]
+        for event in backlog:
+            fn(event)
+
+        def _unsubscribe() -> None:
+            with self._lock:
+                self._subscribers = [s for s in self._subscribers if s is not fn]
+
+        return _unsubscribe
+
+    def recent(self) -> List[Event]:
+        with self._lock:
+            return list(self._recent)
+
+    def emit(self, type_: str, **fields: Any) -> Event:
+        event: Event = {"seq": 0, "ts": round(time.time(), 6), "type": type_}
+        step = _STEP.get()
+        if step is not None:
+            event["step"] = step
+        event.update(fields)
+        with self._lock:
+            event["seq"] = next(self._seq)
+            self._recent.append(event)
+            subscribers = self._subscribers
+        for fn in subscribers:
+            try:
+                fn(event)
+            except Exception:
+                logger.debug("Event subscriber %r failed", fn, exc_info=True)
+        return event
+
+
+BUS = EventBus()
+
+
+def emit(type_: str, **fields: Any) -> Event:
+    return BUS.emit(type_, **fields)
+
+
+def subscribe(fn: Subscriber, *, replay: bool = False) -> Callable[[], None]:
+    return BUS.subscribe(fn, replay=replay)
+
+
+@contextmanager
+def step_context(step_id: str) -> Iterator[None]:
+    """Attribute events emitted in this context (thread/task) to step_id."""
+
+    token = _STEP.set(step_id)
+    try:
+        yield
+    finally:
+        _STEP.reset(token)
+
+
+class WarningForwarder(logging.Handler):
+    """Logging handler that turns WARNING+ records into `warning` events."""
+
+    def __init__(self, bus: EventBus = BUS) -> None:
+        super().__init__(level=logging.WARNING)
+        self.bus = bus
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.name == __name__:
+            return
+        try:
+            self.bus.emit("warning", level=record.levelname, logger=record.name, message=record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+
+def encode(event: Event) -> bytes:
+    return json.dumps(event, separators=(",", ":"), default=str).encode("utf-8") + b"\n"
+
+
+class _Client:
+    __slots__ = ("sock", "buf")
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.buf = bytearray()
+
+
+class EventSocketServer:
+    """Serve the bus as newline-delimited JSON on a Unix stream socket.
+
+    One background thread multiplexes all clients with non-blocking writes, so
+    a slow or stuck observer never stalls the installer: a client whose unsent
+    backlog passes max_buffer bytes is disconnected. New clients first receive
+    the bus backlog. Clients only read; anything they send is ignored.
+    """
+
+    def __init__(self, path: str, bus: EventBus = BUS, *, max_buffer: int = 1 << 20) -> None:
+        self.path = path
+        self.bus = bus
+        self.max_buffer = max_buffer
+        self._sel = selectors.DefaultSelector()
+        self._clients: Dict[int, _Client] = {}
+        self._lock = threading.Lock()
+        self._listener: Optional[socket.socket] = None
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._thread: Optional[threading.Thread] = None
+        self._unsubscribe: Optional[Callable[[], None]] = None
+        self._closing = False
+
+    def start(self) -> "EventSocketServer":
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        try:
+            os.unlink(self.path)  # stale socket from a previous run
+        except FileNotFoundError:
+            pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(8)
+        listener.setblocking(False)
+        self._listener = listener
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._sel.register(listener, selectors.EVENT_READ, "accept")
+        self._sel.register(self._wake_r, selectors.EVENT_READ, "wake")
+        self._unsubscribe = self.bus.subscribe(self._publish)
+        self._thread = threading.Thread(target=self._loop, name="event-socket", daemon=True)
+        self._thread.start()
+        logger.info("Event stream listening on %s", self.path)
+        return self
+
+    def __enter__(self) -> "EventSocketServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _wake(self) -> None:
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # a wakeup is already pending
+
+    def _publish(self, event: Event) -> None:
+        data = encode(event)
+        with self._lock:
+            if not self._clients:
+                return
+            for client in self._clients.values():
+                client.buf += data
+        self._wake()
+
+    def _drop(self, client: _Client) -> None:
+        fd = client.sock.fileno()
+        try:
+            self._sel.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+        self._clients.pop(fd, None)
+
+    def _accept(self) -> None:
+        assert self._listener is not None
+        try:
+            sock, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = _Client(sock)
+        with self._lock:
+            for event in self.bus.recent():
+                client.buf += encode(event)
+            self._clients[sock.fileno()] = client
+        self._sel.register(sock, selectors.EVENT_READ, client)
+
+    def _flush(self) -> None:
+        with self._lock:
+            for client in list(self._clients.values()):
+                if len(client.buf) > self.max_buffer:
+                    logger.info("Dropping slow event client (%d bytes behind)", len(client.buf))
+                    self._drop(client)
+                    continue
+                try:
+                    while client.buf:
+                        n = client.sock.send(client.buf)
+                        del client.buf[:n]
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    self._drop(client)
+                    continue
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.buf else 0)
+                self._sel.modify(client.sock, events, client)
+
+    def _loop(self) -> None:
+        while not self._closing:
+            for key, mask in self._sel.select(timeout=1.0):
+                if key.data == "accept":
+                    self._accept()
+                elif key.data == "wake":
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                elif mask & selectors.EVENT_READ:
+                    try:
+                        gone = not key.fileobj.recv(4096)  # type: ignore[union-attr]
+                    except BlockingIOError:
+                        gone = False
+                    except OSError:
+                        gone = True
+                    if gone:
+                        with self._lock:
+                            self._drop(key.data)
+            self._flush()
+
+    def close(self) -> None:
+        """Stop serving; pending events are flushed to clients that can take them."""
+
+        if self._thread is None:
+            return
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+        self._closing = True
+        self._wake()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self._flush()
+        with self._lock:
+            for client in list(self._clients.values()):
+                self._drop(client)
+        if self._listener is not None:
+            self._sel.unregister(self._listener)
+            self._listener.close()
+            self._listener = None
+        self._sel.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def follow_events(path: str, *, timeout: Optional[float] = None) -> Iterator[Event]:
+    """Read events from an EventSocketServer until the installer closes the stream."""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        with sock.makefile("rb") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
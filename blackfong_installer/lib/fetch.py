@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import hashlib
+import http.client
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import quote, urlsplit
+
+from .apt_index import PackageRecord, iter_stanzas, package_index
+from .net import is_online
+from .resolver import resolve
+
+logger = logging.getLogger(__name__)
+
+_CHUNK = 1 << 16
+
+
+def archive_name(rec: PackageRecord) -> str:
+    """File name apt expects in /var/cache/apt/archives (epoch ':' quoted as %3a)."""
+
+    version = rec.version.replace(":", "%3a")
+    arch = rec.architecture or "all"
+    return f"{rec.name}_{version}_{arch}.deb"
+
+
+def apt_list_prefix(mirror: str) -> str:
+    """Prefix apt gives var/lib/apt/lists files from a mirror URI (e.g. deb.debian.org_debian_)."""
+
+    parts = urlsplit(mirror)
+    return (parts.netloc + parts.path).strip("/").replace("/", "_") + "_"
+
+
+def installed_versions(target_root: str) -> Dict[str, str]:
+    """name -> version of packages dpkg reports installed in target_root."""
+
+    status = Path(target_root) / "var/lib/dpkg/status"
+    if not status.is_file():
+        return {}
+    out: Dict[str, str] = {}
+    with open(status, "rb") as fp:
+        for st in iter_stanzas(fp, ("Package", "Version", "Status")):
+            if st.get("Status", "").endswith(" installed") and st.get("Package") and st.get("Version"):
+                out[st["Package"]] = st["Version"]
+    return out
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass
+class FetchResult:
+    fetched: List[str] = field(default_factory=list)
+    cached: List[str] = field(default_factory=list)
+    failed: List[Tuple[str, str]] = field(default_factory=list)
+    bytes_fetched: int = 0
+    wall_s: float = 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "fetched": len(self.fetched),
+            "cached": len(self.cached),
+            "failed": [{"package": n, "error": e} for n, e in self.failed],
+            "bytes_fetched": self.bytes_fetched,
+            "wall_s": round(self.wall_s, 3),
+        }
+
+
+class _Connection:
+    """One keep-alive HTTP(S) connection, reopened after errors."""
+
+    def __init__(self, scheme: str, netloc: str, timeout: float) -> None:
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def _open(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            self._conn = cls(self.netloc, timeout=self.timeout)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get_to_file(self, path: str, dst: Path, *, expected_sha256: str) -> int:
+        """GET path into dst, verifying SHA256 while streaming. Returns bytes written."""
+
+        # One retry covers a keep-alive connection the server closed while idle.
+        for attempt in (1, 2):
+            conn = self._open()
+            try:
+                conn.request("GET", path, headers={"Connection": "keep-alive"})
+                resp = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+
+            if resp.status != 200:
+                resp.read()
+                if resp.will_close:
+                    self.close()
+                raise RuntimeError(f"HTTP {resp.status} for {path}")
+
+            h = hashlib.sha256()
+            n = 0
+            try:
+                with open(dst, "wb") as f:
+                    while True:
+                        chunk = resp.read(_CHUNK)
+                        if not chunk:
+                            break
+                        h.update(chunk)
+                        f.write(chunk)
+                        n += len(chunk)
+            except (http.client.HTTPException, OSError):
+                self.close()
+                raise
+            if resp.will_close:
+                self.close()
+            if expected_sha256 and h.hexdigest() != expected_sha256.lower():
+                raise RuntimeError(f"SHA256 mismatch for {path}")
+            return n
+        raise AssertionError("unreachable")
+
+
+def fetch_debs(
+    records: Iterable[PackageRecord],
+    *,
+    mirror: str,
+    archives_dir: str,
+    jobs: int = 8,
+    timeout: float = 60.0,
+    proxy: Optional[str] = None,
+) -> FetchResult:
+    """Download .debs from a mirror into an apt archives dir, in parallel.
+
+    Each worker keeps its own keep-alive connection to the mirror (or to the
+    HTTP proxy, when given, which is then sent absolute URLs). Files stream
+    into archives/partial/ and are renamed into place only after the SHA256
+    from the Packages index matches; already-present verified files are kept.
+    A failed package is reported, not raised (apt fetches whatever is missing).
+    """
+
+    started = time.monotonic()
+    result = FetchResult()
+    lock = threading.Lock()
+
+    archives = Path(archives_dir)
+    partial = archives / "partial"
+    partial.mkdir(parents=True, exist_ok=True)
+
+    base = urlsplit(mirror)
+    base_path = base.path.rstrip("/")
+    conn_to = base
+    if proxy:
+        conn_to = urlsplit(proxy)
+        base_path = mirror.rstrip("/")
+
+    work: "queue.Queue[PackageRecord]" = queue.Queue()
+    for rec in records:
+        if not rec.filename:
+            continue
+        dst = archives / archive_name(rec)
+        if dst.is_file() and dst.stat().st_size == rec.size and (not rec.sha256 or _sha256_file(dst) == rec.sha256):
+            result.cached.append(rec.name)
+            continue
+        work.put(rec)
+
+    def _worker() -> None:
+        conn = _Connection(conn_to.scheme, conn_to.netloc, timeout)
+        try:
+            while True:
+                try:
+                    rec = work.get_nowait()
+                except queue.Empty:
+                    return
+                tmp = partial / archive_name(rec)
+                try:
+                    n = conn.get_to_file(f"{base_path}/{quote(rec.filename)}", tmp, expected_sha256=rec.sha256)
+                    os.replace(tmp, archives / archive_name(rec))
+                    with lock:
+                        result.fetched.append(rec.name)
+                        result.bytes_fetched += n
+                except Exception as e:
+                    tmp.unlink(missing_ok=True)
+                    logger.warning("Prefetch of %s failed: %s", rec.name, e)
+                    with lock:
+                        result.failed.append((rec.name, str(e)))
+        finally:
+            conn.close()
+
+    threads = [
+        threading.Thread(target=_worker, name=f"fetch-{i}", daemon=True)
+        for i in range(max(1, min(jobs, work.qsize())))
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    result.wall_s = time.monotonic() - started
+    logger.info(
+        "Prefetched %d .debs (%.1f MiB) in %.1fs; %d cached, %d failed",
+        len(result.fetched),
+        result.bytes_fetched / (1 << 20),
+        result.wall_s,
+        len(result.cached),
+        len(result.failed),
+    )
+    return result
+
+
+def prefetch_for_install(
+    state: Dict[str, Any],
+    target_root: str,
+    packages: Sequence[str],
+    *,
+    with_recommends: bool = False,
+    dry_run: bool = False,
+) -> Optional[FetchResult]:
+    """Fill the target's apt archives from config.debian_mirror ahead of apt_install.
+
+    Only for install_source online/hybrid with network, and only when a package
+    index is available for the target. Resolves the closure of `packages`, keeps
+    what comes from the mirror and is not already installed, and fetches it with
+    config.apt_prefetch_jobs workers (0 disables). Appends a summary to
+    execution.prefetch.
+    """
+
+    cfg = state.get("config") or {}
+    jobs = int(cfg.get("apt_prefetch_jobs", 8) or 0)
+    if dry_run or jobs <= 0 or not packages:
+        return None
+    if str(cfg.get("install_source", "offline")) not in {"online", "hybrid"}:
+        return None
+    decisions = (state.get("execution") or {}).get("decisions") or {}
+    online = decisions.get("online")
+    if online is None:
+        online = is_online()
+    if not online:
+        return None
+
+    mirror = str(cfg.get("debian_mirror", "http://deb.debian.org/debian"))
+    prefix = apt_list_prefix(mirror)
+    with package_index(state) as index:
+        if index is None:
+            return None
+        res = resolve(index, packages, with_recommends=with_recommends)
+
+    installed = installed_versions(target_root)
+    wanted = [
+        rec
+        for name, rec in res.packages.items()
+        if os.path.basename(res.origins.get(name, "")).startswith(prefix) and installed.get(name) != rec.version
+    ]
+    result = fetch_debs(
+        wanted,
+        mirror=mirror,
+        archives_dir=str(Path(target_root) / "var/cache/apt/archives"),
+        jobs=jobs,
+        timeout=float(cfg.get("apt_prefetch_timeout_s", 60)),
+        proxy=decisions.get("apt_proxy"),
+    )
+    state.setdefault("execution", {}).setdefault("prefetch", []).append(result.summary())
+    return result
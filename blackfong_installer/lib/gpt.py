@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import logging
+import os
+import struct
+import uuid
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Minimal GPT writer/reader (UEFI spec 2.x, chapter 5): protective MBR, primary
+# and backup headers, and the partition entry arrays with their CRC32s.
+#
+# The whole table is written in one pass, to a block device or an image file,
+# replacing whatever was there (MBR, both GPT copies), like `sgdisk --zap-all`
+# followed by the individual --new calls.
+
+ESP_TYPE = "C12A7328-F81F-11D2-BA4B-00A0C93EC93B"
+LINUX_FS_TYPE = "0FC63DAF-8483-4772-8E79-3D69D8477DE4"
+LINUX_SWAP_TYPE = "0657FD6D-A4AB-43C4-84E5-0933C84B4F4F"
+
+NUM_ENTRIES = 128
+ENTRY_SIZE = 128
+
+_SIGNATURE = b"EFI PART"
+_REVISION = 0x00010000
+# signature, revision, header size, header crc, reserved, my lba, alternate lba,
+# first usable, last usable, disk guid, entries lba, entry count, entry size, entries crc
+_HEADER = struct.Struct("<8sIIIIQQQQ16sQIII")
+# type guid, unique guid, first lba, last lba (inclusive), attributes, UTF-16LE name
+_ENTRY = struct.Struct("<16s16sQQQ72s")
+# status, CHS first, type, CHS last, first LBA, sector count
+_MBR_ENTRY = struct.Struct("<B3sB3sII")
+
+
+class GptError(ValueError):
+    """Invalid layout, or not a (valid) GPT when reading."""
+
+
+@dataclass(frozen=True)
+class GptPartition:
+    number: int
+    name: str
+    type_guid: str
+    first_lba: int
+    last_lba: int  # inclusive
+    guid: str = ""
+    attributes: int = 0
+
+    def start(self, sector_size: int) -> int:
+        return self.first_lba * sector_size
+
+    def size(self, sector_size: int) -> int:
+        return (self.last_lba - self.first_lba + 1) * sector_size
+
+    def summary(self, sector_size: int) -> Dict[str, Any]:
+        return {
+            "number": self.number,
+            "name": self.name,
+            "type": self.type_guid,
+            "guid": self.guid,
+            "start": self.start(sector_size),
+            "size": self.size(sector_size),
+        }
+
+
+def _entry_sectors(sector_size: int) -> int:
+    return -(-NUM_ENTRIES * ENTRY_SIZE // sector_size)
+
+
+def usable_range(disk_bytes: int, sector_size: int) -> Tuple[int, int]:
+    """(first, last) usable LBA of a disk this size."""
+
+    last_lba = disk_bytes // sector_size - 1
+    n = _entry_sectors(sector_size)
+    return 2 + n, last_lba - n - 1
+
+
+def plan_partitions(
+    specs: Sequence[Tuple[str, str, Optional[int]]],
+    *,
+    disk_bytes: int,
+    sector_size: int = 512,
+    alignment: int = 1 << 20,
+) -> List[GptPartition]:
+    """Lay out (name, type GUID, size in bytes or None for "the rest") back to back.
+
+    Starts are aligned to `alignment`; sizes are rounded up to it, and the
+    final "rest" partition ends on an alignment boundary too.
+    """
+
+    if alignment % sector_size:
+        raise GptError(f"alignment {alignment} is not a multiple of the sector size {sector_size}")
+    first, last = usable_range(disk_bytes, sector_size)
+    step = alignment // sector_size
+    lba = -(-first // step) * step
+    parts: List[GptPartition] = []
+    for i, (name, type_guid, size) in enumerate(specs, start=1):
+        if size is None:
+            if i != len(specs):
+                raise GptError("only the last partition can take the rest of the disk")
+            end = (last + 1) // step * step - 1
+        else:
+            end = lba + -(-size // alignment) * step - 1
+        if end > last or end < lba:
+            raise GptError(f"partition {i} ({name}) does not fit on a {disk_bytes} byte disk")
+        parts.append(
+            GptPartition(number=i, name=name, type_guid=type_guid, first_lba=lba, last_lba=end, guid=str(uuid.uuid4()))
+        )
+        lba = end + 1
+    return parts
+
+
+def _protective_mbr(total_sectors: int, sector_size: int) -> bytes:
+    mbr = bytearray(sector_size)
+    mbr[446:462] = _MBR_ENTRY.pack(0, b"\x00\x02\x00", 0xEE, b"\xff\xff\xff", 1, min(total_sectors - 1, 0xFFFFFFFF))
+    mbr[510:512] = b"\x55\xaa"
+    return bytes(mbr)
+
+
+def _entries(parts: Sequence[GptPartition]) -> bytes:
+    table = bytearray(NUM_ENTRIES * ENTRY_SIZE)
+    for p in parts:
+        if not 1 <= p.number <= NUM_ENTRIES:
+            raise GptError(f"partition number {p.number} out of range")
+        name = p.name.encode("utf-16-le")
+        if len(name) > 72:
+            raise GptError(f"partition name too long: {p.name!r}")
+        off = (p.number - 1) * ENTRY_SIZE
+        _ENTRY.pack_into(
+            table,
+            off,
+            uuid.UUID(p.type_guid).bytes_le,
+            uuid.UUID(p.guid or str(uuid.uuid4())).bytes_le,
+            p.first_lba,
+            p.last_lba,
+            p.attributes,
+            name,
+        )
+    return bytes(table)
+
+
+def _header(
+    *, my_lba: int, alt_lba: int, first: int, last: int, disk_guid: bytes, entries_lba: int, entries_crc: int
+) -> bytes:
+    fields = [_SIGNATURE, _REVISION, _HEADER.size, 0, 0, my_lba, alt_lba, first, last, disk_guid, entries_lba]
+    fields += [NUM_ENTRIES, ENTRY_SIZE, entries_crc]
+    crc = zlib.crc32(_HEADER.pack(*fields))
+    fields[3] = crc
+    return _HEADER.pack(*fields)
+
+
+def device_size(path: str) -> int:
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+
+
+def write_gpt(
+    path: str, parts: Sequence[GptPartition], *, sector_size: int = 512, disk_guid: Optional[str] = None
+) -> str:
+    """Write a complete GPT (protective MBR, both headers and entry arrays) to a device or image file.
+
+    Returns the disk GUID. The target is flushed (fsync) before returning.
+    """
+
+    fd = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+    try:
+        disk_bytes = os.lseek(fd, 0, os.SEEK_END)
+        total = disk_bytes // sector_size
+        first, last = usable_range(disk_bytes, sector_size)
+        for p in parts:
+            if p.first_lba < first or p.last_lba > last or p.first_lba > p.last_lba:
+                raise GptError(f"partition {p.number} ({p.first_lba}-{p.last_lba}) outside usable LBAs {first}-{last}")
+        spans = sorted((p.first_lba, p.last_lba) for p in parts)
+        for (_, a_end), (b_start, _) in zip(spans, spans[1:]):
+            if b_start <= a_end:
+                raise GptError("partitions overlap")
+
+        guid = uuid.UUID(disk_guid) if disk_guid else uuid.uuid4()
+        entries = _entries(parts)
+        entries_crc = zlib.crc32(entries)
+        n = _entry_sectors(sector_size)
+        entries_padded = entries.ljust(n * sector_size, b"\0")
+        backup_entries_lba = total - 1 - n
+
+        common = dict(first=first, last=last, disk_guid=guid.bytes_le, entries_crc=entries_crc)
+        primary = _header(my_lba=1, alt_lba=total - 1, entries_lba=2, **common)
+        backup = _header(my_lba=total - 1, alt_lba=1, entries_lba=backup_entries_lba, **common)
+        head = _protective_mbr(total, sector_size) + primary.ljust(sector_size, b"\0") + entries_padded
+        tail = entries_padded + backup.ljust(sector_size, b"\0")
+        os.pwrite(fd, head, 0)
+        os.pwrite(fd, tail, backup_entries_lba * sector_size)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    logger.info("Wrote GPT to %s: %d partition(s), disk guid %s", path, len(parts), guid)
+    return str(guid)
+
+
+def read_gpt(path: str, *, sector_size: int = 512) -> List[GptPartition]:
+    """Partitions from the primary GPT of a device or image (CRCs verified)."""
+
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        hdr = os.pread(fd, _HEADER.size, sector_size)
+        if len(hdr) < _HEADER.size:
+            raise GptError(f"{path}: too small for a GPT")
+        fields = list(_HEADER.unpack(hdr))
+        if fields[0] != _SIGNATURE:
+            raise GptError(f"{path}: no GPT signature")
+        crc = fields[3]
+        fields[3] = 0
+        if zlib.crc32(_HEADER.pack(*fields)) != crc:
+            raise GptError(f"{path}: GPT header CRC mismatch")
+        entries_lba, count, size, entries_crc = fields[10], fields[11], fields[12], fields[13]
+        table = os.pread(fd, count * size, entries_lba * sector_size)
+    finally:
+        os.close(fd)
+    if zlib.crc32(table) != entries_crc:
+        raise GptError(f"{path}: GPT entries CRC mismatch")
+
+    parts: List[GptPartition] = []
+    for i in range(count):
+        type_b, guid_b, first, last, attrs, name = _ENTRY.unpack_from(table, i * size)
+        if type_b == bytes(16):
+            continue
+        parts.append(
+            GptPartition(
+                number=i + 1,
+                name=name.decode("utf-16-le").rstrip("\0"),
+                type_guid=str(uuid.UUID(bytes_le=type_b)).upper(),
+                first_lba=first,
+                last_lba=last,
+                guid=str(uuid.UUID(bytes_le=guid_b)),
+                attributes=attrs,
+            )
+        )
+    return parts
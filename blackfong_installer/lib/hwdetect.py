@@ -1,15 +1,39 @@
 from __future__ import annotations
 
+import contextvars
+import hashlib
+import json
 import logging
+import os
 import platform
+import re
+import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from .command import run_cmd
+from .block import inventory_disks
 from .firmware import detect_firmware
+from .pci import enumerate_pci, pci_ids
 
 logger = logging.getLogger(__name__)
 
+# Deadline for sysfs/procfs probes (they normally take microseconds).
+SYSFS_PROBE_DEADLINE_S = 5.0
+# Bump when the detect_hardware() result schema changes (invalidates cached results).
+HW_CACHE_VERSION = 4
+
+# Non-PCI GPUs are identified by their DRM driver.
+_PLATFORM_GPU_DRIVERS = {
+    "vc4": "broadcom",
+    "v3d": "broadcom",
+    "panfrost": "arm",
+    "lima": "arm",
+    "msm": "qualcomm",
+    "etnaviv": "vivante",
+}
+
 _GPU_VENDOR_MAP = {
     "0x8086": "intel",
     "0x1002": "amd",
@@ -144,93 +168,218 @@ def _detect_camera() -> Dict[str, Any]:
     }
 
 
-def _detect_gpu(*, dry_run: bool) -> Dict[str, Any]:
-    """Best-effort GPU detection with a stable, actionable schema."""
+def _detect_pci() -> List[Dict[str, Any]]:
+    """Every PCI function from sysfs, named from the pci.ids index when available."""
+
+    ids = pci_ids()
+    return [d.to_dict(ids) for d in enumerate_pci()]
+
+
+def _platform_drm_cards() -> List[Dict[str, Any]]:
+    """DRM cards without a PCI parent (SoC GPUs/display engines on ARM boards)."""
+
+    out: List[Dict[str, Any]] = []
+    drm = Path("/sys/class/drm")
+    cards = sorted(p for p in drm.glob("card*") if re.fullmatch(r"card\d+", p.name)) if drm.exists() else []
+    for card in cards:
+        dev = card / "device"
+        if (dev / "vendor").exists() and (dev / "class").exists():
+            continue  # PCI device: reported by _detect_pci
+        driver_link = dev / "driver"
+        driver = driver_link.resolve().name if driver_link.exists() else None
+        out.append({"card": card.name, "driver": driver})
+    return out
+
+
+def _gpu_entry(dev: Dict[str, Any]) -> Dict[str, Any]:
+    vendor_id = str(dev.get("vendor_id") or "")
+    return {
+        "bus": "pci",
+        "slot": dev.get("slot"),
+        "vendor": _GPU_VENDOR_MAP.get(vendor_id.lower(), "unknown"),
+        "vendor_id": vendor_id,
+        "device_id": dev.get("device_id"),
+        "name": dev.get("device_name"),
+        "driver": dev.get("driver"),
+        "drm_nodes": dev.get("drm_nodes") or [],
+        "boot_vga": bool(dev.get("boot_vga", False)),
+    }
+
+
+def _summarize_gpus(
+    pci: List[Dict[str, Any]], platform_cards: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Build hardware.gpus (every GPU) and the legacy single-GPU hardware.gpu summary.
+
+    The summary describes the primary GPU (the boot VGA device, else the first
+    one found) and keeps the schema older consumers read.
+    """
+
+    gpus = [_gpu_entry(d) for d in pci if str(d.get("class") or "").startswith("0x03")]
+    for card in platform_cards:
+        driver = card.get("driver")
+        gpus.append(
+            {
+                "bus": "platform",
+                "vendor": _PLATFORM_GPU_DRIVERS.get(str(driver), "unknown"),
+                "driver": driver,
+                "drm_nodes": [card["card"]],
+            }
+        )
 
+    primary = next((g for g in gpus if g.get("boot_vga")), gpus[0] if gpus else None)
     gpu: Dict[str, Any] = {
-        "present": False,
-        "vendor": "unknown",
-        "vendor_id": None,
-        "driver": None,
+        "present": bool(gpus),
+        "count": len(gpus),
+        "vendor": primary["vendor"] if primary else "unknown",
+        "vendor_id": primary.get("vendor_id") if primary else None,
+        "driver": primary.get("driver") if primary else None,
+        "vendors": sorted({g["vendor"] for g in gpus}),
         "render_node_present": Path("/dev/dri/renderD128").exists(),
-        "raw": {},
     }
+    return gpus, gpu
 
-    # Preferred path: /sys/class/drm (works on most modern kernels, including ARM).
-    drm = Path("/sys/class/drm")
-    cards = sorted([p for p in drm.glob("card[0-9]*") if p.is_dir()]) if drm.exists() else []
-    gpu["raw"]["drm_cards"] = [c.name for c in cards]
-    if cards:
-        gpu["present"] = True
-        dev = cards[0] / "device"
-        vendor_id = None
-        try:
-            vendor_id = (dev / "vendor").read_text(encoding="utf-8").strip()
-        except Exception:
-            vendor_id = None
-        if vendor_id:
-            gpu["vendor_id"] = vendor_id
-            gpu["vendor"] = _GPU_VENDOR_MAP.get(vendor_id.lower(), "unknown")
-
-        # driver: /sys/class/drm/card0/device/driver -> .../drivers/amdgpu
-        try:
-            driver_link = dev / "driver"
-            if driver_link.exists():
-                gpu["driver"] = driver_link.resolve().name
-        except Exception:
-            pass
-
-    # Optional enrichment on amd64: lspci can provide vendor strings.
-    if platform.system().lower() == "linux":
-        try:
-            r = run_cmd(["lspci", "-nn"], check=False, dry_run=dry_run)
-            if r.stdout:
-                lines = [ln for ln in r.stdout.splitlines() if any(x in ln.lower() for x in ("vga", "3d", "display"))]
-                if lines:
-                    gpu["raw"]["lspci_display"] = lines
-                    gpu["present"] = True
-        except Exception:
-            pass
-
-    return gpu
-
-
-def detect_hardware(dry_run: bool = False, *, forced_profile: Optional[str] = None) -> Dict[str, Any]:
-    machine = platform.machine()
-    arch = normalize_arch(machine)
 
-    hw: Dict[str, Any] = {
+def _ram_mb() -> Optional[int]:
+    for line in Path("/proc/meminfo").read_text(encoding="utf-8").splitlines():
+        if line.startswith("MemTotal:"):
+            return int(line.split()[1]) // 1024
+    return None
+
+
+@dataclass(frozen=True)
+class Probe:
+    name: str
+    fn: Callable[[], Any]
+    deadline_s: float = SYSFS_PROBE_DEADLINE_S
+
+
+def run_probes(probes: List[Probe]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """Run probes concurrently, each against its own deadline.
+
+    Returns (results, status): results only holds probes that finished in time
+    without raising; status has {ok, wall_s, error?, timed_out?} for every probe.
+    Probe threads are daemons, so one stuck in an uninterruptible read cannot
+    block the installer (command probes also kill their command at the deadline).
+    """
+
+    t0 = time.monotonic()
+    pending: List[Tuple[Probe, threading.Event, Dict[str, Any]]] = []
+    for probe in probes:
+        done = threading.Event()
+        box: Dict[str, Any] = {}
+
+        def _target(probe: Probe = probe, done: threading.Event = done, box: Dict[str, Any] = box) -> None:
+            started = time.monotonic()
+            try:
+                box["value"] = probe.fn()
+            except Exception as e:
+                box["error"] = f"{type(e).__name__}: {e}"
+            box["wall_s"] = round(time.monotonic() - started, 6)
+            done.set()
+
+        # Run in a copy of this context so probe commands land in the current step's ledger.
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(_target,), name=f"probe-{probe.name}", daemon=True).start()
+        pending.append((probe, done, box))
+
+    results: Dict[str, Any] = {}
+    status: Dict[str, Dict[str, Any]] = {}
+    for probe, done, box in pending:
+        if not done.wait(max(0.0, t0 + probe.deadline_s - time.monotonic())):
+            logger.warning("Hardware probe %s missed its %.1fs deadline; continuing without it", probe.name, probe.deadline_s)
+            status[probe.name] = {"ok": False, "timed_out": True, "wall_s": probe.deadline_s}
+            continue
+        if "error" in box:
+            logger.warning("Hardware probe %s failed: %s", probe.name, box["error"])
+            status[probe.name] = {"ok": False, "error": box["error"], "wall_s": box["wall_s"]}
+            continue
+        results[probe.name] = box["value"]
+        status[probe.name] = {"ok": True, "wall_s": box["wall_s"]}
+    return results, status
+
+
+def hardware_fingerprint(arch: str) -> str:
+    """Stable hash of the machine's hardware topology, from cheap sysfs reads only.
+
+    Covers kernel release, DMI and device-tree identity, PCI devices
+    (vendor/device/class/driver), block devices with their partitions and
+    sizes, DRM cards and V4L2 nodes: everything detect_hardware reports.
+    """
+
+    dmi = Path("/sys/class/dmi/id")
+    block: List[str] = []
+    for dev in sorted(Path("/sys/block").glob("*")):
+        parts = sorted(p.name for p in dev.glob(f"{dev.name}*"))
+        block.append(":".join([dev.name, _read_text(dev / "size") or "", _read_text(dev / "removable") or "", *parts]))
+        block += [f"{p}:{_read_text(dev / p / 'size') or ''}" for p in parts]
+    pci = [
+        f"{d.slot}:{d.vendor_id:04x}:{d.device_id:04x}:{d.class_code:06x}:{d.driver or ''}:{','.join(d.drm_nodes)}"
+        for d in enumerate_pci()
+    ]
+
+    signals = {
+        "version": HW_CACHE_VERSION,
         "arch": arch,
-        "cpu_model": platform.processor() or "unknown",
-        "firmware": detect_firmware(),
+        "kernel": platform.release(),
+        "dmi": {a: _read_text(dmi / a) for a in ("sys_vendor", "product_name", "product_version", "board_name")},
+        "dt_model": _read_text(Path("/sys/firmware/devicetree/base/model")),
+        "dt_compatible": _read_text(Path("/sys/firmware/devicetree/base/compatible")),
+        "efi": Path("/sys/firmware/efi").exists(),
+        "mem_kb": (os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")) // 1024,
+        "pci": pci,
+        "block": block,
+        "drm": sorted(p.name for p in Path("/sys/class/drm").glob("*")),
+        "v4l": sorted(p.name for p in Path("/sys/class/video4linux").glob("*")),
+        "render_node": Path("/dev/dri/renderD128").exists(),
     }
+    return hashlib.sha256(json.dumps(signals, sort_keys=True).encode("utf-8")).hexdigest()
 
-    # RAM (best-effort)
-    try:
-        mem_kb = 0
-        for line in Path("/proc/meminfo").read_text(encoding="utf-8").splitlines():
-            if line.startswith("MemTotal:"):
-                mem_kb = int(line.split()[1])
-                break
-        if mem_kb:
-            hw["ram_mb"] = mem_kb // 1024
-    except Exception:
-        pass
 
-    # GPU + camera signals that materially affect what we install/enable.
-    hw["gpu"] = _detect_gpu(dry_run=dry_run)
-    hw["camera"] = _detect_camera()
+def _load_cached(cache_dir: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    try:
+        data = json.loads((Path(cache_dir) / f"{fingerprint}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
 
-    # Identity signals: used by profile rule engine.
-    hw["identity"] = _detect_identity()
 
-    # Disks (best-effort)
+def _save_cached(cache_dir: str, fingerprint: str, hw: Dict[str, Any]) -> None:
     try:
-        r = run_cmd(["lsblk", "-J", "-o", "NAME,SIZE,TYPE,RM,TRAN"], check=True, dry_run=dry_run)
-        hw["lsblk_json"] = r.stdout  # raw for support/repro
-    except Exception:
-        # keep going
-        pass
+        d = Path(cache_dir)
+        d.mkdir(parents=True, exist_ok=True)
+        tmp = d / f".{fingerprint}.json.tmp"
+        tmp.write_text(json.dumps(hw, sort_keys=True) + "\n", encoding="utf-8")
+        os.replace(tmp, d / f"{fingerprint}.json")
+    except OSError as e:
+        logger.info("Not caching hardware detection in %s: %s", cache_dir, e)
+
+
+def detect_hardware(
+    dry_run: bool = False, *, forced_profile: Optional[str] = None, cache_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """Probe the machine (concurrently, each probe with a deadline) and pick a profile.
+
+    With cache_dir, a complete result is stored under the hardware fingerprint
+    and reused while the fingerprint matches. hw["probes"] records per-probe
+    status; a failed or late probe leaves its keys out (partial result, never cached).
+    """
+
+    machine = platform.machine()
+    arch = normalize_arch(machine)
+    fingerprint = hardware_fingerprint(arch)
+
+    hw: Optional[Dict[str, Any]] = _load_cached(cache_dir, fingerprint) if cache_dir else None
+    if hw is not None:
+        hw["cache"] = "hit"
+        logger.info("Hardware detection cache hit (%s)", fingerprint[:12])
+    else:
+        hw = _probe_hardware(arch)
+        hw["fingerprint"] = fingerprint
+        complete = all(st["ok"] for st in hw["probes"].values())
+        if cache_dir and complete and not dry_run:
+            _save_cached(cache_dir, fingerprint, hw)
+        hw["cache"] = "miss" if cache_dir else "off"
 
     profile, why = _pick_profile(hw, forced_profile=forced_profile)
     hw["profile"] = profile
@@ -238,3 +387,32 @@ def detect_hardware(dry_run: bool = False, *, forced_profile: Optional[str] = No
 
     logger.info("Hardware: arch=%s firmware=%s profile=%s", hw.get("arch"), hw.get("firmware"), hw.get("profile"))
     return hw
+
+
+def _probe_hardware(arch: str) -> Dict[str, Any]:
+    results, status = run_probes(
+        [
+            Probe("firmware", detect_firmware),
+            Probe("ram_mb", _ram_mb),
+            # GPU + camera signals that materially affect what we install/enable.
+            Probe("pci", _detect_pci),
+            Probe("drm_platform", _platform_drm_cards),
+            Probe("camera", _detect_camera),
+            # Identity signals: used by profile rule engine.
+            Probe("identity", _detect_identity),
+            Probe("disks", lambda: [d.to_dict() for d in inventory_disks()]),
+        ]
+    )
+
+    hw: Dict[str, Any] = {
+        "arch": arch,
+        "cpu_model": platform.processor() or "unknown",
+        "probes": status,
+    }
+    for key in ("firmware", "ram_mb", "pci", "camera", "identity", "disks"):
+        if results.get(key) is not None:
+            hw[key] = results[key]
+
+    if "pci" in results or "drm_platform" in results:
+        hw["gpus"], hw["gpu"] = _summarize_gpus(results.get("pci") or [], results.get("drm_platform") or [])
+    return hw
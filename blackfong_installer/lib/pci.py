@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import functools
+import gzip
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# PCI enumeration straight from sysfs (no lspci subprocess), with names from an
+# indexed copy of the pci.ids database.
+
+SYSFS_PCI_DEVICES = "/sys/bus/pci/devices"
+PCI_IDS_PATHS = (
+    "/usr/share/misc/pci.ids",
+    "/usr/share/hwdata/pci.ids",
+    "/usr/share/pci.ids",
+    "/usr/share/misc/pci.ids.gz",
+)
+DEFAULT_CACHE_DIR = "/var/cache/blackfong-installer/pci-ids"
+SIDECAR_NAME = "pci.ids.bfidx"
+
+# PCI base class 0x03: display controllers (VGA, XGA, 3D, other).
+DISPLAY_CLASS = 0x03
+
+_MAGIC = b"BFPCIID1"
+# magic, key (sha256), then (count, table off) for vendors/devices/classes/subclasses, blob off
+_HEADER = struct.Struct("<8s32s" + "IQ" * 4 + "Q")
+# numeric key, name off, name len (offsets relative to blob)
+_ENTRY = struct.Struct("<III")
+
+_VENDOR, _DEVICE, _CLASS, _SUBCLASS = range(4)
+
+
+# ---------------------------------------------------------------------------
+# pci.ids index
+# ---------------------------------------------------------------------------
+
+
+def _open_ids(path: str) -> IO[bytes]:
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def find_pci_ids(paths: Sequence[str] = PCI_IDS_PATHS) -> Optional[str]:
+    for p in paths:
+        if os.path.isfile(p):
+            return p
+    return None
+
+
+def iter_pci_ids(fp: IO[bytes]) -> Iterator[Tuple[int, int, str]]:
+    """Yield (table, key, name) from a pci.ids file.
+
+    Only vendor, device, class and subclass names are kept; subsystem and
+    prog-if lines are skipped.
+    """
+
+    vendor: Optional[int] = None
+    cls: Optional[int] = None
+    for raw in fp:
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+        if not line or line.startswith("#"):
+            continue
+        try:
+            if line.startswith("C "):
+                cls, vendor = int(line[2:4], 16), None
+                yield _CLASS, cls, line[4:].strip()
+            elif not line.startswith("\t"):
+                vendor, cls = int(line[:4], 16), None
+                yield _VENDOR, vendor, line[4:].strip()
+            elif line.startswith("\t\t"):
+                continue
+            elif vendor is not None:
+                yield _DEVICE, (vendor << 16) | int(line[1:5], 16), line[5:].strip()
+            elif cls is not None:
+                yield _SUBCLASS, (cls << 8) | int(line[1:3], 16), line[3:].strip()
+        except ValueError:
+            continue  # malformed line; pci.ids is hand-maintained
+
+
+def cache_key(ids_path: str) -> bytes:
+    h = hashlib.sha256()
+    with open(ids_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+def build_cache(ids_path: str, out_path: str, *, key: Optional[bytes] = None) -> None:
+    """Parse pci.ids and write the compact index (atomically)."""
+
+    key = key or cache_key(ids_path)
+    tables: List[Dict[int, str]] = [{}, {}, {}, {}]
+    with _open_ids(ids_path) as fp:
+        for table, k, name in iter_pci_ids(fp):
+            tables[table].setdefault(k, name)
+
+    blob = bytearray()
+    packed: List[bytes] = []
+    for items in tables:
+        out = bytearray()
+        for k in sorted(items):
+            nb = items[k].encode("utf-8")
+            out += _ENTRY.pack(k, len(blob), len(nb))
+            blob.extend(nb)
+        packed.append(bytes(out))
+
+    layout: List[int] = []
+    off = _HEADER.size
+    for items, table in zip(tables, packed):
+        layout += [len(items), off]
+        off += len(table)
+    header = _HEADER.pack(_MAGIC, key, *layout, off)
+
+    out = Path(out_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".bfpci-", dir=str(out.parent))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            for table in packed:
+                f.write(table)
+            f.write(blob)
+        os.replace(tmp, out)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    logger.info("Indexed %s: %d vendors, %d devices -> %s", ids_path, len(tables[_VENDOR]), len(tables[_DEVICE]), out)
+
+
+class PciIds:
+    """Read-only, memory-mapped view of an indexed pci.ids.
+
+    Lookups binary-search fixed-width tables of numeric keys, so opening is
+    constant time and only the pages actually touched are read.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            fields = _HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            fields = (b"",)
+        if fields[0] != _MAGIC:
+            self._mm.close()
+            raise ValueError(f"Not a pci.ids index: {path}")
+        self.key = fields[1]
+        self._tables = [(fields[2 + 2 * i], fields[3 + 2 * i]) for i in range(4)]
+        self._blob_off = fields[10]
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def _lookup(self, table: int, key: int) -> Optional[str]:
+        count, off = self._tables[table]
+        mm = self._mm
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, name_off, name_len = _ENTRY.unpack_from(mm, off + mid * _ENTRY.size)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                start = self._blob_off + name_off
+                return mm[start : start + name_len].decode("utf-8")
+        return None
+
+    def vendor(self, vendor_id: int) -> Optional[str]:
+        return self._lookup(_VENDOR, vendor_id)
+
+    def device(self, vendor_id: int, device_id: int) -> Optional[str]:
+        return self._lookup(_DEVICE, (vendor_id << 16) | device_id)
+
+    def device_class(self, class_code: int) -> Optional[str]:
+        """Name for a 24-bit class code: the subclass name, else the base class name."""
+
+        return self._lookup(_SUBCLASS, class_code >> 8) or self._lookup(_CLASS, class_code >> 16)
+
+
+def open_pci_ids(ids_path: str, *, cache_dir: str = DEFAULT_CACHE_DIR) -> PciIds:
+    """Open the index for a pci.ids file, building it on first use.
+
+    A prebuilt sidecar next to pci.ids (e.g. on read-only live media) is used
+    before the cache directory. Stale indexes are detected by key and rebuilt.
+    """
+
+    key = cache_key(ids_path)
+    sidecar = Path(ids_path).with_name(SIDECAR_NAME)
+    cached = Path(cache_dir) / f"{key.hex()}.bfidx"
+    for candidate in (sidecar, cached):
+        if candidate.is_file():
+            try:
+                ids = PciIds(str(candidate))
+            except (ValueError, OSError):
+                continue
+            if ids.key == key:
+                return ids
+            ids.close()
+
+    build_cache(ids_path, str(cached), key=key)
+    return PciIds(str(cached))
+
+
+@functools.lru_cache(maxsize=1)
+def pci_ids() -> Optional[PciIds]:
+    """The system pci.ids index, opened on first use; None when unavailable (names are optional)."""
+
+    path = find_pci_ids()
+    if path is None:
+        logger.info("No pci.ids database found; PCI devices will be reported by id only")
+        return None
+    try:
+        return open_pci_ids(path)
+    except (OSError, ValueError) as e:
+        logger.info("Cannot index %s: %s", path, e)
+        return None
+
+
+# ---------------------------------------------------------------------------
+# sysfs enumeration
+# ---------------------------------------------------------------------------
+
+_DRM_CARD = re.compile(r"card\d+")
+_DRM_RENDER = re.compile(r"renderD\d+")
+
+
+def _read_hex(path: Path) -> Optional[int]:
+    try:
+        return int(path.read_text(encoding="ascii").strip(), 16)
+    except (OSError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class PciDevice:
+    slot: str
+    class_code: int
+    vendor_id: int
+    device_id: int
+    subsystem_vendor_id: Optional[int] = None
+    subsystem_device_id: Optional[int] = None
+    driver: Optional[str] = None
+    drm_nodes: Tuple[str, ...] = ()
+    boot_vga: bool = False
+
+    @property
+    def is_display(self) -> bool:
+        return self.class_code >> 16 == DISPLAY_CLASS
+
+    def to_dict(self, ids: Optional[PciIds] = None) -> Dict[str, Any]:
+        d: Dict[str, Any] = {
+            "slot": self.slot,
+            "class": f"0x{self.class_code:06x}",
+            "vendor_id": f"0x{self.vendor_id:04x}",
+            "device_id": f"0x{self.device_id:04x}",
+            "driver": self.driver,
+            "drm_nodes": list(self.drm_nodes),
+        }
+        if self.subsystem_vendor_id is not None:
+            d["subsystem_id"] = f"0x{self.subsystem_vendor_id:04x}:0x{self.subsystem_device_id or 0:04x}"
+        if self.is_display:
+            d["boot_vga"] = self.boot_vga
+        if ids is not None:
+            d["vendor_name"] = ids.vendor(self.vendor_id)
+            d["device_name"] = ids.device(self.vendor_id, self.device_id)
+            d["class_name"] = ids.device_class(self.class_code)
+        return d
+
+
+def read_pci_device(dev: Path) -> Optional[PciDevice]:
+    vendor_id = _read_hex(dev / "vendor")
+    device_id = _read_hex(dev / "device")
+    class_code = _read_hex(dev / "class")
+    if vendor_id is None or device_id is None or class_code is None:
+        return None
+    driver = dev / "driver"
+    drm = dev / "drm"
+    nodes: List[str] = []
+    if drm.is_dir():
+        nodes = sorted(p.name for p in drm.iterdir() if _DRM_CARD.fullmatch(p.name) or _DRM_RENDER.fullmatch(p.name))
+    return PciDevice(
+        slot=dev.name,
+        class_code=class_code,
+        vendor_id=vendor_id,
+        device_id=device_id,
+        subsystem_vendor_id=_read_hex(dev / "subsystem_vendor"),
+        subsystem_device_id=_read_hex(dev / "subsystem_device"),
+        driver=driver.resolve().name if driver.exists() else None,
+        drm_nodes=tuple(nodes),
+        boot_vga=_read_hex(dev / "boot_vga") == 1,
+    )
+
+
+def enumerate_pci(root: str = SYSFS_PCI_DEVICES) -> List[PciDevice]:
+    """Every PCI function the kernel knows about, in slot order (empty without a PCI bus)."""
+
+    base = Path(root)
+    if not base.is_dir():
+        return []
+    out: List[PciDevice] = []
+    for dev in sorted(base.iterdir()):
+        d = read_pci_device(dev)
+        if d is not None:
+            out.append(d)
+    return out
@@ -1,32 +1,105 @@
 from __future__ import annotations
 
 import logging
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, Sequence
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
 
+from .apt_index import PackageIndex
+from .bootstrap_cache import cached_debootstrap
 from .chroot import chroot_cmd
 from .command import run_cmd
 
 logger = logging.getLogger(__name__)
 
 
+APT_TRANSACTION_MODES = {"per_step", "single"}
+
+
+@dataclass(frozen=True)
+class PackageSet:
+    """Packages a step wants installed.
+
+    optional: packages are skipped (not fatal) when the configured repos lack them.
+    """
+
+    source: str
+    packages: tuple[str, ...]
+    optional: bool = False
+    with_recommends: bool = False
+
+
+def split_by_recommends(plan: Sequence[PackageSet]) -> List[Tuple[bool, List[PackageSet]]]:
+    """[(False, sets without Recommends), (True, sets with)], skipping empty groups.
+
+    Each group is one apt transaction, so merging steps never changes which
+    packages get --no-install-recommends.
+    """
+
+    groups = [(flag, [ps for ps in plan if ps.with_recommends == flag]) for flag in (False, True)]
+    return [(flag, sets) for flag, sets in groups if sets]
+
+
+def apt_transaction_mode(cfg: Mapping[str, Any]) -> str:
+    """Return config.apt_transaction: per_step (default) or single.
+
+    single: one apt-get update + one install for every step's packages (step
+    45_install_packages); the other steps then only configure the installed root.
+    """
+
+    mode = str(cfg.get("apt_transaction", "per_step")).strip().lower()
+    if mode not in APT_TRANSACTION_MODES:
+        raise RuntimeError(f"config.apt_transaction must be one of {sorted(APT_TRANSACTION_MODES)}, got {mode}")
+    return mode
+
+
 def debootstrap_rootfs(
     *,
     target_root: str,
     suite: str = "stable",
     mirror: str = "http://deb.debian.org/debian",
     arch: str | None = None,
+    variant: str | None = None,
+    include: Sequence[str] = (),
+    env: Mapping[str, str] | None = None,
+    cache_dir: str | None = None,
     dry_run: bool = False,
-) -> None:
+) -> str:
+    """Bootstrap a Debian root, through the tarball cache when cache_dir is set.
+
+    Returns "hit"/"miss" for the cache, or "uncached".
+    """
+
     argv = ["debootstrap"]
     if arch:
         argv += ["--arch", arch]
+    if variant:
+        argv.append(f"--variant={variant}")
+    if include:
+        argv.append("--include=" + ",".join(include))
     argv += [suite, target_root, mirror]
-    run_cmd(argv, dry_run=dry_run)
+
+    def _run() -> None:
+        run_cmd(argv, env=env, stream=True, dry_run=dry_run)
+
+    if not cache_dir or not arch or dry_run:
+        _run()
+        return "uncached"
+    return cached_debootstrap(
+        cache_dir=cache_dir,
+        target_root=target_root,
+        suite=suite,
+        arch=arch,
+        mirror=mirror,
+        variant=variant,
+        include=include,
+        proxy=(env or {}).get("http_proxy"),
+        run_debootstrap=_run,
+    )
 
 
 def apt_update(target_root: str, *, dry_run: bool = False) -> None:
-    chroot_cmd(target_root, ["apt-get", "update"], dry_run=dry_run)
+    chroot_cmd(target_root, ["apt-get", "update"], apt_status=True, dry_run=dry_run)
 
 
 def apt_install(
@@ -48,20 +121,135 @@ def apt_install(
     chroot_cmd(
         target_root,
         [*argv, *packages],
+        apt_status=True,
         dry_run=dry_run,
     )
 
 
+@dataclass(frozen=True)
+class PackageInfo:
+    """apt's view of one package name (from `apt-cache policy`)."""
+
+    name: str
+    available: bool
+    candidate: Optional[str] = None
+    source: Optional[str] = None
+
+
+def parse_apt_policy(text: str) -> Dict[str, PackageInfo]:
+    """Parse `apt-cache policy <pkg>...` output.
+
+    Names apt does not know at all are simply absent from the output. Purely
+    virtual names show "Candidate: (none)" and are reported unavailable.
+    """
+
+    out: Dict[str, PackageInfo] = {}
+    name: Optional[str] = None
+    candidate: Optional[str] = None
+    source: Optional[str] = None
+    in_candidate_row = False
+
+    def _flush() -> None:
+        if name is not None:
+            out[name] = PackageInfo(name=name, available=candidate is not None, candidate=candidate, source=source)
+
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if not line.startswith(" ") and line.endswith(":"):
+            _flush()
+            name, candidate, source, in_candidate_row = line[:-1], None, None, False
+            continue
+        if name is None:
+            continue
+        stripped = line.strip()
+        if stripped.startswith("Candidate:"):
+            value = stripped.split(":", 1)[1].strip()
+            candidate = None if value == "(none)" else value
+            continue
+        if stripped.startswith(("Installed:", "Version table:")):
+            continue
+        fields = stripped.split()
+        if stripped.startswith("***"):
+            fields = fields[1:]
+        if len(fields) == 2 and fields[1].lstrip("-").isdigit():
+            # Version row: "<version> <priority>"
+            in_candidate_row = candidate is not None and fields[0] == candidate
+            continue
+        if in_candidate_row and len(fields) >= 2:
+            # Origin row: "<priority> <uri> [<suite/component> <arch> Packages]".
+            # Prefer a repository over the dpkg status file (installed copy).
+            origin = " ".join(fields[1:])
+            if source is None or source == "/var/lib/dpkg/status":
+                source = origin
+    _flush()
+    return out
+
+
+def apt_package_info(
+    target_root: str,
+    packages: Iterable[str],
+    *,
+    index: Optional[PackageIndex] = None,
+    dry_run: bool = False,
+) -> Dict[str, PackageInfo]:
+    """Availability, candidate version and origin for many packages in one apt-cache call.
+
+    With an index (see apt_index.package_index) the answer comes from the parsed
+    Packages cache in-process, without chroot or apt-cache.
+
+    dry_run still answers from real apt metadata, read-only and without chroot:
+    the target's apt state if it has package lists, else the host's.
+    """
+
+    names = list(dict.fromkeys(p for p in packages if p))
+    if not names:
+        return {}
+
+    if index is not None:
+        out: Dict[str, PackageInfo] = {}
+        for n in names:
+            hit = index.candidate(n)
+            out[n] = (
+                PackageInfo(name=n, available=True, candidate=hit[0].version, source=hit[1].label)
+                if hit
+                else PackageInfo(name=n, available=False)
+            )
+        return out
+
+    if not dry_run:
+        r = chroot_cmd(target_root, ["apt-cache", "policy", *names], check=False)
+    else:
+        argv = ["apt-cache"]
+        lists_dir = Path(target_root) / "var/lib/apt/lists"
+        if lists_dir.is_dir() and any(lists_dir.glob("*_Packages*")):
+            argv += [
+                "-o",
+                f"Dir={target_root}",
+                "-o",
+                f"Dir::State::status={target_root}/var/lib/dpkg/status",
+            ]
+        try:
+            r = run_cmd([*argv, "policy", *names], check=False)
+        except OSError as e:
+            # No apt on this host (e.g. developing on a non-Debian machine): stay permissive.
+            logger.warning("apt-cache unavailable for dry-run lookup (%s); assuming packages exist", e)
+            return {n: PackageInfo(name=n, available=True) for n in names}
+
+    if r.returncode != 0:
+        raise RuntimeError(f"apt-cache policy failed ({r.returncode}): {r.stderr.strip()}")
+
+    parsed = parse_apt_policy(r.stdout)
+    return {n: parsed.get(n) or PackageInfo(name=n, available=False) for n in names}
+
+
 def apt_has_package(target_root: str, package: str, *, dry_run: bool = False) -> bool:
-    """Return True if apt knows about a package name in the target root.
+    """Return True if apt has an installable candidate for a package name in the target root.
 
     This is useful for optional packages that may only exist in some repos.
+    Prefer apt_package_info() for more than one name.
     """
-    if dry_run:
-        # Be permissive in dry-run so planning doesn't fail.
-        return True
-    r = run_cmd(["chroot", target_root, "apt-cache", "show", package], check=False)
-    return r.returncode == 0
+    return apt_package_info(target_root, [package], dry_run=dry_run)[package].available
 
 
 def write_sources_list_offline(
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from .apt_index import PackageIndex, PackageRecord, parse_provides, version_compare
+from .manifests import load_profile
+from .pkg import PackageSet, split_by_recommends
+
+logger = logging.getLogger(__name__)
+
+_OPS = {
+    "<<": lambda c: c < 0,
+    "<=": lambda c: c <= 0,
+    "=": lambda c: c == 0,
+    ">=": lambda c: c >= 0,
+    ">>": lambda c: c > 0,
+    # Obsolete spellings still accepted by dpkg.
+    "<": lambda c: c <= 0,
+    ">": lambda c: c >= 0,
+}
+
+_DEP_RE = re.compile(r"^([^\s(:\[<]+)(?::\S+)?\s*(?:\(\s*(<<|<=|>=|>>|=|<|>)\s*([^)\s]+)\s*\))?")
+
+
+@dataclass(frozen=True)
+class Dep:
+    name: str
+    op: Optional[str] = None
+    version: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.op} {self.version})" if self.op else self.name
+
+
+def parse_relations(value: str) -> List[List[Dep]]:
+    """Parse a Depends-style field into AND-of-OR groups."""
+
+    groups: List[List[Dep]] = []
+    for clause in value.split(","):
+        alts: List[Dep] = []
+        for alt in clause.split("|"):
+            m = _DEP_RE.match(alt.strip())
+            if m:
+                alts.append(Dep(m.group(1), m.group(2), m.group(3)))
+        if alts:
+            groups.append(alts)
+    return groups
+
+
+def version_satisfies(version: str, op: Optional[str], required: Optional[str]) -> bool:
+    if op is None or required is None:
+        return True
+    return _OPS[op](version_compare(version, required))
+
+
+@dataclass(frozen=True)
+class Gap:
+    """A requirement the index cannot satisfy."""
+
+    requirement: str
+    required_by: str
+    kind: str  # "missing" | "version"
+
+
+@dataclass
+class Resolution:
+    packages: Dict[str, PackageRecord] = field(default_factory=dict)
+    # package name -> label of the Packages index it was taken from
+    origins: Dict[str, str] = field(default_factory=dict)
+    gaps: List[Gap] = field(default_factory=list)
+    missing_optional: List[str] = field(default_factory=list)
+
+    @property
+    def download_bytes(self) -> int:
+        return sum(r.size for r in self.packages.values())
+
+    @property
+    def installed_bytes(self) -> int:
+        return sum(r.installed_size_kb for r in self.packages.values()) * 1024
+
+    def merge(self, other: "Resolution") -> "Resolution":
+        """Fold another resolution (e.g. a second apt transaction) into this one."""
+
+        for name, rec in other.packages.items():
+            if name not in self.packages:
+                self.packages[name] = rec
+                self.origins[name] = other.origins.get(name, "")
+        self.gaps += [g for g in other.gaps if g not in self.gaps]
+        self.missing_optional += [p for p in other.missing_optional if p not in self.missing_optional]
+        return self
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON-friendly report (state / build reports)."""
+
+        return {
+            "packages": len(self.packages),
+            "download_bytes": self.download_bytes,
+            "installed_bytes": self.installed_bytes,
+            "gaps": [{"requirement": g.requirement, "required_by": g.required_by, "kind": g.kind} for g in self.gaps],
+            "missing_optional": list(self.missing_optional),
+        }
+
+
+class _Resolver:
+    def __init__(self, index: PackageIndex, *, with_recommends: bool) -> None:
+        self.index = index
+        self.with_recommends = with_recommends
+        self.res = Resolution()
+        # virtual name -> selected providers (with provided version)
+        self._provided: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+        self._queue: List[PackageRecord] = []
+
+    def _satisfied(self, dep: Dep) -> bool:
+        rec = self.res.packages.get(dep.name)
+        if rec is not None and version_satisfies(rec.version, dep.op, dep.version):
+            return True
+        for _, pver in self._provided.get(dep.name, ()):
+            if dep.op is None or (pver is not None and version_satisfies(pver, dep.op, dep.version)):
+                return True
+        return False
+
+    def _select(self, rec: PackageRecord, origin: str) -> None:
+        self.res.packages[rec.name] = rec
+        self.res.origins[rec.name] = origin
+        for name, pver in parse_provides(rec.provides):
+            self._provided.setdefault(name, []).append((rec.name, pver))
+        self._queue.append(rec)
+
+    def _candidate(self, dep: Dep) -> Optional[Tuple[PackageRecord, str]]:
+        for rec, cache in self.index.versions(dep.name):
+            if version_satisfies(rec.version, dep.op, dep.version):
+                return rec, cache.label
+        for provider, pver in self.index.providers(dep.name):
+            if dep.op is not None and (pver is None or not version_satisfies(pver, dep.op, dep.version)):
+                continue
+            if provider in self.res.packages:
+                return self.res.packages[provider], self.res.origins[provider]
+            hit = self.index.candidate(provider)
+            if hit is not None:
+                return hit[0], hit[1].label
+        return None
+
+    def require(self, alts: Sequence[Dep], required_by: str) -> bool:
+        if any(self._satisfied(d) for d in alts):
+            return True
+        for dep in alts:
+            hit = self._candidate(dep)
+            if hit is None:
+                continue
+            rec, origin = hit
+            if rec.name in self.res.packages:
+                if self.res.packages[rec.name] == rec:
+                    return True
+                continue
+            self._select(rec, origin)
+            return True
+        kind = "version" if any(d.name in self.res.packages for d in alts) else "missing"
+        self.res.gaps.append(Gap(" | ".join(str(d) for d in alts), required_by, kind))
+        return False
+
+    def run(self, required: Iterable[str], optional: Iterable[str]) -> Resolution:
+        for name in required:
+            self.require([Dep(name)], "(requested)")
+        for name in optional:
+            if self._satisfied(Dep(name)):
+                continue
+            hit = self._candidate(Dep(name))
+            if hit is None:
+                self.res.missing_optional.append(name)
+            elif hit[0].name not in self.res.packages:
+                self._select(*hit)
+
+        while self._queue:
+            rec = self._queue.pop()
+            for value in (rec.pre_depends, rec.depends):
+                for alts in parse_relations(value):
+                    self.require(alts, rec.name)
+            if self.with_recommends:
+                for alts in parse_relations(rec.recommends):
+                    # apt skips recommends it cannot satisfy; so do we (no gap).
+                    if not any(self._satisfied(d) for d in alts):
+                        for dep in alts:
+                            hit = self._candidate(dep)
+                            if hit is not None and hit[0].name not in self.res.packages:
+                                self._select(*hit)
+                                break
+        return self.res
+
+
+def resolve(
+    index: PackageIndex,
+    required: Iterable[str],
+    optional: Iterable[str] = (),
+    *,
+    with_recommends: bool = False,
+) -> Resolution:
+    """Transitive Depends/Pre-Depends closure (optionally Recommends) against an index.
+
+    Alternatives are tried in order, virtual names resolve through Provides, and
+    the newest version satisfying each constraint is chosen (no pinning). Missing
+    optional roots are listed separately; anything else unsatisfiable is a gap.
+    """
+
+    return _Resolver(index, with_recommends=with_recommends).run(list(required), list(optional))
+
+
+def resolve_plan(index: PackageIndex, plan: Sequence[PackageSet]) -> Resolution:
+    """resolve() an install plan the way it is installed: one closure per apt transaction.
+
+    Sets installed with --no-install-recommends and those with Recommends are
+    resolved separately (see split_by_recommends) and merged.
+    """
+
+    res = Resolution()
+    for with_recommends, sets in split_by_recommends(plan):
+        res.merge(
+            resolve(
+                index,
+                [p for ps in sets if not ps.optional for p in ps.packages],
+                [p for ps in sets if ps.optional for p in ps.packages],
+                with_recommends=with_recommends,
+            )
+        )
+    return res
+
+
+def list_profiles() -> List[Mapping[str, Any]]:
+    profiles_dir = Path(__file__).resolve().parents[2] / "manifests" / "profiles"
+    return [load_profile(p.stem) for p in sorted(profiles_dir.glob("*.yaml"))]
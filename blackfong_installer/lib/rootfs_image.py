@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+from .command import run_cmd
+
+logger = logging.getLogger(__name__)
+
+
+INSTALL_MODES = {"packages", "image"}
+
+# Golden images are <profile>.ext4.zst (or a raw <profile>.ext4) plus a <profile>.json manifest.
+IMAGE_SUFFIXES = (".ext4.zst", ".ext4")
+
+# live-boot mounts the installer medium at /run/live/medium; images sit next to /live on the ISO.
+DEFAULT_IMAGE_DIRS = ("/run/live/medium/images", "/opt/blackfong/images")
+
+
+def install_mode(state: Mapping[str, Any]) -> str:
+    """Effective install mode: packages (debootstrap + apt, default) or image.
+
+    image: 20_partition_fs lays a prebuilt per-profile root filesystem onto the
+    root partition; package steps then only install what the image lacks
+    (hardware-gated features) and the host-specific steps run as usual.
+    The decision recorded by 20_partition_fs wins over config.install_mode
+    (it falls back to packages when no usable image exists).
+    """
+
+    decided = ((state.get("execution") or {}).get("decisions") or {}).get("install_mode")
+    mode = str(decided or (state.get("config") or {}).get("install_mode", "packages")).strip().lower()
+    if mode not in INSTALL_MODES:
+        raise RuntimeError(f"config.install_mode must be one of {sorted(INSTALL_MODES)}, got {mode}")
+    return mode
+
+
+def image_stem(path: str) -> str:
+    name = os.path.basename(path)
+    for suffix in IMAGE_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def read_image_manifest(image: str) -> Dict[str, Any]:
+    """The <profile>.json written next to an image by build_root_image ({} if absent)."""
+
+    p = Path(image).parent / f"{image_stem(image)}.json"
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def find_root_image(cfg: Mapping[str, Any], profile_id: str) -> Optional[str]:
+    """Locate the golden image for a profile.
+
+    config.golden_image_path wins; otherwise config.golden_image_dirs (default
+    DEFAULT_IMAGE_DIRS) are searched for <profile>.ext4.zst / <profile>.ext4.
+    """
+
+    explicit = cfg.get("golden_image_path")
+    if explicit:
+        return str(explicit) if Path(str(explicit)).is_file() else None
+
+    for d in cfg.get("golden_image_dirs") or DEFAULT_IMAGE_DIRS:
+        for suffix in IMAGE_SUFFIXES:
+            p = Path(str(d)) / f"{profile_id}{suffix}"
+            if p.is_file():
+                return str(p)
+    return None
+
+
+def prepare_rootfs_for_image(rootfs: str, *, dry_run: bool = False) -> None:
+    """Strip per-machine identity and caches from a rootfs before imaging it.
+
+    machine-id is left empty (systemd generates one on first boot) and SSH host
+    keys are removed (50_configure_services regenerates them per install).
+    """
+
+    root = Path(rootfs)
+    run_cmd(["chroot", rootfs, "apt-get", "clean"], dry_run=dry_run)
+    if dry_run:
+        logger.info("Would clear machine-id, SSH host keys and apt lists in %s", rootfs)
+        return
+    for p in (root / "etc/machine-id", root / "var/lib/dbus/machine-id"):
+        if p.is_file() and not p.is_symlink():
+            p.write_text("", encoding="utf-8")
+    for p in (root / "etc/ssh").glob("ssh_host_*"):
+        p.unlink()
+    lists = root / "var/lib/apt/lists"
+    for p in lists.glob("*") if lists.is_dir() else ():
+        if p.is_file():
+            p.unlink()
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_root_image(
+    rootfs: str,
+    out_dir: str,
+    *,
+    profile_id: str,
+    arch: str,
+    packages: Sequence[str] = (),
+    extra: Optional[Mapping[str, Any]] = None,
+    dry_run: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """Pack a prepared rootfs into <out_dir>/<profile>.ext4.zst plus a <profile>.json manifest.
+
+    The filesystem is populated with mkfs.ext4 -d (no loop mount needed), shrunk
+    to its minimum size, and zstd-compressed; the installer grows it again to
+    fill the root partition. Returns the manifest (None in dry-run).
+    """
+
+    out = Path(out_dir)
+    raw = out / f"{profile_id}.ext4"
+    packed = out / f"{profile_id}.ext4.zst"
+    if not dry_run:
+        out.mkdir(parents=True, exist_ok=True)
+        raw.unlink(missing_ok=True)
+
+    # Size the scratch filesystem with room for ext4 metadata; resize2fs -M shrinks it afterwards.
+    used = 0
+    if not dry_run:
+        r = run_cmd(["du", "-s", "-B1", "--one-file-system", rootfs])
+        used = int((r.stdout or "0").split()[0])
+    size_mib = int(used * 1.3 / (1 << 20)) + 512
+
+    run_cmd(["truncate", "-s", f"{size_mib}M", str(raw)], dry_run=dry_run)
+    run_cmd(["mkfs.ext4", "-q", "-F", "-L", "ROOT", "-d", rootfs, str(raw)], dry_run=dry_run)
+    r = run_cmd(["e2fsck", "-f", "-y", str(raw)], check=False, dry_run=dry_run)
+    if r.returncode not in {0, 1}:
+        raise RuntimeError(f"e2fsck failed on {raw} (rc={r.returncode})\n{r.stdout}{r.stderr}")
+    run_cmd(["resize2fs", "-M", str(raw)], dry_run=dry_run)
+    run_cmd(["zstd", "-q", "-f", "-T0", "-12", "--rm", str(raw), "-o", str(packed)], dry_run=dry_run)
+
+    if dry_run:
+        return None
+
+    manifest: Dict[str, Any] = {
+        "profile": profile_id,
+        "arch": arch,
+        "image": packed.name,
+        "sha256": _sha256_file(packed),
+        "compressed_bytes": packed.stat().st_size,
+        "packages": sorted(packages),
+        **(extra or {}),
+    }
+    (out / f"{profile_id}.json").write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    logger.info("Golden image %s: %.1f MiB compressed", packed, manifest["compressed_bytes"] / (1 << 20))
+    return manifest
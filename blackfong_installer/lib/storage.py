@@ -1,13 +1,50 @@
 from __future__ import annotations
 
+import contextvars
+import errno
+import fcntl
+import hashlib
 import logging
+import math
+import os
+import queue
+import stat
+import struct
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
-from .command import run_cmd
+from .block import (
+    BlockDevice,
+    active_swaps,
+    device_name,
+    mounted_partitions,
+    partition_path,
+    read_block_device,
+    reread_partitions,
+)
+from .command import run_cmd, run_cmds
+from .gpt import ESP_TYPE, LINUX_FS_TYPE, device_size, plan_partitions, write_gpt
 
 logger = logging.getLogger(__name__)
 
+# Writer chunk size: large, and a multiple of every sector/page size we meet.
+WRITE_CHUNK = 4 << 20
+_ZERO = bytes(WRITE_CHUNK)
+# linux/fs.h: BLKZEROOUT = _IO(0x12, 127); zeroes a byte range, offloaded to the device when possible.
+_BLKZEROOUT = 0x127F
+_SECTOR = 512
+# Smallest root partition worth installing to (the planner refuses smaller disks).
+MIN_ROOT_MIB = 4096
+# Partition alignment floor (the de-facto standard) and the ceiling beyond which
+# device hints are treated as bogus.
+BASE_ALIGNMENT = 1 << 20
+MAX_ALIGNMENT = 64 << 20
+_FS_BLOCK = 4096
+
 
 @dataclass(frozen=True)
 class PartitionPlan:
@@ -17,6 +54,11 @@ class PartitionPlan:
     esp_size_mib: int = 512
     boot_size_mib: int = 1024
     swap_size_mib: Optional[int] = None
+    # Golden rootfs image written to the root partition instead of mkfs (install_mode=image).
+    root_image: Optional[str] = None
+    write_jobs: int = 4
+    # Inventory of plan.disk read just before partitioning (lib/block.read_block_device).
+    device: Optional[BlockDevice] = None
 
 
 @dataclass(frozen=True)
@@ -24,13 +66,153 @@ class PartitionResult:
     root_part: str
     esp_part: Optional[str]
     boot_part: Optional[str]
+    image_write: Optional[Dict[str, Any]] = None
+    # plan.disk re-read after the new table was loaded (its partitions are the ones created).
+    disk: Optional[Dict[str, Any]] = None
+    # Alignment/mkfs parameters used and the resulting partitions (FormatPlan.summary() et al.).
+    layout: Optional[Dict[str, Any]] = None
+
+
+@dataclass(frozen=True)
+class FormatPlan:
+    """Alignment and mkfs parameters derived from the target device (see plan_format)."""
+
+    alignment: int = BASE_ALIGNMENT  # bytes; partition starts and sizes are multiples of it
+    sector_size: int = _SECTOR  # logical sector size
+    discard: bool = True  # let mke2fs discard (TRIM) the partition before writing
+    lazy_itable_init: bool = True
+    lazy_journal_init: bool = False
+    stride: int = 0  # ext4 blocks; 0 = not set
+    stripe_width: int = 0  # ext4 blocks; 0 = not set
+    reasons: Tuple[str, ...] = ()
+
+    @property
+    def alignment_sectors(self) -> int:
+        return self.alignment // self.sector_size
+
+    def align_up(self, nbytes: int) -> int:
+        return -(-nbytes // self.alignment) * self.alignment
+
+    def mkfs_ext4(self, dev: str) -> List[str]:
+        ext = [
+            f"lazy_itable_init={int(self.lazy_itable_init)}",
+            f"lazy_journal_init={int(self.lazy_journal_init)}",
+        ]
+        if self.stride:
+            ext.append(f"stride={self.stride}")
+        if self.stripe_width:
+            ext.append(f"stripe_width={self.stripe_width}")
+        ext.append("discard" if self.discard else "nodiscard")
+        return ["mkfs.ext4", "-F", "-b", str(_FS_BLOCK), "-E", ",".join(ext), dev]
+
+    def mkfs_vfat(self, dev: str) -> List[str]:
+        argv = ["mkfs.vfat", "-F", "32"]
+        if self.sector_size != _SECTOR:
+            argv += ["-S", str(self.sector_size)]  # 4Kn disks: FAT32 needs the native sector size
+        return [*argv, dev]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "alignment_bytes": self.alignment,
+            "sector_size": self.sector_size,
+            "discard": self.discard,
+            "lazy_itable_init": self.lazy_itable_init,
+            "lazy_journal_init": self.lazy_journal_init,
+            "stride": self.stride,
+            "stripe_width": self.stripe_width,
+            "reasons": list(self.reasons),
+        }
+
+
+def plan_format(dev: Optional[BlockDevice]) -> FormatPlan:
+    """Derive partition alignment and mkfs policy from the device's characteristics.
+
+    - Alignment: 1 MiB, raised to a common multiple of the physical sector size,
+      optimal I/O size (RAID stripe, SMR zone hint) and flash erase block.
+    - stride/stripe_width: minimum I/O size, and optimal I/O size (else the
+      erase block), in 4 KiB filesystem blocks.
+    - Discard only where it is fast and meaningful (SSD/NVMe that advertise it);
+      on SD/eMMC and USB flash a full-partition discard can take minutes.
+    - Slow flash also skips zeroing the journal up front; inode tables are always
+      initialised lazily by the kernel after mount.
+    """
 
+    if dev is None:
+        return FormatPlan(reasons=("no device inventory: generic defaults",))
 
-def _part_suffix(disk: str, n: int) -> str:
-    # nvme/mmcblk devices use p suffix
-    if disk.endswith(tuple("0123456789")):
-        return f"{disk}p{n}"
-    return f"{disk}{n}"
+    reasons: List[str] = []
+    sector = dev.logical_block_size or _SECTOR
+    alignment = BASE_ALIGNMENT
+    for label, hint in (
+        ("physical sector", dev.physical_block_size),
+        ("optimal I/O size", dev.optimal_io_size),
+        ("erase block", dev.erase_size),
+    ):
+        if hint > sector and hint % sector == 0:
+            candidate = math.lcm(alignment, hint)
+            if candidate > MAX_ALIGNMENT:
+                reasons.append(f"ignored {label} {hint} (alignment would exceed {MAX_ALIGNMENT >> 20} MiB)")
+                continue
+            if candidate != alignment:
+                reasons.append(f"alignment {candidate} from {label} {hint}")
+            alignment = candidate
+
+    stride = dev.minimum_io_size // _FS_BLOCK if dev.minimum_io_size > _FS_BLOCK else 0
+    width_hint = dev.optimal_io_size or dev.erase_size
+    stripe_width = width_hint // _FS_BLOCK if width_hint > _FS_BLOCK and width_hint % _FS_BLOCK == 0 else 0
+    if stride and stripe_width % stride:
+        stripe_width = 0
+    if stride or stripe_width:
+        reasons.append(f"stride={stride} stripe_width={stripe_width} blocks")
+
+    slow_flash = dev.transport in {"mmc", "usb"}
+    discard = bool(dev.discard_max_bytes) and not dev.rotational and not slow_flash
+    if not discard:
+        why = "slow flash" if slow_flash else ("rotational" if dev.rotational else "no discard support")
+        reasons.append(f"nodiscard ({why})")
+    if slow_flash:
+        reasons.append("lazy_journal_init (slow flash)")
+
+    return FormatPlan(
+        alignment=alignment,
+        sector_size=sector,
+        discard=discard,
+        lazy_itable_init=True,
+        lazy_journal_init=slow_flash,
+        stride=stride,
+        stripe_width=stripe_width,
+        reasons=tuple(reasons),
+    )
+
+
+def disk_problem(dev: BlockDevice, *, min_mib: int = MIN_ROOT_MIB + 1024 + 2) -> Optional[str]:
+    """Why dev cannot be an install target, or None if it can."""
+
+    if dev.read_only:
+        return "read-only"
+    holders = dev.all_holders()
+    if holders:
+        return f"in use by {', '.join(holders)} (LVM/RAID/crypt)"
+    mounted = mounted_partitions(dev)
+    if mounted:
+        return f"in use: {', '.join(mounted)} mounted"
+    swaps = active_swaps(dev)
+    if swaps:
+        return f"in use: {', '.join(swaps)} active swap"
+    if dev.size < min_mib << 20:
+        return f"too small: {dev.size >> 20} MiB, need at least {min_mib} MiB"
+    return None
+
+
+def check_target_disk(plan: PartitionPlan) -> None:
+    """Refuse disks the plan cannot (or must not) be applied to."""
+
+    if plan.device is None:
+        return
+    need_mib = MIN_ROOT_MIB + (plan.esp_size_mib if plan.firmware == "efi" else plan.boot_size_mib) + 2
+    problem = disk_problem(plan.device, min_mib=need_mib)
+    if problem:
+        raise RuntimeError(f"Target disk {plan.device.path} is {problem}")
 
 
 def partition_and_format(
@@ -46,84 +228,495 @@ def partition_and_format(
     - U-Boot: optional /boot (ext4) mounted at /boot
     - Root: ext4 mounted at /
 
+    With plan.root_image the root partition receives that image (grown to fill
+    it) instead of a fresh filesystem; the image's /boot is carried over onto a
+    separate /boot partition.
+
     Note: Device-specific layouts (e.g., Raspberry Pi firmware FAT) should be
     handled via profiles; this is a solid baseline for EFI systems and generic U-Boot.
     """
 
     disk = plan.disk
-    logger.info("Partitioning disk=%s firmware=%s", disk, plan.firmware)
-
-    # Wipe + GPT
-    run_cmd(["sgdisk", "--zap-all", disk], dry_run=dry_run)
-    run_cmd(["sgdisk", "--clear", disk], dry_run=dry_run)
-
-    part_num = 1
-    esp_part = None
-    boot_part = None
-
-    if plan.firmware == "efi":
-        # ESP
-        run_cmd(
-            [
-                "sgdisk",
-                f"--new={part_num}:0:+{plan.esp_size_mib}MiB",
-                f"--typecode={part_num}:ef00",
-                f"--change-name={part_num}:EFI",
-                disk,
-            ],
-            dry_run=dry_run,
+    check_target_disk(plan)
+    fmt = plan_format(plan.device)
+    if plan.device is not None:
+        dev = plan.device
+        logger.info(
+            "Partitioning disk=%s firmware=%s (%d MiB, %s, sectors %d/%d, optimal_io=%d, discard=%s)",
+            disk,
+            plan.firmware,
+            dev.size >> 20,
+            dev.transport or "unknown transport",
+            dev.logical_block_size,
+            dev.physical_block_size,
+            dev.optimal_io_size,
+            "yes" if dev.discard_max_bytes else "no",
         )
-        esp_part = _part_suffix(disk, part_num)
-        part_num += 1
+    else:
+        logger.info("Partitioning disk=%s firmware=%s", disk, plan.firmware)
+    logger.info("Format plan: %s", "; ".join(fmt.reasons) or "defaults")
 
+    # The whole table (protective MBR, both GPT copies) in one write; replaces whatever was on the disk.
+    specs: List[Tuple[str, str, Optional[int]]] = []
+    if plan.firmware == "efi":
+        specs.append(("EFI", ESP_TYPE, plan.esp_size_mib << 20))
     if plan.firmware == "uboot":
         # Dedicated /boot for extlinux (generic)
-        run_cmd(
-            [
-                "sgdisk",
-                f"--new={part_num}:0:+{plan.boot_size_mib}MiB",
-                f"--typecode={part_num}:8300",
-                f"--change-name={part_num}:BOOT",
-                disk,
-            ],
-            dry_run=dry_run,
-        )
-        boot_part = _part_suffix(disk, part_num)
-        part_num += 1
-
+        specs.append(("BOOT", LINUX_FS_TYPE, plan.boot_size_mib << 20))
     # Root gets rest
-    run_cmd(
-        [
-            "sgdisk",
-            f"--new={part_num}:0:0",
-            f"--typecode={part_num}:8300",
-            f"--change-name={part_num}:ROOT",
-            disk,
-        ],
-        dry_run=dry_run,
-    )
-    root_part = _part_suffix(disk, part_num)
+    specs.append(("ROOT", LINUX_FS_TYPE, None))
+
+    paths = [partition_path(disk, n) for n in range(1, len(specs) + 1)]
+    esp_part = paths[0] if plan.firmware == "efi" else None
+    boot_part = paths[0] if plan.firmware == "uboot" else None
+    root_part = paths[-1]
+
+    if plan.device is not None:
+        disk_bytes: Optional[int] = plan.device.size
+    else:
+        disk_bytes = None if dry_run else device_size(disk)
+    gpt_parts = []
+    if disk_bytes:
+        gpt_parts = plan_partitions(specs, disk_bytes=disk_bytes, sector_size=fmt.sector_size, alignment=fmt.alignment)
+    for gp, path in zip(gpt_parts, paths):
+        logger.info(
+            "Partition %s (%s): start %d MiB, size %d MiB",
+            path,
+            gp.name,
+            gp.start(fmt.sector_size) >> 20,
+            gp.size(fmt.sector_size) >> 20,
+        )
 
-    # Inform kernel
-    run_cmd(["partprobe", disk], dry_run=dry_run)
+    refreshed = None
+    if dry_run:
+        logger.info("Would write GPT to %s: %s", disk, ", ".join(name for name, _, _ in specs))
+    else:
+        write_gpt(disk, gpt_parts, sector_size=fmt.sector_size)
+        # Wait for the kernel's rescan rather than guessing when the nodes show up.
+        reread_partitions(disk, [device_name(p) for p in paths])
+        refreshed = read_block_device(device_name(disk))
+        for p in refreshed.partitions if refreshed is not None else ():
+            if p.start % fmt.alignment:
+                logger.warning("%s starts at %d, not aligned to %d bytes", p.name, p.start, fmt.alignment)
 
-    # Format
+    # Format: the filesystems are independent, so mkfs runs concurrently
+    # (and alongside the root image write in image mode).
+    mkfs: Dict[str, List[str]] = {}
     if esp_part:
-        run_cmd(["mkfs.vfat", "-F", "32", esp_part], dry_run=dry_run)
+        mkfs[esp_part] = fmt.mkfs_vfat(esp_part)
     if boot_part:
-        run_cmd(["mkfs.ext4", "-F", boot_part], dry_run=dry_run)
-    run_cmd(["mkfs.ext4", "-F", root_part], dry_run=dry_run)
+        mkfs[boot_part] = fmt.mkfs_ext4(boot_part)
+    if not plan.root_image:
+        mkfs[root_part] = fmt.mkfs_ext4(root_part)
+    image_write = None
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="mkfs") as pool:
+        ctx = contextvars.copy_context()  # keep the step's command ledger/events attribution
+        formatting = pool.submit(ctx.run, _format_all, list(mkfs.values()), dry_run)
+        if plan.root_image:
+            image_write = write_root_image(plan.root_image, root_part, jobs=plan.write_jobs, dry_run=dry_run).summary()
+        formatting.result()
+    format_s = time.monotonic() - t0
 
     # Mount
     run_cmd(["mkdir", "-p", target_root], dry_run=dry_run)
     run_cmd(["mount", root_part, target_root], dry_run=dry_run)
 
     if boot_part:
+        if plan.root_image:
+            # The image carries kernel/initrd in its /boot, which the boot partition would hide.
+            run_cmd(["mv", f"{target_root}/boot", f"{target_root}/boot.image"], dry_run=dry_run)
         run_cmd(["mkdir", "-p", f"{target_root}/boot"], dry_run=dry_run)
         run_cmd(["mount", boot_part, f"{target_root}/boot"], dry_run=dry_run)
+        if plan.root_image:
+            run_cmd(["cp", "-a", f"{target_root}/boot.image/.", f"{target_root}/boot/"], dry_run=dry_run)
+            run_cmd(["rm", "-rf", f"{target_root}/boot.image"], dry_run=dry_run)
 
     if esp_part:
         run_cmd(["mkdir", "-p", f"{target_root}/boot/efi"], dry_run=dry_run)
         run_cmd(["mount", esp_part, f"{target_root}/boot/efi"], dry_run=dry_run)
 
-    return PartitionResult(root_part=root_part, esp_part=esp_part, boot_part=boot_part)
+    return PartitionResult(
+        root_part=root_part,
+        esp_part=esp_part,
+        boot_part=boot_part,
+        image_write=image_write,
+        disk=refreshed.to_dict() if refreshed is not None else None,
+        layout={
+            "format": fmt.summary(),
+            "gpt": [gp.summary(fmt.sector_size) for gp in gpt_parts],
+            "mkfs": mkfs,
+            "format_wall_s": round(format_s, 3),
+            "partitions": [
+                {"name": p.name, "number": p.number, "start": p.start, "size": p.size, "aligned": p.start % fmt.alignment == 0}
+                for p in (refreshed.partitions if refreshed is not None else ())
+            ],
+        },
+    )
+
+
+def _format_all(cmds: Sequence[List[str]], dry_run: bool) -> None:
+    if cmds:
+        run_cmds(cmds, jobs=len(cmds), dry_run=dry_run)
+
+
+@dataclass
+class WriteResult:
+    source: str
+    dest: str
+    bytes_total: int = 0
+    bytes_written: int = 0
+    bytes_skipped: int = 0  # holes and zero runs not copied byte by byte
+    sha256: str = ""
+    verified: Optional[bool] = None
+    wall_s: float = 0.0
+    verify_s: float = 0.0
+
+    @property
+    def mib_per_s(self) -> float:
+        return self.bytes_total / (1 << 20) / self.wall_s if self.wall_s else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "dest": self.dest,
+            "bytes_total": self.bytes_total,
+            "bytes_written": self.bytes_written,
+            "bytes_skipped": self.bytes_skipped,
+            "sha256": self.sha256,
+            "verified": self.verified,
+            "wall_s": round(self.wall_s, 3),
+            "verify_s": round(self.verify_s, 3),
+            "mib_per_s": round(self.mib_per_s, 1),
+        }
+
+
+def _prefetch(items: Iterator[Any], depth: int) -> Iterator[Any]:
+    """Iterate `items` on a background thread, at most `depth` items ahead of the consumer."""
+
+    q: "queue.Queue[Tuple[bool, Any]]" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _put(item: Tuple[bool, Any]) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run() -> None:
+        try:
+            for item in items:
+                if not _put((False, item)):
+                    return
+            _put((True, None))
+        except BaseException as e:
+            _put((True, e))
+
+    t = threading.Thread(target=_run, name="image-read", daemon=True)
+    t.start()
+    try:
+        while True:
+            end, item = q.get()
+            if end:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+        t.join()
+
+
+def _data_extents(fd: int, size: int) -> Iterator[Tuple[int, int]]:
+    """(start, end) ranges holding data, via SEEK_DATA/SEEK_HOLE; one range if unsupported."""
+
+    pos = 0
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:  # only a hole remains
+                return
+            if pos == 0:
+                yield 0, size
+                return
+            raise
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        yield start, end
+        pos = end
+
+
+def _read_chunks(source: str) -> Iterator[Tuple[int, Optional[bytes], int]]:
+    """(offset, data, length) for the logical contents of source; data None = all zeros.
+
+    Regular files are read extent by extent so holes cost nothing; *.zst
+    sources are decompressed through `zstd -dc` and read as a stream.
+    """
+
+    if source.endswith(".zst"):
+        proc = subprocess.Popen(["zstd", "-dc", "-T0", source], stdout=subprocess.PIPE)
+        assert proc.stdout is not None
+        off = 0
+        try:
+            while True:
+                buf = proc.stdout.read(WRITE_CHUNK)
+                if not buf:
+                    break
+                yield off, (None if buf == _ZERO[: len(buf)] else buf), len(buf)
+                off += len(buf)
+        finally:
+            proc.stdout.close()
+            rc = proc.wait()
+        if rc != 0:
+            raise RuntimeError(f"zstd -dc {source} failed (rc={rc})")
+        return
+
+    fd = os.open(source, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        pos = 0
+        for start, end in _data_extents(fd, size):
+            if start > pos:
+                yield pos, None, start - pos
+            pos = start
+            while pos < end:
+                # Stop at the next chunk boundary so writes stay aligned.
+                n = min(end, (pos // WRITE_CHUNK + 1) * WRITE_CHUNK) - pos
+                buf = os.pread(fd, n, pos)
+                if len(buf) != n:
+                    raise RuntimeError(f"Short read from {source} at {pos}")
+                yield pos, (None if buf == _ZERO[:n] else buf), n
+                pos += n
+        if size > pos:
+            yield pos, None, size - pos
+    finally:
+        os.close(fd)
+
+
+def _pwrite_all(fd: int, data: bytes, off: int) -> None:
+    view = memoryview(data)
+    while view:
+        n = os.pwrite(fd, view, off)
+        view = view[n:]
+        off += n
+
+
+class _ZeroWriter:
+    """Zero a byte range on the destination as cheaply as it allows.
+
+    Regular files were truncated first, so their zero ranges are already holes.
+    Block devices get BLKZEROOUT (falling back to writing zeros).
+    """
+
+    def __init__(self, fd: int, *, is_block: bool) -> None:
+        self.fd = fd
+        self.is_block = is_block
+        self.ioctl_ok = is_block
+
+    def __call__(self, off: int, length: int) -> int:
+        """Returns the bytes actually written (0 when the range was offloaded or already a hole)."""
+
+        if not self.is_block:
+            return 0
+        if self.ioctl_ok and off % _SECTOR == 0 and length % _SECTOR == 0:
+            try:
+                fcntl.ioctl(self.fd, _BLKZEROOUT, struct.pack("QQ", off, length))
+                return 0
+            except OSError as e:
+                logger.info("BLKZEROOUT unsupported (%s); writing zeros", e)
+                self.ioctl_ok = False
+        done = 0
+        while done < length:
+            n = min(WRITE_CHUNK, length - done)
+            _pwrite_all(self.fd, _ZERO[:n], off + done)
+            done += n
+        return length
+
+
+def _hash_file(path: str, length: int) -> str:
+    """SHA256 of the first `length` bytes of path, read ahead on a background thread."""
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # Read back from the device, not from the page cache we just filled.
+        os.posix_fadvise(fd, 0, length, os.POSIX_FADV_DONTNEED)
+
+        def _chunks() -> Iterator[bytes]:
+            off = 0
+            while off < length:
+                buf = os.pread(fd, min(WRITE_CHUNK, length - off), off)
+                if not buf:
+                    raise RuntimeError(f"Short read-back from {path} at {off}")
+                yield buf
+                off += len(buf)
+
+        h = hashlib.sha256()
+        for buf in _prefetch(_chunks(), 4):
+            h.update(buf)
+        return h.hexdigest()
+    finally:
+        os.close(fd)
+
+
+def write_image(
+    source: str,
+    dest: str,
+    *,
+    jobs: int = 4,
+    verify: bool = True,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+    dry_run: bool = False,
+) -> WriteResult:
+    """Copy a disk/filesystem image onto a block device or regular file.
+
+    The source (raw, or *.zst) is read ahead in WRITE_CHUNK-aligned chunks on one
+    thread, SHA256-hashed in order on the calling thread, and written with
+    pwrite by `jobs` writer threads, so reading, hashing and writing overlap.
+    Holes (SEEK_DATA/SEEK_HOLE) and all-zero chunks are not copied: regular
+    destinations are truncated and keep them as holes, block devices get
+    BLKZEROOUT. With verify, the written range is read back and its SHA256
+    compared against the source's.
+
+    progress(done_bytes, total_bytes_or_None) is called after every chunk.
+    """
+
+    result = WriteResult(source=source, dest=dest)
+    if dry_run:
+        logger.info("Would write image %s -> %s", source, dest)
+        return result
+
+    started = time.monotonic()
+    total: Optional[int] = None if source.endswith(".zst") else os.stat(source).st_size
+
+    is_block = os.path.exists(dest) and stat.S_ISBLK(os.stat(dest).st_mode)
+    # O_EXCL on a block device fails with EBUSY while it is mounted.
+    flags = os.O_WRONLY | (os.O_EXCL if is_block else os.O_CREAT)
+    fd = os.open(dest, flags, 0o644)
+    try:
+        if not is_block:
+            os.ftruncate(fd, 0)
+        elif total is not None:
+            dev_size = os.lseek(fd, 0, os.SEEK_END)
+            if total > dev_size:
+                raise RuntimeError(f"{source} ({total} bytes) does not fit on {dest} ({dev_size} bytes)")
+        zero = _ZeroWriter(fd, is_block=is_block)
+
+        lock = threading.Lock()
+        inflight = threading.BoundedSemaphore(max(1, jobs) * 2)
+        futures: List[Future] = []
+
+        def _write(off: int, data: Optional[bytes], length: int) -> None:
+            try:
+                if data is None:
+                    n = zero(off, length)
+                else:
+                    _pwrite_all(fd, data, off)
+                    n = length
+                with lock:
+                    result.bytes_written += n
+                    result.bytes_skipped += length - n
+            finally:
+                inflight.release()
+
+        h = hashlib.sha256()
+        done = 0
+        last_log = started
+        zero_run: Optional[List[int]] = None  # [offset, length] of pending zero chunks
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="image-write") as pool:
+
+            def _submit(off: int, data: Optional[bytes], length: int) -> None:
+                inflight.acquire()
+                futures.append(pool.submit(_write, off, data, length))
+                if len(futures) > 64:
+                    for f in [f for f in futures if f.done()]:
+                        f.result()
+                        futures.remove(f)
+
+            for off, data, length in _prefetch(_read_chunks(source), 4):
+                if data is None:
+                    for z in range(0, length, WRITE_CHUNK):
+                        h.update(memoryview(_ZERO)[: min(WRITE_CHUNK, length - z)])
+                    # Coalesce adjacent zero chunks into one zero-out.
+                    if zero_run is not None and zero_run[0] + zero_run[1] == off:
+                        zero_run[1] += length
+                    else:
+                        if zero_run is not None:
+                            _submit(zero_run[0], None, zero_run[1])
+                        zero_run = [off, length]
+                else:
+                    h.update(data)
+                    if zero_run is not None:
+                        _submit(zero_run[0], None, zero_run[1])
+                        zero_run = None
+                    _submit(off, data, length)
+
+                done = off + length
+                if progress is not None:
+                    progress(done, total)
+                now = time.monotonic()
+                if now - last_log >= 5:
+                    last_log = now
+                    logger.info(
+                        "Writing %s: %d/%s MiB (%.0f MiB/s)",
+                        dest,
+                        done >> 20,
+                        total >> 20 if total is not None else "?",
+                        done / (1 << 20) / (now - started),
+                    )
+            if zero_run is not None:
+                _submit(zero_run[0], None, zero_run[1])
+            for f in futures:
+                f.result()
+
+        if not is_block:
+            # Trailing holes still count towards the length.
+            os.ftruncate(fd, done)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    result.bytes_total = done
+    result.sha256 = h.hexdigest()
+    result.wall_s = time.monotonic() - started
+
+    if verify:
+        t0 = time.monotonic()
+        readback = _hash_file(dest, done)
+        result.verify_s = time.monotonic() - t0
+        result.verified = readback == result.sha256
+        if not result.verified:
+            raise RuntimeError(f"Verification failed writing {source} to {dest}: {readback} != {result.sha256}")
+
+    logger.info(
+        "Wrote %s -> %s: %.1f MiB in %.1fs (%.0f MiB/s), %.1f MiB skipped as holes/zeros%s",
+        source,
+        dest,
+        result.bytes_total / (1 << 20),
+        result.wall_s,
+        result.mib_per_s,
+        result.bytes_skipped / (1 << 20),
+        f", verified in {result.verify_s:.1f}s" if verify else "",
+    )
+    return result
+
+
+def write_root_image(image: str, device: str, *, jobs: int = 4, dry_run: bool = False) -> WriteResult:
+    """Lay a golden ext4 image onto device, grow it to the partition and give it a fresh UUID.
+
+    Every install from the same image would otherwise share one filesystem UUID.
+    """
+
+    result = write_image(image, device, jobs=jobs, dry_run=dry_run)
+
+    # e2fsck: 0 = clean, 1 = errors corrected; anything else is fatal.
+    r = run_cmd(["e2fsck", "-f", "-y", device], check=False, dry_run=dry_run)
+    if r.returncode not in {0, 1}:
+        raise RuntimeError(f"e2fsck failed on {device} after writing {image} (rc={r.returncode})\n{r.stdout}{r.stderr}")
+    run_cmd(["resize2fs", device], dry_run=dry_run)
+    run_cmd(["tune2fs", "-U", "random", device], dry_run=dry_run)
+    logger.info("Root image %s written to %s", image, device)
+    return result
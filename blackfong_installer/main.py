@@ -2,20 +2,30 @@ from __future__ import annotations
 
 import argparse
 import logging
-from typing import Any, Dict, Optional
-
+import os
+import signal
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from .lib.chroot import ChrootSession
+from .lib.events import EventSocketServer, WarningForwarder
 from .logging_utils import DEFAULT_LOG_PATH, configure_logging
 from .pipeline import run_pipeline
-from .state_store import ensure_defaults, load_state, save_state
+from .profiling import StepProfiler
+from .state_model import InstallerState
+from .state_store import StateJournal, ensure_defaults, load_state, save_state
 from .steps import (
     ConfigureServicesStep,
     DetectHardwareStep,
     FinalizeRebootStep,
     ApplyAssetsStep,
+    ConfigureFirewallStep,
     InstallDesktopStep,
     InstallFeaturesStep,
     InstallBootloaderStep,
     InstallKernelStep,
+    InstallPackagesStep,
     InstallRootFSStep,
     PartitionFilesystemStep,
     WriteFstabStep,
@@ -32,12 +42,14 @@ def build_steps():
     return [
         DetectHardwareStep(),
         PartitionFilesystemStep(),
-        WriteFstabStep(),
         InstallRootFSStep(),
+        WriteFstabStep(),
+        InstallPackagesStep(),
         InstallKernelStep(),
         InstallBootloaderStep(),
         ConfigureServicesStep(),
         ApplyAssetsStep(),
+        ConfigureFirewallStep(),
         InstallDesktopStep(),
         InstallFeaturesStep(),
         PostInstallChecksStep(),
@@ -45,6 +57,25 @@ def build_steps():
     ]
 
 
+@contextmanager
+def _exit_on_signals() -> Iterator[None]:
+    """Turn SIGTERM/SIGHUP into SystemExit so cleanup (chroot binds, state) still runs."""
+
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _handler(signum: int, _frame: Any) -> None:
+        raise SystemExit(128 + signum)
+
+    previous = {sig: signal.signal(sig, _handler) for sig in (signal.SIGTERM, signal.SIGHUP)}
+    try:
+        yield
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+
+
 def run(
     *,
     state_path: str = DEFAULT_STATE_PATH,
@@ -52,8 +83,17 @@ def run(
     start_at: Optional[str] = None,
     stop_after: Optional[str] = None,
     force: bool = False,
+    jobs: Optional[int] = None,
+    profile_dir: Optional[str] = None,
+    events_socket: Optional[str] = None,
 ) -> Dict[str, Any]:
-    """Run the installer pipeline, persisting state for resume."""
+    """Run the installer pipeline, persisting state for resume.
+
+    jobs: max concurrently running steps (defaults to config.pipeline_jobs, else 1).
+    profile_dir: if set, write cProfile/tracemalloc dumps per step and a Chrome trace there.
+    events_socket: if set, serve progress events as NDJSON on this Unix socket
+    (in-process frontends use lib.events.subscribe instead).
+    """
 
     actual_log_path = configure_logging(log_path=log_path)
 
@@ -61,16 +101,34 @@ def run(
     state.setdefault("execution", {}).setdefault("paths", {})["log_path_requested"] = log_path
     state.setdefault("execution", {}).setdefault("paths", {})["log_path_actual"] = actual_log_path
 
+    cfg = InstallerState.from_dict(state).config
     steps = build_steps()
+    max_workers = int(jobs or cfg.pipeline_jobs or 1)
+    profiler = StepProfiler(profile_dir=profile_dir)
+    if profile_dir:
+        state.setdefault("execution", {}).setdefault("paths", {})["profile_dir"] = profile_dir
+
+    dry_run = cfg.dry_run
+
+    # Checkpoint after every step; the final snapshot below folds the journal in.
+    journal = StateJournal(state_path, state)
+    warnings = WarningForwarder()
+    logging.getLogger().addHandler(warnings)
+    events_server = EventSocketServer(events_socket).start() if events_socket else None
 
     try:
-        result = run_pipeline(
-            state=state,
-            steps=steps,
-            start_at=start_at,
-            stop_after=stop_after,
-            force=force,
-        )
+        # One set of chroot bind mounts for the whole run; torn down on exit, error or signal.
+        with _exit_on_signals(), ChrootSession(dry_run=dry_run):
+            result = run_pipeline(
+                state=state,
+                steps=steps,
+                start_at=start_at,
+                stop_after=stop_after,
+                force=force,
+                max_workers=max_workers,
+                profiler=profiler,
+                checkpoint=journal.checkpoint,
+            )
         state = result.state
         state.setdefault("execution", {}).setdefault("summary", {})["ran_steps"] = result.ran_steps
         state.setdefault("execution", {}).setdefault("summary", {})["skipped_steps"] = result.skipped_steps
@@ -85,7 +143,12 @@ def run(
         )
         raise
     finally:
+        profiler.close()
+        journal.close()
         save_state(state_path, state)
+        logging.getLogger().removeHandler(warnings)
+        if events_server is not None:
+            events_server.close()
 
 
 def main(argv: Optional[list[str]] = None) -> int:
@@ -95,6 +158,27 @@ def main(argv: Optional[list[str]] = None) -> int:
     p.add_argument("--start-at", default=None, help="Start at step_id (e.g. 30_install_kernel)")
     p.add_argument("--stop-after", default=None, help="Stop after step_id")
     p.add_argument("--force", action="store_true", help="Re-run steps even if marked completed")
+    p.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Run up to N independent steps concurrently (default: config.pipeline_jobs or 1)",
+    )
+    p.add_argument(
+        "--profile",
+        action="store_true",
+        help="Dump cProfile/tracemalloc output per step and a Chrome trace timeline",
+    )
+    p.add_argument(
+        "--profile-dir",
+        default=None,
+        help="Where --profile writes its output (default: <state dir>/profile)",
+    )
+    p.add_argument(
+        "--events-socket",
+        default=None,
+        help="Stream progress events (NDJSON) on this Unix socket for GUIs/remote observers",
+    )
     p.add_argument(
         "--dry-run",
         action="store_true",
@@ -106,6 +190,8 @@ def main(argv: Optional[list[str]] = None) -> int:
     # Persist CLI flags into state (source of truth)
     state = ensure_defaults(load_state(args.state))
     state.setdefault("config", {})["dry_run"] = bool(args.dry_run)
+    if args.jobs is not None:
+        state["config"]["pipeline_jobs"] = max(1, int(args.jobs))
     save_state(args.state, state)
 
     run(
@@ -114,5 +200,10 @@ def main(argv: Optional[list[str]] = None) -> int:
         start_at=args.start_at,
         stop_after=args.stop_after,
         force=args.force,
+        jobs=args.jobs,
+        profile_dir=(args.profile_dir or os.path.join(os.path.dirname(os.path.abspath(args.state)), "profile"))
+        if args.profile
+        else None,
+        events_socket=args.events_socket,
     )
     return 0
@@ -1,16 +1,32 @@
 from __future__ import annotations
 
+import copy
 import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Any, Dict, Iterable, List, Optional, Protocol, Sequence
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Protocol, Sequence
 
+from .lib.command import terminate_running
+from .lib.events import emit, step_context
+from .profiling import StepProfiler
 from .state_store import is_step_completed, mark_step_completed
 
 logger = logging.getLogger(__name__)
 
 
 class Step(Protocol):
-    """A single idempotent step."""
+    """A single idempotent step.
+
+    Steps may optionally declare scheduling metadata (plain class attributes):
+    - requires: state keys the step reads that other steps produce
+    - provides: state keys the step produces
+    - resources: names of exclusive resources (e.g. "dpkg"); two steps sharing a
+      resource never run at the same time
+
+    A step without `requires` is treated as depending on every step before it.
+    """
 
     step_id: str
 
@@ -25,6 +41,53 @@ class PipelineResult:
     skipped_steps: List[str]
 
 
+def _select_window(
+    steps: Sequence[Step], *, start_at: Optional[str], stop_after: Optional[str]
+) -> List[Step]:
+    """Apply --start-at/--stop-after to the ordered step list."""
+
+    selected: List[Step] = []
+    started = start_at is None
+    for step in steps:
+        if not started:
+            if step.step_id == start_at:
+                started = True
+            else:
+                continue
+        selected.append(step)
+        if stop_after is not None and step.step_id == stop_after:
+            break
+    return selected
+
+
+def _step_attr(step: Step, name: str) -> Optional[tuple[str, ...]]:
+    value = getattr(step, name, None)
+    if value is None:
+        return None
+    return tuple(value)
+
+
+def build_dependencies(steps: Sequence[Step]) -> Dict[str, List[str]]:
+    """Map step_id -> step_ids it must wait for.
+
+    Dependencies only point backwards in list order, so the declared order stays
+    authoritative and the graph is always acyclic.
+    """
+
+    deps: Dict[str, List[str]] = {}
+    for i, step in enumerate(steps):
+        earlier = steps[:i]
+        requires = _step_attr(step, "requires")
+        if requires is None:
+            deps[step.step_id] = [s.step_id for s in earlier]
+            continue
+        wanted = set(requires)
+        deps[step.step_id] = [
+            s.step_id for s in earlier if wanted.intersection(_step_attr(s, "provides") or ())
+        ]
+    return deps
+
+
 def run_pipeline(
     *,
     state: Dict[str, Any],
@@ -32,35 +95,253 @@ def run_pipeline(
     start_at: Optional[str] = None,
     stop_after: Optional[str] = None,
     force: bool = False,
+    max_workers: int = 1,
+    profiler: Optional[StepProfiler] = None,
+    checkpoint: Optional[Callable[[Dict[str, Any], str], None]] = None,
 ) -> PipelineResult:
-    """Run steps in order with resume/idempotency semantics."""
+    """Run steps with resume/idempotency semantics.
+
+    max_workers=1 runs the steps strictly in order. Larger values schedule
+    independent steps (see Step) concurrently on a bounded worker pool.
+
+    Per-step resource usage is recorded under execution.timings[step_id].
+    Progress is published as pipeline.*/step.* events (see lib/events.py).
+    checkpoint(state, step_id) is called after each step is marked completed
+    (e.g. StateJournal.checkpoint), so a crash resumes after that step.
+    """
+
+    profiler = profiler or StepProfiler()
+    window = _select_window(steps, start_at=start_at, stop_after=stop_after)
+    emit("pipeline.start", steps=[s.step_id for s in window], jobs=max_workers)
+
+    result: Optional[PipelineResult] = None
+    try:
+        if max_workers > 1:
+            result = _run_parallel(
+                state=state,
+                steps=window,
+                force=force,
+                max_workers=max_workers,
+                profiler=profiler,
+                checkpoint=checkpoint,
+            )
+        else:
+            result = _run_sequential(
+                state=state,
+                steps=window,
+                force=force,
+                stop_after=stop_after,
+                profiler=profiler,
+                checkpoint=checkpoint,
+            )
+        return result
+    finally:
+        if result is None:
+            emit("pipeline.end", ok=False)
+        else:
+            emit("pipeline.end", ok=True, ran=result.ran_steps, skipped=result.skipped_steps)
+
+
+@contextmanager
+def _step_events(step_id: str) -> Iterator[None]:
+    """step.start/step.end around a step; events emitted inside are attributed to it."""
 
+    with step_context(step_id):
+        emit("step.start")
+        t0 = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            emit("step.end", ok=ok, wall_s=round(time.monotonic() - t0, 6))
+
+
+def _run_sequential(
+    *,
+    state: Dict[str, Any],
+    steps: List[Step],
+    force: bool,
+    stop_after: Optional[str],
+    profiler: StepProfiler,
+    checkpoint: Optional[Callable[[Dict[str, Any], str], None]] = None,
+) -> PipelineResult:
     ran: List[str] = []
     skipped: List[str] = []
 
-    started = start_at is None
-
     for step in steps:
-        if not started:
-            if step.step_id == start_at:
-                started = True
-            else:
-                continue
-
         state.setdefault("execution", {})["current_step"] = step.step_id
 
         if (not force) and is_step_completed(state, step.step_id):
             logger.info("Skipping step %s (already completed)", step.step_id)
+            emit("step.skip", step=step.step_id)
             skipped.append(step.step_id)
         else:
             logger.info("Running step %s", step.step_id)
-            state = step.run(state)
+            timing: Dict[str, Any] = {}
+            with _step_events(step.step_id):
+                try:
+                    with profiler.measure(step.step_id) as timing:
+                        state = step.run(state)
+                finally:
+                    _record_timing(state, step.step_id, timing)
             mark_step_completed(state, step.step_id)
             ran.append(step.step_id)
+            if checkpoint is not None:
+                checkpoint(state, step.step_id)
 
         if stop_after is not None and step.step_id == stop_after:
             logger.info("Stopping after %s", stop_after)
-            break
+
+    state.setdefault("execution", {})["current_step"] = None
+    return PipelineResult(state=state, ran_steps=ran, skipped_steps=skipped)
+
+
+def _record_timing(state: Dict[str, Any], step_id: str, timing: Dict[str, Any]) -> None:
+    state.setdefault("execution", {}).setdefault("timings", {})[step_id] = timing
+
+
+_MISSING = object()
+
+
+def _merge_changes(shared: Dict[str, Any], base: Dict[str, Any], work: Dict[str, Any]) -> None:
+    """Apply what a step changed in its working copy (base -> work) to the shared state.
+
+    Mappings merge key by key and lists the step only appended to are extended, so
+    steps that ran side by side (e.g. both adding to execution.warnings) keep each
+    other's writes. Anything else the step changed replaces the shared value.
+    """
+
+    for k, v in work.items():
+        old = base.get(k, _MISSING)
+        cur = shared.get(k, _MISSING)
+        if old is not _MISSING and v == old:
+            continue
+        if isinstance(v, dict) and isinstance(old, dict) and isinstance(cur, dict):
+            _merge_changes(cur, old, v)
+        elif isinstance(v, list) and isinstance(old, list) and isinstance(cur, list) and v[: len(old)] == old:
+            cur.extend(v[len(old) :])
+        else:
+            shared[k] = v
+    for k in base:
+        if k not in work:
+            shared.pop(k, None)
+
+
+def _run_parallel(
+    *,
+    state: Dict[str, Any],
+    steps: List[Step],
+    force: bool,
+    max_workers: int,
+    profiler: StepProfiler,
+    checkpoint: Optional[Callable[[Dict[str, Any], str], None]] = None,
+) -> PipelineResult:
+    """Dependency-aware scheduler over a thread pool.
+
+    Each step runs on its own deep copy of the state taken when it is started;
+    when it finishes, the scheduler thread merges its changes back (see
+    _merge_changes), marks it completed and checkpoints. Only the scheduler thread
+    touches the shared dict, so checkpoints never see a half-written state.
+    Completed steps (resume) count as satisfied dependencies. On failure no new
+    steps are started; running steps are allowed to finish (and are marked
+    completed) before the first error is re-raised.
+    """
+
+    deps = build_dependencies(steps)
+    by_id = {s.step_id: s for s in steps}
+    order = [s.step_id for s in steps]
+
+    ran: List[str] = []
+    skipped: List[str] = []
+    done: set[str] = set()
+
+    for step_id in order:
+        if (not force) and is_step_completed(state, step_id):
+            logger.info("Skipping step %s (already completed)", step_id)
+            emit("step.skip", step=step_id)
+            skipped.append(step_id)
+            done.add(step_id)
+
+    pending = [sid for sid in order if sid not in done]
+    running: Dict[Future, str] = {}
+    # future -> (state as handed to the step, the step's working copy)
+    copies: Dict[Future, tuple[Dict[str, Any], Dict[str, Any]]] = {}
+    held: set[str] = set()
+    error: Optional[BaseException] = None
+
+    def _resources(step_id: str) -> set[str]:
+        return set(_step_attr(by_id[step_id], "resources") or ())
+
+    def _runnable(step_id: str) -> bool:
+        if any(d not in done for d in deps[step_id]):
+            return False
+        return not (_resources(step_id) & held)
+
+    def _run_one(step: Step, work: Dict[str, Any]) -> Dict[str, Any]:
+        logger.info("Running step %s", step.step_id)
+        timing: Dict[str, Any] = {}
+        with _step_events(step.step_id):
+            try:
+                with profiler.measure(step.step_id) as timing:
+                    work = step.run(work)
+            finally:
+                _record_timing(work, step.step_id, timing)
+        return work
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="step") as pool:
+        try:
+            while pending or running:
+                if error is None:
+                    for step_id in list(pending):
+                        if len(running) >= max_workers:
+                            break
+                        if not _runnable(step_id):
+                            continue
+                        pending.remove(step_id)
+                        held.update(_resources(step_id))
+                        state.setdefault("execution", {})["current_step"] = step_id
+                        base = copy.deepcopy(state)
+                        work = copy.deepcopy(base)
+                        fut = pool.submit(_run_one, by_id[step_id], work)
+                        running[fut] = step_id
+                        copies[fut] = (base, work)
+
+                if not running:
+                    if pending and error is None:
+                        # Only possible if a dependency was filtered out of the window.
+                        raise RuntimeError(f"Pipeline stalled; unsatisfiable steps: {pending}")
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    step_id = running.pop(fut)
+                    base, work = copies.pop(fut)
+                    held.difference_update(_resources(step_id))
+                    exc = fut.exception()
+                    # A failed step still contributes what it wrote (warnings, timing), as in sequential mode.
+                    _merge_changes(state, base, work if exc is not None else fut.result())
+                    if exc is not None:
+                        logger.error("Step %s failed: %s", step_id, exc)
+                        if error is None:
+                            error = exc
+                            state.setdefault("execution", {})["current_step"] = step_id
+                        continue
+                    mark_step_completed(state, step_id)
+                    done.add(step_id)
+                    ran.append(step_id)
+                    if checkpoint is not None:
+                        checkpoint(state, step_id)
+        except BaseException:
+            # Ctrl-C/SIGTERM (or a scheduler bug): start nothing new and stop the
+            # commands running steps are waiting on, so the pool can drain.
+            pool.shutdown(wait=False, cancel_futures=True)
+            n = terminate_running()
+            logger.warning("Pipeline aborted; terminated %d running command(s)", n)
+            raise
+
+    if error is not None:
+        raise error
 
     state.setdefault("execution", {})["current_step"] = None
     return PipelineResult(state=state, ran_steps=ran, skipped_steps=skipped)
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from .lib.command import track_commands
+
+logger = logging.getLogger(__name__)
+
+
+def _read_vm_hwm_kb() -> Optional[int]:
+    """Peak resident set size of this process (VmHWM), in KiB."""
+    try:
+        for line in Path("/proc/self/status").read_text(encoding="utf-8").splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    except Exception:
+        pass
+    return None
+
+
+def _reset_vm_hwm() -> bool:
+    """Reset VmHWM so the next reading covers only what follows (Linux >= 4.0)."""
+    try:
+        Path("/proc/self/clear_refs").write_text("5", encoding="utf-8")
+        return True
+    except Exception:
+        return False
+
+
+# Command lines are truncated in the state copy of the ledger (apt installs can list hundreds of packages).
+_LEDGER_CMD_CHARS = 200
+
+
+def _ledger_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    out = {k: v for k, v in entry.items() if k != "start"}
+    cmd = str(out.get("cmd", ""))
+    if len(cmd) > _LEDGER_CMD_CHARS:
+        out["cmd"] = cmd[: _LEDGER_CMD_CHARS - 3] + "..."
+    return out
+
+
+class StepProfiler:
+    """Per-step resource accounting for the installer pipeline.
+
+    Always records, per step:
+    - wall_s: elapsed wall-clock time
+    - cpu_s: CPU time of the step's own thread
+    - children_cpu_s: user+sys CPU of the step's own commands (sum over its ledger)
+    - max_rss_kb: installer peak RSS during the step (process-wide)
+    - subprocesses: number of external commands spawned by the step
+    - commands: the step's command ledger (per command: wall_s, user_s, sys_s,
+      max_rss_kb, returncode; see lib/command.py)
+
+    With profile_dir set (--profile), additionally writes per step a cProfile
+    dump (<step>.prof) and a tracemalloc diff (<step>.tracemalloc.txt), and a
+    Chrome trace timeline (trace.json, open in chrome://tracing or Perfetto).
+
+    When steps run concurrently, the process-wide peak RSS may include work
+    from overlapping steps.
+    """
+
+    def __init__(self, *, profile_dir: Optional[str] = None) -> None:
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.timings: Dict[str, Dict[str, Any]] = {}
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._active = 0
+        self._t0 = time.time()
+        self._started_tracemalloc = False
+
+        if self.profile_dir is not None:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                self._started_tracemalloc = True
+
+    @contextmanager
+    def measure(self, step_id: str) -> Iterator[Dict[str, Any]]:
+        """Measure one step; the yielded dict is filled in when the step exits."""
+
+        timing: Dict[str, Any] = {}
+        with self._lock:
+            self._active += 1
+            # Only reset the process peak when nothing else is running.
+            if self._active == 1:
+                _reset_vm_hwm()
+
+        prof: Optional[cProfile.Profile] = None
+        snap_before = None
+        if self.profile_dir is not None:
+            snap_before = tracemalloc.take_snapshot()
+            prof = cProfile.Profile()
+
+        started = time.time()
+        wall0 = time.monotonic()
+        cpu0 = time.thread_time()
+        ok = False
+        try:
+            with track_commands() as ledger:
+                if prof is not None:
+                    try:
+                        prof.enable()
+                    except ValueError:
+                        # Python >= 3.12 allows one active cProfile at a time (parallel steps).
+                        logger.info("cProfile busy; not profiling %s", step_id)
+                        prof = None
+                try:
+                    yield timing
+                finally:
+                    if prof is not None:
+                        prof.disable()
+            ok = True
+        finally:
+            timing.update(
+                {
+                    "wall_s": round(time.monotonic() - wall0, 6),
+                    "cpu_s": round(time.thread_time() - cpu0, 6),
+                    "children_cpu_s": round(sum(e.get("user_s", 0.0) + e.get("sys_s", 0.0) for e in ledger), 6),
+                    "max_rss_kb": _read_vm_hwm_kb(),
+                    "subprocesses": len(ledger),
+                    "commands": [_ledger_entry(e) for e in ledger],
+                    "ok": ok,
+                }
+            )
+
+            with self._lock:
+                self._active -= 1
+                self.timings[step_id] = timing
+                tid = threading.get_ident()
+                self._events.append(self._trace_event(step_id, "step", started, timing["wall_s"], tid, timing))
+                for entry in ledger:
+                    self._events.append(
+                        self._trace_event(entry["cmd"], "cmd", entry["start"], entry["wall_s"], tid, entry)
+                    )
+
+            if self.profile_dir is not None:
+                self._dump_profiles(step_id, prof, snap_before)
+
+            logger.info(
+                "Step %s timing: wall=%.2fs cpu=%.2fs children_cpu=%.2fs max_rss=%sKiB subprocesses=%d",
+                step_id,
+                timing["wall_s"],
+                timing["cpu_s"],
+                timing["children_cpu_s"],
+                timing["max_rss_kb"],
+                timing["subprocesses"],
+            )
+            if ledger:
+                slowest = max(ledger, key=lambda e: e["wall_s"])
+                logger.info("Step %s slowest command: %.2fs %s", step_id, slowest["wall_s"], slowest["cmd"][:200])
+
+    def _trace_event(
+        self, name: str, cat: str, start: float, dur_s: float, tid: int, args: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        return {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": int((start - self._t0) * 1_000_000),
+            "dur": int(dur_s * 1_000_000),
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": dict(args),
+        }
+
+    def _dump_profiles(self, step_id: str, prof: Optional[cProfile.Profile], snap_before: Any) -> None:
+        assert self.profile_dir is not None
+        try:
+            if snap_before is not None:
+                current, peak = tracemalloc.get_traced_memory()
+                ignore = [
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, cProfile.__file__),
+                ]
+                stats = (
+                    tracemalloc.take_snapshot()
+                    .filter_traces(ignore)
+                    .compare_to(snap_before.filter_traces(ignore), "lineno")
+                )
+                lines = [f"# {step_id}: traced current={current} peak={peak} bytes", ""]
+                lines += [str(s) for s in stats[:25]]
+                (self.profile_dir / f"{step_id}.tracemalloc.txt").write_text(
+                    "\n".join(lines) + "\n", encoding="utf-8"
+                )
+                tracemalloc.reset_peak()
+            if prof is not None:
+                prof.dump_stats(str(self.profile_dir / f"{step_id}.prof"))
+        except Exception as e:
+            logger.warning("Failed to write profile for %s: %s", step_id, e)
+
+    def close(self) -> Optional[str]:
+        """Finish profiling: write the Chrome trace (profile mode only) and return its path."""
+
+        if self.profile_dir is None:
+            return None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        path = self.profile_dir / "trace.json"
+        with self._lock:
+            events = list(self._events)
+        path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}) + "\n", encoding="utf-8")
+        logger.info("Wrote Chrome trace: %s", str(path))
+        return str(path)
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import collections.abc
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple, get_type_hints
+
+from .lib.block import BlockDevice, device_name
+
+# Typed, immutable view of the installer state.
+#
+# The state file format does not change: every section keeps its raw data as a
+# frozen tree (MappingProxyType for objects, tuples for arrays) and the typed
+# fields are validated from it. to_dict() returns exactly that raw data, so
+# unknown keys survive a load/save round trip.
+#
+# Snapshots share structure: InstallerState.from_dict(state, previous=snap)
+# reuses every subtree (and every section object) of `snap` that did not
+# change, so successive snapshots cost memory only for what changed and can be
+# compared by identity.
+#
+# Derived data (e.g. the BlockDevice objects of Hardware.disks()) is never
+# stored in the state. It is a cheap, pure function of raw fields.
+
+EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+_MISSING = object()
+
+
+class StateError(ValueError):
+    """The state does not match the schema (path says where)."""
+
+
+def freeze(value: Any, previous: Any = None) -> Any:
+    """Immutable copy of JSON-like data that reuses unchanged subtrees of `previous`."""
+
+    if isinstance(value, Mapping):
+        prev = previous if isinstance(previous, MappingProxyType) else None
+        same = prev is not None and len(prev) == len(value)
+        items: Dict[str, Any] = {}
+        for k, v in value.items():
+            pv = prev.get(k, _MISSING) if prev is not None else _MISSING
+            fv = freeze(v, None if pv is _MISSING else pv)
+            items[k] = fv
+            if same and fv is not pv:
+                same = False
+        return prev if same else MappingProxyType(items)
+
+    if isinstance(value, (list, tuple)):
+        prev_t = previous if isinstance(previous, tuple) else ()
+        out = tuple(freeze(v, prev_t[i] if i < len(prev_t) else None) for i, v in enumerate(value))
+        if len(out) == len(prev_t) and all(a is b for a, b in zip(out, prev_t)):
+            return prev_t
+        return out
+
+    if previous is not None and type(previous) is type(value) and previous == value:
+        return previous
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Plain dict/list copy of a frozen tree."""
+
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+def json_default(value: Any) -> Any:
+    """json.dumps(default=...) hook for frozen trees."""
+
+    if isinstance(value, MappingProxyType):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _check(value: Any, hint: Any, path: str) -> Any:
+    """Validate one raw value against a field type; returns the typed value."""
+
+    origin = getattr(hint, "__origin__", None)
+    args = getattr(hint, "__args__", ())
+
+    if origin is not None and type(None) in args:  # Optional[X]
+        if value is None:
+            return None
+        (inner,) = [a for a in args if a is not type(None)]
+        return _check(value, inner, path)
+    if hint is Any:
+        return value
+    if hint is bool:
+        if not isinstance(value, bool):
+            raise StateError(f"{path}: expected bool, got {type(value).__name__}")
+        return value
+    if hint in (int, float, str):
+        ok = isinstance(value, hint) and not isinstance(value, bool)
+        if hint is float:
+            ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        if not ok:
+            raise StateError(f"{path}: expected {hint.__name__}, got {type(value).__name__}")
+        return value
+    if origin is tuple:
+        if not isinstance(value, tuple):
+            raise StateError(f"{path}: expected list, got {type(value).__name__}")
+        for i, v in enumerate(value):
+            _check(v, args[0], f"{path}[{i}]")
+        return value
+    if origin in (collections.abc.Mapping, dict) or hint is Mapping:
+        if not isinstance(value, Mapping):
+            raise StateError(f"{path}: expected object, got {type(value).__name__}")
+        return value
+    raise TypeError(f"Unsupported schema type at {path}: {hint!r}")
+
+
+class _Section:
+    """from_raw/to_dict for slotted section dataclasses.
+
+    Fields map 1:1 to keys of the raw object (field metadata "key" overrides,
+    "choices" restricts values, "section" nests another _Section). The raw
+    object itself is kept in the `raw` field.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_raw(cls, raw: Any, path: str, previous: Optional["_Section"] = None) -> Any:
+        if raw is None:
+            raw = EMPTY
+        if not isinstance(raw, Mapping):
+            raise StateError(f"{path}: expected object, got {type(raw).__name__}")
+        if previous is not None and previous.raw is raw:  # type: ignore[attr-defined]
+            return previous
+
+        hints = _hints(cls)
+        kwargs: Dict[str, Any] = {"raw": raw}
+        for f in fields(cls):  # type: ignore[arg-type]
+            if f.name == "raw":
+                continue
+            key = f.metadata.get("key", f.name)
+            sub = f.metadata.get("section")
+            value = raw.get(key, _MISSING)
+            if sub is not None:
+                prev_sub = getattr(previous, f.name, None) if previous is not None else None
+                kwargs[f.name] = sub.from_raw(None if value is _MISSING else value, f"{path}.{key}", prev_sub)
+                continue
+            if value is _MISSING:
+                continue  # dataclass default
+            typed = _check(value, hints[f.name], f"{path}.{key}")
+            choices = f.metadata.get("choices")
+            if choices is not None and typed not in choices:
+                raise StateError(f"{path}.{key}: must be one of {sorted(choices)}, got {typed!r}")
+            kwargs[f.name] = typed
+        return cls(**kwargs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return thaw(self.raw)  # type: ignore[attr-defined]
+
+
+@lru_cache(maxsize=None)
+def _hints(cls: type) -> Dict[str, Any]:
+    return get_type_hints(cls)
+
+
+def _empty() -> Mapping[str, Any]:
+    return EMPTY
+
+
+def _mapping() -> Any:
+    return field(default_factory=_empty)
+
+
+def _section(cls: type) -> Any:
+    return field(default_factory=cls, metadata={"section": cls})
+
+
+def _choices(*values: Any) -> Any:
+    return field(default=values[0], metadata={"choices": frozenset(values)})
+
+
+@dataclass(frozen=True, slots=True)
+class Config(_Section):
+    """state['config'] (defaults mirror state_store.ensure_defaults)."""
+
+    target_disk: Optional[str] = None
+    disk_benchmark: bool = False
+    target_disk_auto_wipe: bool = False
+    profile: Optional[str] = None
+    dry_run: bool = False
+    install_source: str = _choices("offline", "online", "hybrid")
+    install_mode: str = _choices("packages", "image")
+    apt_transaction: str = _choices("per_step", "single")
+    pipeline_jobs: int = 1
+    debian_suite: str = "stable"
+    debian_mirror: str = "http://deb.debian.org/debian"
+    offline_repo_path: Optional[str] = None
+    apt_proxy: Optional[str] = None
+    apt_prefetch_jobs: int = 8
+    apt_index_cache_dir: Optional[str] = None
+    hw_cache_dir: Optional[str] = None
+    bootstrap_cache_dir: Optional[str] = None
+    golden_image_path: Optional[str] = None
+    golden_image_dirs: Tuple[str, ...] = ()
+    hostname: str = "blackfong-node"
+    username: str = "blackfong"
+    fixed_uid: int = 1000
+    ssh_enabled: bool = True
+    ssh_authorized_keys: Tuple[str, ...] = ()
+    firewall_enabled: bool = True
+    daise_device_access_enabled: bool = True
+    desktop_base: str = "xubuntu"
+    code_warden_enabled: bool = True
+    blackfong_shell_package: Optional[str] = "blackfong-code-warden-shell"
+    raw: Mapping[str, Any] = _mapping()
+
+
+@dataclass(frozen=True, slots=True)
+class Hardware(_Section):
+    """state['hardware'] as produced by lib/hwdetect.detect_hardware."""
+
+    arch: Optional[str] = None
+    firmware: Optional[str] = None
+    profile: Optional[str] = None
+    cpu_model: Optional[str] = None
+    ram_mb: Optional[int] = None
+    gpu: Mapping[str, Any] = _mapping()
+    gpus: Tuple[Mapping[str, Any], ...] = ()
+    pci: Tuple[Mapping[str, Any], ...] = ()
+    camera: Mapping[str, Any] = _mapping()
+    identity: Mapping[str, Any] = _mapping()
+    disk_inventory: Tuple[Mapping[str, Any], ...] = field(default=(), metadata={"key": "disks"})
+    raw: Mapping[str, Any] = _mapping()
+
+    def disks(self) -> Tuple[BlockDevice, ...]:
+        """Typed view of hardware.disks (lib/block.inventory_disks at detection time)."""
+
+        return tuple(BlockDevice.from_dict(d) for d in self.disk_inventory)
+
+    def disk(self, dev: str) -> Optional[BlockDevice]:
+        name = device_name(dev)
+        return next((d for d in self.disks() if d.name == name), None)
+
+
+@dataclass(frozen=True, slots=True)
+class Mounts(_Section):
+    target_root: Optional[str] = None
+    root_part: Optional[str] = None
+    esp_part: Optional[str] = None
+    boot_part: Optional[str] = None
+    raw: Mapping[str, Any] = _mapping()
+
+    def require_target_root(self) -> str:
+        if not self.target_root:
+            raise RuntimeError("execution.mounts.target_root missing; run partition step first")
+        return self.target_root
+
+
+@dataclass(frozen=True, slots=True)
+class Plan(_Section):
+    """state['execution']['plan']: what is (or will be) installed."""
+
+    features: Mapping[str, Any] = _mapping()
+    apt_transaction: Optional[Mapping[str, Any]] = None
+    closure: Optional[Mapping[str, Any]] = None
+    raw: Mapping[str, Any] = _mapping()
+
+
+@dataclass(frozen=True, slots=True)
+class Execution(_Section):
+    current_step: Optional[str] = None
+    completed_steps: Tuple[str, ...] = ()
+    errors: Tuple[Mapping[str, Any], ...] = ()
+    warnings: Tuple[Mapping[str, Any], ...] = ()
+    state_seq: int = 0
+    mounts: Mounts = _section(Mounts)
+    plan: Plan = _section(Plan)
+    decisions: Mapping[str, Any] = _mapping()
+    timings: Mapping[str, Any] = _mapping()
+    raw: Mapping[str, Any] = _mapping()
+
+
+@dataclass(frozen=True, slots=True)
+class InstallerState(_Section):
+    version: Optional[str] = None
+    config: Config = _section(Config)
+    hardware: Hardware = _section(Hardware)
+    profile: Mapping[str, Any] = _mapping()
+    execution: Execution = _section(Execution)
+    raw: Mapping[str, Any] = _mapping()
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any], *, previous: Optional["InstallerState"] = None) -> "InstallerState":
+        """Validate and freeze a state dict, sharing unchanged parts with `previous`.
+
+        Raises StateError on schema violations.
+        """
+
+        return cls.from_raw(freeze(data, previous.raw if previous is not None else None), "state", previous)
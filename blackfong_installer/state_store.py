@@ -2,11 +2,18 @@ from __future__ import annotations
 
 import json
 import logging
+import os
+import threading
 from pathlib import Path
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from .state_model import InstallerState, json_default, thaw
 
 logger = logging.getLogger(__name__)
 
+# The journal is folded into a fresh snapshot once it grows past this.
+JOURNAL_COMPACT_BYTES = 256 * 1024
+
 
 def _detect_format(path: Path) -> str:
     ext = path.suffix.lower().lstrip(".")
@@ -16,25 +23,30 @@ def _detect_format(path: Path) -> str:
     return "json"
 
 
-def load_state(path: str) -> Dict[str, Any]:
-    p = Path(path)
+def _yaml() -> Any:
+    try:
+        import yaml  # type: ignore
+    except Exception as e:  # pragma: no cover
+        raise RuntimeError(
+            "YAML state requested but PyYAML is not available. "
+            "Use JSON state or add PyYAML to the live environment."
+        ) from e
+    return yaml
+
+
+def journal_path(path: str) -> Path:
+    return Path(f"{path}.journal")
+
+
+def _read_snapshot(p: Path) -> Dict[str, Any]:
     if not p.exists():
         return {}
 
     fmt = _detect_format(p)
     data: Dict[str, Any]
 
-    if fmt == "json":
-        data = json.loads(p.read_text(encoding="utf-8"))
-    elif fmt in {"yaml", "yml"}:
-        try:
-            import yaml  # type: ignore
-        except Exception as e:  # pragma: no cover
-            raise RuntimeError(
-                "YAML state requested but PyYAML is not available. "
-                "Use JSON state or add PyYAML to the live environment."
-            ) from e
-        data = yaml.safe_load(p.read_text(encoding="utf-8")) or {}
+    if fmt in {"yaml", "yml"}:
+        data = _yaml().safe_load(p.read_text(encoding="utf-8")) or {}
     else:
         data = json.loads(p.read_text(encoding="utf-8"))
 
@@ -44,24 +56,214 @@ def load_state(path: str) -> Dict[str, Any]:
     return data
 
 
-def save_state(path: str, state: Dict[str, Any]) -> None:
+def _state_seq(state: Dict[str, Any]) -> int:
+    return int((state.get("execution") or {}).get("state_seq") or 0)
+
+
+def _read_journal(p: Path) -> Tuple[List[Dict[str, Any]], int]:
+    """(records, byte length of the intact prefix). A torn last line (power loss) is dropped."""
+
+    if not p.exists():
+        return [], 0
+    records: List[Dict[str, Any]] = []
+    good = 0
+    with open(p, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            good += len(line)
+    return records, good
+
+
+def load_state(path: str) -> Dict[str, Any]:
+    """Load the snapshot at path and replay its journal (path + ".journal") on top.
+
+    The result is validated against state_model.InstallerState (StateError on mismatch).
+    """
+
     p = Path(path)
-    p.parent.mkdir(parents=True, exist_ok=True)
+    state = _read_snapshot(p)
+    records, _ = _read_journal(journal_path(path))
+    base = _state_seq(state)
+    replayed = 0
+    for rec in records:
+        if int(rec.get("seq", 0)) > base:
+            apply_delta(state, rec.get("delta") or {})
+            replayed += 1
+    if replayed:
+        logger.info("Replayed %d journaled checkpoints onto %s", replayed, path)
+    InstallerState.from_dict(state)
+    return state
 
+
+def _fsync_dir(path: Path) -> None:
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_snapshot(p: Path, state: Mapping[str, Any]) -> None:
+    """Write-temp, fsync, rename: a crash leaves either the old or the new snapshot.
+
+    state may be a plain dict or a frozen InstallerState.raw tree.
+    """
+
+    p.parent.mkdir(parents=True, exist_ok=True)
     fmt = _detect_format(p)
-    if fmt == "json":
-        p.write_text(json.dumps(state, indent=2, sort_keys=True) + "\n", encoding="utf-8")
-    elif fmt in {"yaml", "yml"}:
-        try:
-            import yaml  # type: ignore
-        except Exception as e:  # pragma: no cover
-            raise RuntimeError(
-                "YAML state requested but PyYAML is not available. "
-                "Use JSON state or add PyYAML to the live environment."
-            ) from e
-        p.write_text(yaml.safe_dump(state, sort_keys=False) + "\n", encoding="utf-8")
+    if fmt in {"yaml", "yml"}:
+        text = _yaml().safe_dump(thaw(state), sort_keys=False) + "\n"
     else:
-        p.write_text(json.dumps(state, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        text = json.dumps(state, indent=2, sort_keys=True, default=json_default) + "\n"
+
+    tmp = p.with_name(f".{p.name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, p)
+    _fsync_dir(p.parent)
+
+
+def save_state(path: str, state: Dict[str, Any]) -> None:
+    """Validate and atomically write a full snapshot; it supersedes (and removes) the journal."""
+
+    _write_snapshot(Path(path), InstallerState.from_dict(state).raw)
+    journal_path(path).unlink(missing_ok=True)
+
+
+_DELETE = {"$delete": True}
+
+
+def diff_state(old: Mapping[str, Any], new: Mapping[str, Any]) -> Dict[str, Any]:
+    """Delta turning old into new: nested mappings recurse, anything else is replaced.
+
+    Keys removed in new map to {"$delete": true} (null is a legitimate state value).
+    Subtrees shared between two snapshots (see state_model.freeze) are skipped by identity.
+    """
+
+    delta: Dict[str, Any] = {}
+    for k, v in new.items():
+        if k not in old:
+            delta[k] = {"$set": v}
+        elif v is old[k]:
+            continue
+        elif isinstance(v, Mapping) and isinstance(old[k], Mapping):
+            sub = diff_state(old[k], v)
+            if sub:
+                delta[k] = sub
+        elif v != old[k] or type(v) is not type(old[k]):
+            delta[k] = {"$set": v}
+    for k in old:
+        if k not in new:
+            delta[k] = _DELETE
+    return delta
+
+
+def apply_delta(state: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    for k, v in delta.items():
+        if v == _DELETE:
+            state.pop(k, None)
+        elif isinstance(v, dict) and "$set" in v and len(v) == 1:
+            state[k] = v["$set"]
+        else:
+            if not isinstance(state.get(k), dict):
+                state[k] = {}
+            apply_delta(state[k], v)
+
+
+def _snapshot(state: Dict[str, Any], previous: Optional[InstallerState] = None) -> InstallerState:
+    """Validated, immutable snapshot sharing unchanged subtrees with previous."""
+
+    return InstallerState.from_dict(state, previous=previous)
+
+
+class StateJournal:
+    """Per-step checkpoints for the installer state.
+
+    checkpoint() appends the delta since the previous checkpoint as one JSON
+    line to <state>.journal and makes it durable with group commit:
+    concurrent checkpoints share a single fdatasync. Once the journal passes
+    JOURNAL_COMPACT_BYTES it is folded into an atomic snapshot (see
+    save_state). load_state() replays the journal, so a crash or power loss
+    after a checkpoint resumes with that step completed.
+
+    Checkpoints keep the previous snapshot (state_model.InstallerState), so
+    each one only copies and diffs what changed; `snapshot` is the latest one
+    and is safe to hand to readers in other threads (e.g. a GUI).
+    """
+
+    def __init__(self, path: str, state: Dict[str, Any], *, compact_bytes: int = JOURNAL_COMPACT_BYTES) -> None:
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self._jpath = journal_path(path)
+        self._jpath.parent.mkdir(parents=True, exist_ok=True)
+
+        # Drop a torn tail so new records start on a clean line.
+        _, good = _read_journal(self._jpath)
+        self._fd = os.open(str(self._jpath), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if os.fstat(self._fd).st_size != good:
+            os.ftruncate(self._fd, good)
+        self._size = good
+
+        self._seq = _state_seq(state)
+        self._base = _snapshot(state)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0
+        self._synced = 0
+
+    def checkpoint(self, state: Dict[str, Any], label: Optional[str] = None) -> None:
+        with self._lock:
+            self._seq += 1
+            state.setdefault("execution", {})["state_seq"] = self._seq
+            current = _snapshot(state, self._base)
+            delta = diff_state(self._base.raw, current.raw)
+            line = json.dumps(
+                {"seq": self._seq, "label": label, "delta": delta}, separators=(",", ":"), default=json_default
+            ) + "\n"
+            os.write(self._fd, line.encode("utf-8"))
+            self._base = current
+            self._size += len(line)
+            self._written += 1
+            ticket = self._written
+
+        # Group commit: whoever syncs covers every record written before it.
+        with self._sync_lock:
+            if self._synced < ticket:
+                upto = self._written
+                os.fdatasync(self._fd)
+                self._synced = upto
+
+        if self._size >= self.compact_bytes:
+            self.compact(state)
+
+    def compact(self, state: Dict[str, Any]) -> None:
+        with self._lock, self._sync_lock:
+            state.setdefault("execution", {})["state_seq"] = self._seq
+            snapshot = _snapshot(state, self._base)
+            _write_snapshot(Path(self.path), snapshot.raw)
+            # Records are now in the snapshot (replay skips seq <= state_seq even if this is lost).
+            os.ftruncate(self._fd, 0)
+            os.fsync(self._fd)
+            self._base = snapshot
+            self._size = 0
+
+    @property
+    def snapshot(self) -> InstallerState:
+        return self._base
+
+    def close(self, state: Optional[Dict[str, Any]] = None) -> None:
+        if state is not None:
+            self.compact(state)
+        os.close(self._fd)
+        if state is not None:
+            self._jpath.unlink(missing_ok=True)
 
 
 def ensure_defaults(state: Dict[str, Any]) -> Dict[str, Any]:
@@ -79,7 +281,35 @@ def ensure_defaults(state: Dict[str, Any]) -> Dict[str, Any]:
     cfg.setdefault("firewall_enabled", True)
     cfg.setdefault("daise_device_access_enabled", True)
     cfg.setdefault("partitioning", "auto")
+    # Read-only throughput/latency probe of candidate disks in 10_detect_hardware (lib/diskbench.py).
+    # Always runs for target_disk: auto, which installs to the best-scoring usable disk.
+    cfg.setdefault("disk_benchmark", False)
+    # target_disk: auto never picks a disk that already has partitions or a filesystem unless this is set.
+    cfg.setdefault("target_disk_auto_wipe", False)
     cfg.setdefault("swap", "auto")
+    # Max concurrently running pipeline steps (1 = strictly sequential).
+    cfg.setdefault("pipeline_jobs", 1)
+    # per_step: each step runs its own apt-get update/install.
+    # single: one apt transaction for all steps (45_install_packages).
+    cfg.setdefault("apt_transaction", "per_step")
+    # Parsed Packages index cache (lib/apt_index.py); keyed by Release/Packages hash.
+    cfg.setdefault("apt_index_cache_dir", "/var/cache/blackfong-installer/apt-index")
+    # Hardware detection results keyed by sysfs fingerprint (lib/hwdetect.py); null disables.
+    cfg.setdefault("hw_cache_dir", "/var/cache/blackfong-installer/hw")
+    # Parallel .deb prefetch from debian_mirror for online/hybrid installs (0 = let apt fetch).
+    cfg.setdefault("apt_prefetch_jobs", 8)
+    # APT cache proxy for debootstrap/apt in the target: URL, "auto" (probe :3142 locally and on
+    # the default gateway, e.g. `blackfong-build cache-proxy` in a lab) or null.
+    cfg.setdefault("apt_proxy", None)
+    # Directory of cached debootstrap tarballs (lib/bootstrap_cache.py); null disables.
+    # Point at persistent storage: on a live system /var/cache usually lives in RAM.
+    cfg.setdefault("bootstrap_cache_dir", None)
+    # packages: debootstrap + apt per profile. image: write the profile's golden root image
+    # (built by blackfong-build) and run only the host-specific steps; falls back to packages
+    # when no image is found (config.golden_image_path, else config.golden_image_dirs).
+    cfg.setdefault("install_mode", "packages")
+    cfg.setdefault("golden_image_path", None)
+    cfg.setdefault("golden_image_dirs", ["/run/live/medium/images", "/opt/blackfong/images"])
     # Desktop default:
     # The OS should boot into an XFCE ("Xubuntu-style") desktop by default.
     # Code Warden is an in-OS capability (not a separate OS / not a separate desktop base).
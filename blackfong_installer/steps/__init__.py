@@ -4,8 +4,10 @@ from .step_25_write_fstab import WriteFstabStep
 from .step_30_install_kernel import InstallKernelStep
 from .step_35_install_bootloader import InstallBootloaderStep
 from .step_40_install_rootfs import InstallRootFSStep
+from .step_45_install_packages import InstallPackagesStep
 from .step_50_configure_services import ConfigureServicesStep
 from .step_55_apply_assets import ApplyAssetsStep
+from .step_57_configure_firewall import ConfigureFirewallStep
 from .step_60_install_desktop import InstallDesktopStep
 from .step_70_install_features import InstallFeaturesStep
 from .step_80_post_install_checks import PostInstallChecksStep
@@ -18,8 +20,10 @@ __all__ = [
     "InstallKernelStep",
     "InstallBootloaderStep",
     "InstallRootFSStep",
+    "InstallPackagesStep",
     "ConfigureServicesStep",
     "ApplyAssetsStep",
+    "ConfigureFirewallStep",
     "InstallDesktopStep",
     "InstallFeaturesStep",
     "PostInstallChecksStep",
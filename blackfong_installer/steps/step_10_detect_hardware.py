@@ -3,23 +3,38 @@ from __future__ import annotations
 import logging
 from typing import Any, Dict
 
+from ..lib.diskbench import benchmark_disks, recommend_target_disk
 from ..lib.hwdetect import detect_hardware
+from ..lib.storage import disk_problem
 from ..lib.manifests import load_profile
+from ..state_model import Config, Hardware, freeze
 
 logger = logging.getLogger(__name__)
 
 
 class DetectHardwareStep:
     step_id = "10_detect_hardware"
+    requires = ()
+    provides = ("hardware", "profile")
 
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        cfg = state.get("config") or {}
-        dry_run = bool(cfg.get("dry_run", False))
+        # Only the sections this step reads are frozen, not the whole state.
+        cfg = Config.from_raw(freeze(state.get("config")), "state.config")
 
-        forced_profile = cfg.get("profile")
-        hw = detect_hardware(dry_run=dry_run, forced_profile=str(forced_profile).strip() or None)
+        forced_profile = (cfg.profile or "").strip() or None
+        hw = detect_hardware(dry_run=cfg.dry_run, forced_profile=forced_profile, cache_dir=cfg.hw_cache_dir)
         state["hardware"] = hw
 
+        # Read-only micro-benchmark of candidate disks: opt-in, or needed to resolve target_disk=auto.
+        disks = Hardware.from_raw(freeze(hw), "state.hardware").disks()
+        bench = None
+        if cfg.disk_benchmark or cfg.target_disk == "auto":
+            bench = benchmark_disks([d for d in disks if disk_problem(d) is None])
+            hw["disk_benchmark"] = bench
+        hw["target_disk_recommendation"] = recommend_target_disk(
+            disks, bench, allow_existing=cfg.target_disk_auto_wipe
+        )
+
         profile_id = hw.get("profile")
         if profile_id:
             # Profiles are declarative: opt-ins + defaults. They do not execute logic.
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
+from ..lib.block import BlockDevice, device_name, existing_data, parent_disk, read_block_device
 from ..lib.env import PATHS
+from ..lib.rootfs_image import find_root_image, install_mode, read_image_manifest
 from ..lib.storage import PartitionPlan, partition_and_format
 
 logger = logging.getLogger(__name__)
@@ -11,6 +13,45 @@ logger = logging.getLogger(__name__)
 
 class PartitionFilesystemStep:
     step_id = "20_partition_fs"
+    requires = ("hardware",)
+    provides = ("mounts",)
+    resources = ("disk",)
+
+    def _root_image(self, state: Dict[str, Any]) -> Optional[str]:
+        """Golden image for the detected profile, or None (falls back to a package install)."""
+
+        cfg = state.get("config") or {}
+        hw = state.get("hardware") or {}
+        profile_id = str((state.get("profile") or {}).get("id") or hw.get("profile") or "")
+
+        image = find_root_image(cfg, profile_id) if profile_id else None
+        if image is None:
+            reason = "no_image_for_profile"
+        else:
+            image_arch = read_image_manifest(image).get("arch")
+            if image_arch and image_arch != hw.get("arch"):
+                reason = f"image_arch_{image_arch}_does_not_match_{hw.get('arch')}"
+                image = None
+        if image is None:
+            logger.warning("install_mode=image but no usable root image for profile %r; installing packages", profile_id)
+            state.setdefault("execution", {}).setdefault("warnings", []).append(
+                {"install_mode": "image", "profile": profile_id, "reason": reason}
+            )
+        return image
+
+    def _target_device(self, target_disk: str, *, dry_run: bool) -> Optional[BlockDevice]:
+        """Fresh inventory of the target disk (hardware.disks may be cached or stale)."""
+
+        name = device_name(target_disk)
+        parent = parent_disk(name)
+        if parent is not None:
+            raise RuntimeError(f"config.target_disk must be a whole disk; {target_disk} is a partition of /dev/{parent}")
+        device = read_block_device(name)
+        if device is None:
+            if not dry_run:
+                raise RuntimeError(f"config.target_disk {target_disk} does not exist (/sys/block/{name} missing)")
+            logger.warning("Target disk %s not found; planning without device geometry (dry run)", target_disk)
+        return device
 
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         cfg = state.setdefault("config", {})
@@ -20,6 +61,14 @@ class PartitionFilesystemStep:
         target_disk = cfg.get("target_disk")
         if not target_disk:
             raise RuntimeError("config.target_disk is required for partitioning")
+        auto = target_disk == "auto"
+        if auto:
+            rec = hw.get("target_disk_recommendation") or {}
+            target_disk = rec.get("disk")
+            if not target_disk:
+                problems = "; ".join(f"{c['disk']}: {c['problem']}" for c in rec.get("candidates") or [] if "problem" in c)
+                raise RuntimeError(f"target_disk=auto found no usable disk ({problems or 'no disks detected'})")
+            logger.info("target_disk=auto: selected %s (%s)", target_disk, rec.get("reason") or rec.get("basis"))
 
         firmware = hw.get("firmware")
         if firmware not in {"efi", "uboot"}:
@@ -27,10 +76,28 @@ class PartitionFilesystemStep:
 
         dry_run = bool(cfg.get("dry_run", False))
 
+        # The requested mode (config), not a decision recorded by an earlier run.
+        root_image = self._root_image(state) if install_mode({"config": cfg}) == "image" else None
+        exe.setdefault("decisions", {})["install_mode"] = "image" if root_image else "packages"
+        exe["decisions"]["target_disk"] = target_disk
+        exe["decisions"]["root_image"] = root_image
+
+        device = self._target_device(target_disk, dry_run=dry_run)
+        if auto and device is not None and not cfg.get("target_disk_auto_wipe", False):
+            # The recommendation may come from a cached inventory; never wipe data nobody named.
+            existing = existing_data(device)
+            if existing:
+                raise RuntimeError(
+                    f"target_disk=auto selected {target_disk}, which now holds existing data ({existing}); "
+                    "name the disk explicitly or set target_disk_auto_wipe: true"
+                )
+
         plan = PartitionPlan(
             disk=target_disk,
             firmware=firmware,
             swap_size_mib=None if cfg.get("swap", "auto") in {"none", None} else None,
+            root_image=root_image,
+            device=device,
         )
 
         target_root = (exe.get("mounts") or {}).get("target_root") or PATHS.target_root
@@ -40,6 +107,12 @@ class PartitionFilesystemStep:
         exe["mounts"]["root_part"] = result.root_part
         exe["mounts"]["esp_part"] = result.esp_part
         exe["mounts"]["boot_part"] = result.boot_part
+        if result.layout is not None:
+            exe["decisions"]["storage_layout"] = result.layout
+        if result.disk is not None:
+            exe["decisions"]["target_disk_inventory"] = result.disk
+        if result.image_write is not None:
+            exe["decisions"]["root_image_write"] = result.image_write
 
         logger.info("Partitioned and mounted target_root=%s", target_root)
         return state
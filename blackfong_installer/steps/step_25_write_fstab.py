@@ -4,7 +4,7 @@ import logging
 from pathlib import Path
 from typing import Any, Dict
 
-from ..lib.block import get_uuid
+from ..lib.block import get_uuids
 from ..lib.fstab import FstabEntry, render_fstab
 
 logger = logging.getLogger(__name__)
@@ -12,6 +12,8 @@ logger = logging.getLogger(__name__)
 
 class WriteFstabStep:
     step_id = "25_write_fstab"
+    requires = ("mounts", "rootfs")
+    provides = ("fstab",)
 
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         cfg = state.get("config") or {}
@@ -28,8 +30,9 @@ class WriteFstabStep:
         dry_run = bool(cfg.get("dry_run", False))
 
         entries: list[FstabEntry] = []
+        uuids = get_uuids([p for p in (root_part, boot_part, esp_part) if p], dry_run=dry_run)
 
-        root_uuid = get_uuid(root_part, dry_run=dry_run)
+        root_uuid = uuids[root_part]
         entries.append(
             FstabEntry(
                 spec=f"UUID={root_uuid}",
@@ -42,7 +45,7 @@ class WriteFstabStep:
         )
 
         if boot_part:
-            boot_uuid = get_uuid(boot_part, dry_run=dry_run)
+            boot_uuid = uuids[boot_part]
             entries.append(
                 FstabEntry(
                     spec=f"UUID={boot_uuid}",
@@ -55,7 +58,7 @@ class WriteFstabStep:
             )
 
         if esp_part:
-            esp_uuid = get_uuid(esp_part, dry_run=dry_run)
+            esp_uuid = uuids[esp_part]
             entries.append(
                 FstabEntry(
                     spec=f"UUID={esp_uuid}",
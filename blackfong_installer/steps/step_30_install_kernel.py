@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from ..lib.chroot import mount_chroot_binds, umount_chroot_binds
-from ..lib.pkg import apt_install, apt_update
+from ..lib.pkg import PackageSet, apt_install, apt_transaction_mode, apt_update
+from ..lib.rootfs_image import install_mode
 
 logger = logging.getLogger(__name__)
 
@@ -18,16 +19,12 @@ KERNEL_BY_ARCH = {
 
 class InstallKernelStep:
     step_id = "30_install_kernel"
+    requires = ("hardware", "rootfs", "packages")
+    provides = ("kernel",)
+    resources = ("dpkg",)
 
-    def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        cfg = state.get("config") or {}
+    def _kernel_package(self, state: Dict[str, Any]) -> str:
         hw = state.get("hardware") or {}
-        exe = state.get("execution") or {}
-        mounts = exe.get("mounts") or {}
-        target_root = mounts.get("target_root")
-        if not target_root:
-            raise RuntimeError("execution.mounts.target_root missing; run partition step first")
-
         arch = hw.get("arch")
         if not arch:
             raise RuntimeError("hardware.arch is missing")
@@ -35,11 +32,32 @@ class InstallKernelStep:
         kernel_pkg = KERNEL_BY_ARCH.get(arch)
         if not kernel_pkg:
             raise RuntimeError(f"Unsupported arch for kernel selection: {arch}")
+        return kernel_pkg
 
+    def plan_packages(self, state: Dict[str, Any]) -> List[PackageSet]:
+        return [PackageSet(source=self.step_id, packages=(self._kernel_package(state),))]
+
+    def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        cfg = state.get("config") or {}
+        exe = state.get("execution") or {}
+        mounts = exe.get("mounts") or {}
+        target_root = mounts.get("target_root")
+        if not target_root:
+            raise RuntimeError("execution.mounts.target_root missing; run partition step first")
+
+        kernel_pkg = self._kernel_package(state)
         state.setdefault("execution", {}).setdefault("decisions", {})["kernel_package"] = kernel_pkg
 
         dry_run = bool(cfg.get("dry_run", False))
 
+        if install_mode(state) == "image":
+            logger.info("Kernel provided by root image: %s", kernel_pkg)
+            return state
+
+        if apt_transaction_mode(cfg) == "single":
+            logger.info("Kernel installed by apt transaction: %s", kernel_pkg)
+            return state
+
         mount_chroot_binds(target_root, dry_run=dry_run)
         try:
             apt_update(target_root, dry_run=dry_run)
@@ -1,18 +1,29 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from ..lib.block import get_uuid
 from ..lib.bootloader import install_grub_efi, write_extlinux_config
 from ..lib.chroot import mount_chroot_binds, umount_chroot_binds
-from ..lib.pkg import apt_install, apt_update
+from ..lib.pkg import PackageSet, apt_install, apt_transaction_mode, apt_update
+from ..lib.rootfs_image import install_mode
 
 logger = logging.getLogger(__name__)
 
 
 class InstallBootloaderStep:
     step_id = "35_install_bootloader"
+    requires = ("hardware", "mounts", "rootfs", "packages")
+    provides = ("bootloader",)
+    resources = ("dpkg",)
+
+    def plan_packages(self, state: Dict[str, Any]) -> List[PackageSet]:
+        hw = state.get("hardware") or {}
+        if hw.get("firmware") == "efi":
+            return [PackageSet(source=self.step_id, packages=("grub-efi-amd64", "efibootmgr"))]
+        # extlinux is typically provided via syslinux-common/extlinux
+        return [PackageSet(source=self.step_id, packages=("extlinux", "syslinux-common"))]
 
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         cfg = state.get("config") or {}
@@ -31,23 +42,24 @@ class InstallBootloaderStep:
 
         dry_run = bool(cfg.get("dry_run", False))
 
-        # Ensure bootloader tooling exists inside target
-        mount_chroot_binds(target_root, dry_run=dry_run)
-        try:
-            apt_update(target_root, dry_run=dry_run)
-            if firmware == "efi":
-                apt_install(target_root, ["grub-efi-amd64", "efibootmgr"], dry_run=dry_run)
-            else:
-                # extlinux is typically provided via syslinux-common/extlinux
-                apt_install(target_root, ["extlinux", "syslinux-common"], dry_run=dry_run)
-        finally:
-            umount_chroot_binds(target_root, dry_run=dry_run)
+        # Ensure bootloader tooling exists inside target (a root image already ships it)
+        if apt_transaction_mode(cfg) != "single" and install_mode(state) != "image":
+            mount_chroot_binds(target_root, dry_run=dry_run)
+            try:
+                apt_update(target_root, dry_run=dry_run)
+                for ps in self.plan_packages(state):
+                    apt_install(target_root, ps.packages, dry_run=dry_run)
+            finally:
+                umount_chroot_binds(target_root, dry_run=dry_run)
 
         root_uuid = get_uuid(root_part, dry_run=dry_run)
-        state.setdefault("execution", {}).setdefault("decisions", {})["root_uuid"] = root_uuid
+        decisions = state.setdefault("execution", {}).setdefault("decisions", {})
+        decisions["root_uuid"] = root_uuid
 
         if firmware == "efi":
-            install_grub_efi(target_root=target_root, disk=cfg.get("target_disk", ""), dry_run=dry_run)
+            # The disk step 20 partitioned (config.target_disk may be "auto").
+            disk = decisions.get("target_disk") or cfg.get("target_disk", "")
+            install_grub_efi(target_root=target_root, disk=disk, dry_run=dry_run)
         else:
             write_extlinux_config(target_root=target_root, root_uuid=root_uuid, dry_run=dry_run)
 
@@ -1,16 +1,44 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List
 
+from ..lib.apt_proxy import proxy_env, resolve_apt_proxy, write_apt_proxy_conf
 from ..lib.chroot import mount_chroot_binds, umount_chroot_binds
-from ..lib.pkg import apt_install, apt_update, debootstrap_rootfs, write_sources_list_offline
+from ..lib.pkg import (
+    PackageSet,
+    apt_install,
+    apt_transaction_mode,
+    apt_update,
+    debootstrap_rootfs,
+    write_sources_list_offline,
+)
+from ..lib.rootfs_image import install_mode
 
 logger = logging.getLogger(__name__)
 
 
+# Minimal base tools needed for later steps
+BASE_PACKAGES = (
+    "systemd",
+    "coreutils",
+    "ca-certificates",
+    "network-manager",
+    "openssh-server",
+    "sudo",
+    "linux-base",
+    "initramfs-tools",
+)
+
+
 class InstallRootFSStep:
     step_id = "40_install_rootfs"
+    requires = ("hardware", "mounts")
+    provides = ("rootfs",)
+    resources = ("dpkg",)
+
+    def plan_packages(self, state: Dict[str, Any]) -> List[PackageSet]:
+        return [PackageSet(source=self.step_id, packages=BASE_PACKAGES)]
 
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         cfg = state.get("config") or {}
@@ -31,7 +59,27 @@ class InstallRootFSStep:
         suite = cfg.get("debian_suite", "stable")
         mirror = cfg.get("debian_mirror", "http://deb.debian.org/debian")
 
-        debootstrap_rootfs(target_root=target_root, suite=suite, mirror=mirror, arch=arch, dry_run=dry_run)
+        # Optional APT cache proxy (config.apt_proxy: URL or "auto"); removed again by 80_post_install_checks.
+        apt_proxy = resolve_apt_proxy(cfg.get("apt_proxy"))
+        state.setdefault("execution", {}).setdefault("decisions", {})["apt_proxy"] = apt_proxy
+
+        image_mode = install_mode(state) == "image"
+        if image_mode:
+            # 20_partition_fs already laid the profile's root image onto the root partition.
+            bootstrap = "image"
+        else:
+            bootstrap = debootstrap_rootfs(
+                target_root=target_root,
+                suite=suite,
+                mirror=mirror,
+                arch=arch,
+                env=proxy_env(apt_proxy),
+                cache_dir=cfg.get("bootstrap_cache_dir") or None,
+                dry_run=dry_run,
+            )
+        state.setdefault("execution", {}).setdefault("decisions", {})["bootstrap_cache"] = bootstrap
+        if apt_proxy and not dry_run:
+            write_apt_proxy_conf(target_root, apt_proxy)
 
         # Offline-first: if caller provides an on-media repo path, prefer it.
         offline_repo = cfg.get("offline_repo_path")
@@ -43,24 +91,20 @@ class InstallRootFSStep:
                 component=str(cfg.get("offline_repo_component", "main")),
             )
 
+        if image_mode:
+            logger.info("Rootfs provided by root image at %s", target_root)
+            return state
+
+        if apt_transaction_mode(cfg) == "single":
+            # Base packages are part of the single apt transaction (45_install_packages).
+            logger.info("Rootfs bootstrapped at %s (packages deferred to apt transaction)", target_root)
+            return state
+
         mount_chroot_binds(target_root, dry_run=dry_run)
         try:
             apt_update(target_root, dry_run=dry_run)
-            # Minimal base tools needed for later steps
-            apt_install(
-                target_root,
-                [
-                    "systemd",
-                    "coreutils",
-                    "ca-certificates",
-                    "network-manager",
-                    "openssh-server",
-                    "sudo",
-                    "linux-base",
-                    "initramfs-tools",
-                ],
-                dry_run=dry_run,
-            )
+            for ps in self.plan_packages(state):
+                apt_install(target_root, ps.packages, with_recommends=ps.with_recommends, dry_run=dry_run)
         finally:
             umount_chroot_binds(target_root, dry_run=dry_run)
 
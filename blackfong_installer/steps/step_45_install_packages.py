@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List
+
+from ..lib.apt_index import package_index
+from ..lib.chroot import mount_chroot_binds, umount_chroot_binds
+from ..lib.fetch import prefetch_for_install
+from ..lib.pkg import (
+    PackageSet,
+    apt_install,
+    apt_package_info,
+    apt_transaction_mode,
+    apt_update,
+    split_by_recommends,
+)
+from ..lib.resolver import resolve_plan
+from ..lib.rootfs_image import install_mode
+from .step_30_install_kernel import InstallKernelStep
+from .step_35_install_bootloader import InstallBootloaderStep
+from .step_40_install_rootfs import InstallRootFSStep
+from .step_57_configure_firewall import ConfigureFirewallStep
+from .step_60_install_desktop import InstallDesktopStep
+from .step_70_install_features import InstallFeaturesStep, record_feature_packages
+
+logger = logging.getLogger(__name__)
+
+
+class InstallPackagesStep:
+    """Single apt transaction for every package-installing step (config.apt_transaction=single).
+
+    Gathers each step's plan_packages() into one plan, then runs one apt-get update
+    and dependency-resolved apt-get installs: one for the package sets installed
+    without Recommends and one for those with, so the result matches per-step mode.
+    The planning steps themselves then only configure the already-installed root.
+
+    In both modes it first resolves the plan's dependency closure against the
+    package index (when one is available) and records gaps and sizes under
+    execution.plan.closure, so an unsatisfiable plan shows up before apt runs.
+    """
+
+    step_id = "45_install_packages"
+    requires = ("hardware", "profile", "rootfs")
+    provides = ("packages",)
+    resources = ("dpkg",)
+
+    def __init__(self) -> None:
+        self.planners = [
+            InstallRootFSStep(),
+            InstallKernelStep(),
+            InstallBootloaderStep(),
+            ConfigureFirewallStep(),
+            InstallDesktopStep(),
+            InstallFeaturesStep(),
+        ]
+
+    def plan(self, state: Dict[str, Any]) -> List[PackageSet]:
+        plan: List[PackageSet] = []
+        for planner in self.planners:
+            plan.extend(planner.plan_packages(state))
+        return plan
+
+    def check_closure(self, state: Dict[str, Any], plan: List[PackageSet]) -> None:
+        with package_index(state) as index:
+            if index is None:
+                logger.info("No package index for the target; skipping dependency closure check")
+                return
+            res = resolve_plan(index, plan)
+
+        summary = res.summary()
+        state.setdefault("execution", {}).setdefault("plan", {})["closure"] = summary
+        if res.gaps:
+            for g in res.gaps:
+                logger.warning("Unsatisfiable dependency %s (required by %s)", g.requirement, g.required_by)
+            state.setdefault("execution", {}).setdefault("warnings", []).append(
+                {"package_closure_gaps": summary["gaps"]}
+            )
+        logger.info(
+            "Package closure: %d packages, %.1f MiB download, %.1f MiB installed, %d gaps",
+            summary["packages"],
+            summary["download_bytes"] / (1 << 20),
+            summary["installed_bytes"] / (1 << 20),
+            len(res.gaps),
+        )
+
+    def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        cfg = state.get("config") or {}
+        if install_mode(state) == "image":
+            # Everything but hardware-gated features is in the root image (70_install_features adds those).
+            logger.info("Packages provided by root image; skipping apt transaction")
+            return state
+
+        if apt_transaction_mode(cfg) != "single":
+            self.check_closure(state, self.plan(state))
+            return state
+
+        exe = state.get("execution") or {}
+        mounts = exe.get("mounts") or {}
+        target_root = mounts.get("target_root")
+        if not target_root:
+            raise RuntimeError("execution.mounts.target_root missing; run partition step first")
+
+        dry_run = bool(cfg.get("dry_run", False))
+        plan = self.plan(state)
+
+        mount_chroot_binds(target_root, dry_run=dry_run)
+        try:
+            apt_update(target_root, dry_run=dry_run)
+            self.check_closure(state, plan)
+
+            # One lookup for every optional package across all steps.
+            with package_index(state) as index:
+                info = apt_package_info(
+                    target_root,
+                    [p for ps in plan if ps.optional for p in ps.packages],
+                    index=index,
+                    dry_run=dry_run,
+                )
+
+            packages: list[str] = []
+            by_source: Dict[str, Dict[str, list[str]]] = {}
+            transactions: List[Dict[str, Any]] = []
+            for with_recommends, sets in split_by_recommends(plan):
+                txn: list[str] = []
+                for ps in sets:
+                    entry = by_source.setdefault(ps.source, {"packages": [], "missing": []})
+                    for p in ps.packages:
+                        if ps.optional and not info[p].available:
+                            entry["missing"].append(p)
+                            continue
+                        entry["packages"].append(p)
+                        if p not in packages:
+                            packages.append(p)
+                            txn.append(p)
+                if txn:
+                    transactions.append({"packages": txn, "with_recommends": with_recommends})
+
+            state.setdefault("execution", {}).setdefault("plan", {})["apt_transaction"] = {
+                "packages": packages,
+                "transactions": transactions,
+                "sources": by_source,
+            }
+            features = by_source.get(InstallFeaturesStep.step_id)
+            if features is not None:
+                record_feature_packages(state, features["packages"], features["missing"], info=info)
+
+            for txn in transactions:
+                prefetch_for_install(
+                    state, target_root, txn["packages"], with_recommends=txn["with_recommends"], dry_run=dry_run
+                )
+                apt_install(target_root, txn["packages"], with_recommends=txn["with_recommends"], dry_run=dry_run)
+        finally:
+            umount_chroot_binds(target_root, dry_run=dry_run)
+
+        logger.info("Apt transaction installed %d packages in %d install(s)", len(packages), len(transactions))
+        return state
@@ -5,6 +5,7 @@ from pathlib import Path
 from typing import Any, Dict
 
 from ..lib.chroot import chroot_cmd, mount_chroot_binds, umount_chroot_binds
+from ..lib.rootfs_image import install_mode
 
 logger = logging.getLogger(__name__)
 
@@ -18,8 +19,19 @@ def _write_file(root: str, rel: str, contents: str, *, dry_run: bool) -> None:
     p.write_text(contents, encoding="utf-8")
 
 
+def _exists(root: str, database: str, name: str, *, dry_run: bool) -> bool:
+    if dry_run:
+        return False
+    return chroot_cmd(root, ["getent", database, name], check=False).returncode == 0
+
+
 class ConfigureServicesStep:
     step_id = "50_configure_services"
+    # NetworkManager and openssh-server must be installed before they are enabled.
+    requires = ("rootfs", "packages")
+    provides = ("services",)
+    # groupadd/useradd take the /etc/passwd lock, as do maintainer scripts running adduser --system.
+    resources = ("dpkg",)
 
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         cfg = state.get("config") or {}
@@ -64,15 +76,11 @@ class ConfigureServicesStep:
 
         mount_chroot_binds(target_root, dry_run=dry_run)
         try:
-            try:
-                # Ensure group exists; idempotent.
+            # Idempotent: only create what is missing, and let a real failure raise.
+            if not _exists(target_root, "group", username, dry_run=dry_run):
                 chroot_cmd(target_root, ["groupadd", "-g", str(uid), username], dry_run=dry_run)
-            except Exception:
-                # group may exist
-                pass
 
-            try:
-                # Ensure user exists; idempotent.
+            if not _exists(target_root, "passwd", username, dry_run=dry_run):
                 chroot_cmd(
                     target_root,
                     [
@@ -88,9 +96,10 @@ class ConfigureServicesStep:
                     ],
                     dry_run=dry_run,
                 )
-            except Exception:
-                # user may exist
-                pass
+
+            if install_mode(state) == "image":
+                # Root images ship without SSH host keys; every install gets its own.
+                chroot_cmd(target_root, ["ssh-keygen", "-A"], dry_run=dry_run)
 
             if ssh_enabled and ssh_keys:
                 if not isinstance(ssh_keys, list):
@@ -12,6 +12,11 @@ logger = logging.getLogger(__name__)
 
 class ApplyAssetsStep:
     step_id = "55_apply_assets"
+    requires = ("rootfs",)
+    provides = ("assets",)
+    # Only new files no package owns (units, udev rules, sudoers.d drop-ins) plus one enable symlink;
+    # nothing here touches dpkg's database or the passwd/group lock, so it may overlap package installs.
+    resources = ()
 
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         cfg = state.get("config") or {}
@@ -44,12 +49,6 @@ class ApplyAssetsStep:
                 ],
                 dry_run=dry_run,
             )
-
-            # Firewall (ufw) toggle
-            if bool(cfg.get("firewall_enabled", True)):
-                chroot_cmd(target_root, ["bash", "-lc", "apt-get install -y ufw && ufw --force enable"], dry_run=dry_run)
-            else:
-                chroot_cmd(target_root, ["bash", "-lc", "apt-get install -y ufw && ufw --force disable"], dry_run=dry_run)
         finally:
             umount_chroot_binds(target_root, dry_run=dry_run)
 
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List
+
+from ..lib.chroot import chroot_cmd, mount_chroot_binds, umount_chroot_binds
+from ..lib.pkg import PackageSet, apt_install, apt_transaction_mode
+from ..lib.rootfs_image import install_mode
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigureFirewallStep:
+    step_id = "57_configure_firewall"
+    requires = ("rootfs", "packages")
+    provides = ("firewall",)
+    resources = ("dpkg",)
+
+    def plan_packages(self, state: Dict[str, Any]) -> List[PackageSet]:
+        # ufw is installed either way so the firewall toggle can be flipped later.
+        return [PackageSet(source=self.step_id, packages=("ufw",), with_recommends=True)]
+
+    def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        cfg = state.get("config") or {}
+        exe = state.get("execution") or {}
+        mounts = exe.get("mounts") or {}
+        target_root = mounts.get("target_root")
+        if not target_root:
+            raise RuntimeError("execution.mounts.target_root missing")
+
+        dry_run = bool(cfg.get("dry_run", False))
+        enabled = bool(cfg.get("firewall_enabled", True))
+
+        mount_chroot_binds(target_root, dry_run=dry_run)
+        try:
+            if apt_transaction_mode(cfg) != "single" and install_mode(state) != "image":
+                for ps in self.plan_packages(state):
+                    apt_install(target_root, ps.packages, with_recommends=ps.with_recommends, dry_run=dry_run)
+            chroot_cmd(target_root, ["ufw", "--force", "enable" if enabled else "disable"], dry_run=dry_run)
+        finally:
+            umount_chroot_binds(target_root, dry_run=dry_run)
+
+        logger.info("Firewall (ufw) %s", "enabled" if enabled else "disabled")
+        return state
@@ -1,26 +1,25 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List
 
+from ..lib.apt_index import package_index
 from ..lib.chroot import mount_chroot_binds, umount_chroot_binds
-from ..lib.pkg import apt_has_package, apt_install, apt_update
+from ..lib.fetch import prefetch_for_install
+from ..lib.pkg import PackageSet, apt_install, apt_package_info, apt_transaction_mode, apt_update
+from ..lib.rootfs_image import install_mode
 
 logger = logging.getLogger(__name__)
 
 
 class InstallDesktopStep:
     step_id = "60_install_desktop"
+    requires = ("rootfs", "packages")
+    provides = ("desktop",)
+    resources = ("dpkg",)
 
-    def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    def plan_packages(self, state: Dict[str, Any]) -> List[PackageSet]:
         cfg = state.get("config") or {}
-        exe = state.get("execution") or {}
-        mounts = exe.get("mounts") or {}
-        target_root = mounts.get("target_root")
-        if not target_root:
-            raise RuntimeError("execution.mounts.target_root missing")
-
-        dry_run = bool(cfg.get("dry_run", False))
 
         # Desktop base:
         # - OS boots into XFCE ("Xubuntu-style") by default.
@@ -63,17 +62,57 @@ class InstallDesktopStep:
                 "wl-clipboard",
             ]
 
+        plan = [PackageSet(source=self.step_id, packages=tuple(packages), with_recommends=with_recommends)]
+
         # Optional: Blackfong shell (only if repo provides it).
         blackfong_shell_pkg = str(cfg.get("blackfong_shell_package", "blackfong-code-warden-shell")).strip()
+        if blackfong_shell_pkg:
+            plan.append(
+                PackageSet(
+                    source=self.step_id,
+                    packages=(blackfong_shell_pkg,),
+                    optional=True,
+                    with_recommends=with_recommends,
+                )
+            )
+        return plan
+
+    def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        cfg = state.get("config") or {}
+        exe = state.get("execution") or {}
+        mounts = exe.get("mounts") or {}
+        target_root = mounts.get("target_root")
+        if not target_root:
+            raise RuntimeError("execution.mounts.target_root missing")
+
+        dry_run = bool(cfg.get("dry_run", False))
+        desktop_base = str(cfg.get("desktop_base", "xubuntu")).strip().lower()
+        code_warden_enabled = bool(cfg.get("code_warden_enabled", False))
 
-        mount_chroot_binds(target_root, dry_run=dry_run)
-        try:
-            apt_update(target_root, dry_run=dry_run)
-            if blackfong_shell_pkg and apt_has_package(target_root, blackfong_shell_pkg, dry_run=dry_run):
-                packages.append(blackfong_shell_pkg)
-            apt_install(target_root, packages, with_recommends=with_recommends, dry_run=dry_run)
-        finally:
-            umount_chroot_binds(target_root, dry_run=dry_run)
+        if apt_transaction_mode(cfg) != "single" and install_mode(state) != "image":
+            plan = self.plan_packages(state)
+            mount_chroot_binds(target_root, dry_run=dry_run)
+            try:
+                apt_update(target_root, dry_run=dry_run)
+                with package_index(state) as index:
+                    info = apt_package_info(
+                        target_root,
+                        [p for ps in plan if ps.optional for p in ps.packages],
+                        index=index,
+                        dry_run=dry_run,
+                    )
+                packages: list[str] = []
+                for ps in plan:
+                    if ps.optional:
+                        packages += [p for p in ps.packages if info[p].available]
+                    else:
+                        packages += list(ps.packages)
+                prefetch_for_install(
+                    state, target_root, packages, with_recommends=plan[0].with_recommends, dry_run=dry_run
+                )
+                apt_install(target_root, packages, with_recommends=plan[0].with_recommends, dry_run=dry_run)
+            finally:
+                umount_chroot_binds(target_root, dry_run=dry_run)
 
         logger.info(
             "Desktop stack installed (desktop_base=%s code_warden_enabled=%s)",
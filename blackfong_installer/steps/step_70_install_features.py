@@ -1,18 +1,24 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
+from ..lib.apt_index import package_index
 from ..lib.chroot import mount_chroot_binds, umount_chroot_binds
+from ..lib.fetch import installed_versions, prefetch_for_install
 from ..lib.manifests import load_features_manifest
 from ..lib.net import is_online
-from ..lib.pkg import apt_has_package, apt_install, apt_update
+from ..lib.pkg import PackageInfo, PackageSet, apt_install, apt_package_info, apt_transaction_mode, apt_update
+from ..lib.rootfs_image import install_mode
 
 logger = logging.getLogger(__name__)
 
 
 class InstallFeaturesStep:
     step_id = "70_install_features"
+    requires = ("hardware", "profile", "rootfs", "packages")
+    provides = ("features",)
+    resources = ("dpkg",)
 
     def _get_profile_flag(self, state: Dict[str, Any], key: str, default: Any) -> Any:
         profile = state.get("profile") or {}
@@ -50,28 +56,20 @@ class InstallFeaturesStep:
             if bool(self._get_profile_flag(state, name, False)):
                 groups.append(name)
 
-        # Media path: if GPU present, attempt hw accel packages.
-        if bool(gpu.get("present", False)):
-            vendor = str(gpu.get("vendor") or "unknown").lower()
-            if vendor == "intel":
-                groups.append("media_hwaccel_intel")
-            elif vendor == "amd":
-                groups.append("media_hwaccel_amd")
-            elif vendor == "nvidia":
-                groups.append("media_hwaccel_nvidia")
-
-            # AI/ML GPU path only if online/hybrid allows it (these are heavy / repo-dependent).
-            ai_policy = str(self._get_profile_flag(state, "ai_ml", "auto")).lower()
+        # Media path: hw accel packages for every detected GPU vendor (hybrid laptops have two).
+        vendors = [str(g.get("vendor") or "unknown").lower() for g in (hw.get("gpus") or [])]
+        if not vendors and bool(gpu.get("present", False)):
+            vendors = [str(gpu.get("vendor") or "unknown").lower()]
+        # AI/ML GPU path only if online/hybrid allows it (these are heavy / repo-dependent).
+        ai_policy = str(self._get_profile_flag(state, "ai_ml", "auto")).lower()
+        for vendor in vendors:
+            if vendor not in {"intel", "amd", "nvidia"}:
+                continue
+            groups.append(f"media_hwaccel_{vendor}")
             if allow_online and ai_policy in {"auto", "gpu", "on"}:
-                if vendor == "intel":
-                    groups.append("ai_ml_gpu_intel")
-                elif vendor == "amd":
-                    groups.append("ai_ml_gpu_amd")
-                elif vendor == "nvidia":
-                    groups.append("ai_ml_gpu_nvidia")
+                groups.append(f"ai_ml_gpu_{vendor}")
 
         # CPU AI/ML runtime (safe default when online GPU path isn't selected).
-        ai_policy = str(self._get_profile_flag(state, "ai_ml", "auto")).lower()
         if ai_policy in {"auto", "cpu", "on"}:
             groups.append("ai_ml_cpu")
 
@@ -87,14 +85,13 @@ class InstallFeaturesStep:
                 dedup.append(g)
         return dedup
 
-    def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        cfg = state.get("config") or {}
-        exe = state.get("execution") or {}
-        mounts = exe.get("mounts") or {}
-        target_root = mounts.get("target_root")
-        if not target_root:
-            raise RuntimeError("execution.mounts.target_root missing")
+    def plan_packages(self, state: Dict[str, Any]) -> List[PackageSet]:
+        """Select feature groups and return their packages (all optional).
 
+        Records decisions.online and plan.features.selected_groups.
+        """
+
+        cfg = state.get("config") or {}
         dry_run = bool(cfg.get("dry_run", False))
         src = cfg.get("install_source", "offline")
 
@@ -118,32 +115,81 @@ class InstallFeaturesStep:
                 raise RuntimeError(f"Feature group {group} packages must be a list")
             desired_packages.extend([str(p).strip() for p in pkgs if str(p).strip()])
 
+        state.setdefault("execution", {}).setdefault("plan", {}).setdefault("features", {})[
+            "selected_groups"
+        ] = selected_groups
+        state.setdefault("execution", {}).setdefault("decisions", {})["features_allow_online"] = allow_online
+
+        # Never fail the installer on repo variance: packages not known to apt are skipped.
+        return [PackageSet(source=self.step_id, packages=tuple(desired_packages), optional=True)]
+
+    def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        cfg = state.get("config") or {}
+        exe = state.get("execution") or {}
+        mounts = exe.get("mounts") or {}
+        target_root = mounts.get("target_root")
+        if not target_root:
+            raise RuntimeError("execution.mounts.target_root missing")
+
+        dry_run = bool(cfg.get("dry_run", False))
+
+        image_mode = install_mode(state) == "image"
+        if apt_transaction_mode(cfg) == "single" and not image_mode:
+            # Planned and installed by 45_install_packages.
+            features = ((state.get("execution") or {}).get("plan") or {}).get("features") or {}
+            logger.info("Features installed by apt transaction (groups=%s)", ",".join(features.get("selected_groups") or []))
+            return state
+
+        plan = self.plan_packages(state)
+        allow_online = bool((state.get("execution") or {}).get("decisions", {}).get("features_allow_online"))
+        selected_groups = state["execution"]["plan"]["features"]["selected_groups"]
+
+        if image_mode:
+            # The root image ships the groups every host gets; only hardware-gated extras remain.
+            installed = installed_versions(target_root)
+            plan = [
+                PackageSet(source=ps.source, packages=tuple(p for p in ps.packages if p not in installed), optional=ps.optional)
+                for ps in plan
+            ]
+            if not any(ps.packages for ps in plan):
+                record_feature_packages(state, [], [])
+                logger.info("Features provided by root image (groups=%s)", ",".join(selected_groups))
+                return state
+
         mount_chroot_binds(target_root, dry_run=dry_run)
         try:
             apt_update(target_root, dry_run=dry_run)
-            # Never fail the installer on repo variance: skip packages not known to apt.
-            packages: list[str] = []
-            missing: list[str] = []
-            for p in desired_packages:
-                if apt_has_package(target_root, p, dry_run=dry_run):
-                    packages.append(p)
-                else:
-                    missing.append(p)
-
-            state.setdefault("execution", {}).setdefault("plan", {}).setdefault("features", {})[
-                "selected_groups"
-            ] = selected_groups
-            state.setdefault("execution", {}).setdefault("plan", {}).setdefault("features", {})[
-                "packages"
-            ] = packages
-            if missing:
-                state.setdefault("execution", {}).setdefault("warnings", []).append(
-                    {"feature_packages_missing": missing}
+            with package_index(state) as index:
+                info = apt_package_info(
+                    target_root, [p for ps in plan for p in ps.packages], index=index, dry_run=dry_run
                 )
+            packages = [n for n, i in info.items() if i.available]
+            missing = [n for n, i in info.items() if not i.available]
 
+            record_feature_packages(state, packages, missing, info=info)
+            prefetch_for_install(state, target_root, packages, dry_run=dry_run)
             apt_install(target_root, packages, dry_run=dry_run)
         finally:
             umount_chroot_binds(target_root, dry_run=dry_run)
 
         logger.info("Features installed (allow_online=%s groups=%s)", allow_online, ",".join(selected_groups))
         return state
+
+
+def record_feature_packages(
+    state: Dict[str, Any],
+    packages: list[str],
+    missing: list[str],
+    *,
+    info: Optional[Dict[str, PackageInfo]] = None,
+) -> None:
+    """Record the resolved feature package list (and any packages apt does not know)."""
+
+    features = state.setdefault("execution", {}).setdefault("plan", {}).setdefault("features", {})
+    features["packages"] = packages
+    if info is not None:
+        features["candidates"] = {
+            p: {"version": info[p].candidate, "source": info[p].source} for p in packages if p in info
+        }
+    if missing:
+        state.setdefault("execution", {}).setdefault("warnings", []).append({"feature_packages_missing": missing})
@@ -4,11 +4,15 @@ import logging
 from pathlib import Path
 from typing import Any, Dict
 
+from ..lib.apt_proxy import remove_apt_proxy_conf
+
 logger = logging.getLogger(__name__)
 
 
 class PostInstallChecksStep:
     step_id = "80_post_install_checks"
+    requires = ("fstab", "kernel", "bootloader", "services", "assets", "firewall", "desktop", "features")
+    provides = ("checks",)
 
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         exe = state.get("execution") or {}
@@ -27,5 +31,9 @@ class PostInstallChecksStep:
             if not p.exists():
                 raise RuntimeError(f"Post-install check failed: missing {p}")
 
+        # The install-time APT proxy must not leak into the installed system.
+        if not bool((state.get("config") or {}).get("dry_run", False)):
+            remove_apt_proxy_conf(target_root)
+
         logger.info("Post-install checks passed (basic)")
         return state
@@ -3,6 +3,7 @@ from __future__ import annotations
 import logging
 from typing import Any, Dict
 
+from ..lib.chroot import release_chroot_binds
 from ..lib.command import run_cmd
 
 logger = logging.getLogger(__name__)
@@ -10,6 +11,9 @@ logger = logging.getLogger(__name__)
 
 class FinalizeRebootStep:
     step_id = "90_finalize_reboot"
+    requires = ("checks",)
+    provides = ()
+    resources = ("disk",)
 
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         cfg = state.get("config") or {}
@@ -23,6 +27,10 @@ class FinalizeRebootStep:
         # Unmounting and reboot are operational and should be explicitly enabled.
         # For a real installer environment, set config.finalize_reboot=true.
         if bool(cfg.get("finalize_reboot", False)):
+            # Session-held chroot binds must go before the target itself can be unmounted.
+            if target_root:
+                release_chroot_binds(target_root, dry_run=dry_run)
+
             # best-effort unmount
             for p in [
                 f"{target_root}/boot/efi",
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+import asyncio
+import os
 import shlex
+import signal
 import subprocess
 from dataclasses import dataclass
 from typing import List, Optional, Sequence
@@ -37,3 +40,49 @@ def run_in_workspace(
     )
     return ExecResult(argv=argv_list, returncode=p.returncode, stdout=p.stdout, stderr=p.stderr)
 
+
+def _text(data: bytes) -> str:
+    # Universal newlines, as text=True gives run_in_workspace.
+    return data.decode("utf-8", "replace").replace("\r\n", "\n").replace("\r", "\n")
+
+
+async def run_in_workspace_async(
+    argv: Sequence[str],
+    *,
+    cwd: str,
+    timeout_s: float = 30.0,
+    input_text: Optional[str] = None,
+) -> ExecResult:
+    """asyncio counterpart of run_in_workspace (same result and TimeoutExpired on timeout).
+
+    On timeout or cancellation the command's process group is killed and reaped.
+    """
+
+    argv_list = list(argv)
+    proc = await asyncio.create_subprocess_exec(
+        *argv_list,
+        cwd=cwd,
+        stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        out, err = await asyncio.wait_for(
+            proc.communicate(input_text.encode("utf-8") if input_text is not None else None), timeout_s
+        )
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await asyncio.shield(proc.wait())
+        if isinstance(e, asyncio.TimeoutError):
+            raise subprocess.TimeoutExpired(argv_list, timeout_s) from None
+        raise
+    return ExecResult(
+        argv=argv_list,
+        returncode=proc.returncode if proc.returncode is not None else -signal.SIGKILL,
+        stdout=_text(out),
+        stderr=_text(err),
+    )
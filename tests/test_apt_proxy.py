@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import hashlib
+import http.client
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import pytest
+
+from blackfong_installer.lib.apt_proxy import CacheStore, make_server
+
+
+class _Upstream:
+    """Fake mirror: serves `files` with ETags and answers If-None-Match with 304."""
+
+    def __init__(self) -> None:
+        self.files: Dict[str, bytes] = {}
+        self.requests: List[str] = []
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                upstream.requests.append(self.path)
+                body = upstream.files.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host = f"127.0.0.1:{self.server.server_port}"
+
+
+def _serve(server: ThreadingHTTPServer) -> None:
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def _stop(server: ThreadingHTTPServer) -> None:
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def upstream() -> Iterator[_Upstream]:
+    u = _Upstream()
+    _serve(u.server)
+    yield u
+    _stop(u.server)
+
+
+def _proxy(tmp_path: Path, upstream: _Upstream, *, max_bytes: int = 1 << 20) -> ThreadingHTTPServer:
+    server = make_server(
+        "127.0.0.1",
+        0,
+        cache_dir=str(tmp_path / "store"),
+        max_bytes=max_bytes,
+        allowed_hosts=[f"http://{upstream.host}/debian"],
+    )
+    _serve(server)
+    return server
+
+
+@pytest.fixture
+def proxy(tmp_path: Path, upstream: _Upstream) -> Iterator[ThreadingHTTPServer]:
+    server = _proxy(tmp_path, upstream)
+    yield server
+    _stop(server)
+
+
+def _get(proxy: ThreadingHTTPServer, path: str) -> Tuple[int, str, bytes]:
+    """GET through the proxy; absolute URIs are sent proxy-style, anything else as is."""
+
+    conn = http.client.HTTPConnection("127.0.0.1", proxy.server_port, timeout=10)
+    try:
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        return resp.status, resp.getheader("X-Cache") or "", resp.read()
+    finally:
+        conn.close()
+
+
+def _wait_stored(tmp_path: Path, host: str, path: str) -> None:
+    """The store commits after the body went out; wait for it before relying on LRU order."""
+
+    dst = tmp_path / "store" / host / path.lstrip("/")
+    deadline = time.monotonic() + 5
+    while not dst.with_name(dst.name + ".meta").exists():
+        assert time.monotonic() < deadline, f"{path} never stored"
+        time.sleep(0.01)
+
+
+def test_pool_and_by_hash_hit(proxy: ThreadingHTTPServer, upstream: _Upstream) -> None:
+    deb = "/debian/pool/main/h/hello/hello_2.10-3_amd64.deb"
+    by_hash = "/debian/dists/bookworm/main/binary-amd64/by-hash/SHA256/" + "ab" * 32
+    upstream.files[deb] = b"deb" * 1000
+    upstream.files[by_hash] = b"index" * 100
+
+    for path in (deb, by_hash):
+        assert _get(proxy, f"http://{upstream.host}{path}") == (200, "MISS", upstream.files[path])
+        assert _get(proxy, f"/{upstream.host}{path}") == (200, "HIT", upstream.files[path])
+    # Immutable objects are never revalidated.
+    assert upstream.requests == [deb, by_hash]
+
+
+def test_inrelease_revalidated_then_refetched(proxy: ThreadingHTTPServer, upstream: _Upstream) -> None:
+    path = "/debian/dists/bookworm/InRelease"
+    url = f"http://{upstream.host}{path}"
+    upstream.files[path] = b"Suite: stable\nDate: one\n"
+
+    assert _get(proxy, url) == (200, "MISS", b"Suite: stable\nDate: one\n")
+    assert _get(proxy, url) == (200, "REVALIDATED", b"Suite: stable\nDate: one\n")
+
+    upstream.files[path] = b"Suite: stable\nDate: two\n"
+    assert _get(proxy, url) == (200, "MISS", b"Suite: stable\nDate: two\n")
+    assert _get(proxy, url) == (200, "REVALIDATED", b"Suite: stable\nDate: two\n")
+    assert upstream.requests == [path] * 4
+
+
+def test_lru_eviction(tmp_path: Path, upstream: _Upstream) -> None:
+    paths = [f"/debian/pool/main/p/p{i}/p{i}_1_all.deb" for i in range(3)]
+    for p in paths:
+        upstream.files[p] = b"x" * 400
+
+    server = _proxy(tmp_path, upstream, max_bytes=1000)
+    try:
+        base = f"http://{upstream.host}"
+        for p in paths[:2]:
+            _get(server, base + p)
+            _wait_stored(tmp_path, upstream.host, p)
+        assert _get(server, base + paths[0])[1] == "HIT"  # p0 is now the most recently used
+        _get(server, base + paths[2])  # 1200 bytes > cap: evicts p1
+        _wait_stored(tmp_path, upstream.host, paths[2])
+
+        assert _get(server, base + paths[0])[1] == "HIT"
+        assert _get(server, base + paths[2])[1] == "HIT"
+        assert _get(server, base + paths[1])[1] == "MISS"  # and in turn evicts p0
+    finally:
+        _stop(server)
+    assert not (tmp_path / "store" / upstream.host / paths[0].lstrip("/")).exists()
+
+
+@pytest.mark.parametrize(
+    "host,path",
+    [
+        ("mirror", "/debian/../../etc/passwd"),
+        ("mirror", "/debian/pool/../../../x.deb"),
+        ("..", "/debian/pool/x.deb"),
+        (".", "/debian/pool/x.deb"),
+        ("", "/debian/pool/x.deb"),
+        ("a/b", "/debian/pool/x.deb"),
+        ("mirror", "/debian/pool/x\0.deb"),
+    ],
+)
+def test_key_for_rejects_escapes(host: str, path: str) -> None:
+    assert CacheStore.key_for(host, path) is None
+
+
+def test_rejects_bad_paths_and_hosts(proxy: ThreadingHTTPServer, upstream: _Upstream) -> None:
+    assert _get(proxy, f"/{upstream.host}/debian/../../etc/passwd")[0] == 400
+    assert _get(proxy, "/../debian/pool/x.deb")[0] == 400
+    assert _get(proxy, "/./debian/pool/x.deb")[0] == 400
+    # Not on the allowlist: the proxy is not an open relay.
+    assert _get(proxy, "http://example.invalid/debian/pool/x.deb")[0] == 403
+    assert upstream.requests == []
+
+
+def test_rejects_keys_conflicting_with_cached_objects(proxy: ThreadingHTTPServer, upstream: _Upstream) -> None:
+    release = "/debian/dists/bookworm/InRelease"
+    upstream.files[release] = b"Suite: stable\n"
+    upstream.files["/debian/dists/bookworm"] = b"directory listing"
+    upstream.files[release + "/x"] = b"below a file"
+    base = f"http://{upstream.host}"
+
+    assert _get(proxy, base + release)[0] == 200
+    assert _get(proxy, base + "/debian/dists/bookworm")[0] == 409
+    assert _get(proxy, base + release + "/x")[0] == 409
+    assert _get(proxy, base + release)[1] == "REVALIDATED"
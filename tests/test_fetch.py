@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import pytest
+
+from blackfong_installer.lib.apt_index import PackageRecord, open_cache
+from blackfong_installer.lib.fetch import archive_name, fetch_debs
+
+# name -> (version, architecture)
+PACKAGES = {
+    "alpha": ("1.0-1", "amd64"),
+    "bravo": ("2:3.4-5", "amd64"),
+    "charlie": ("0.9", "all"),
+    "delta": ("1:1.1+dfsg-2", "amd64"),
+    "echo": ("7.0", "amd64"),
+    "foxtrot": ("1.2.3-1", "all"),
+}
+
+
+class _Mirror:
+    """A directory served over HTTP that records requests and peak concurrency."""
+
+    def __init__(self, root: Path, delay: float = 0.05) -> None:
+        self.root = root
+        self.requests: List[str] = []
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        mirror = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def do_GET(self) -> None:
+                with mirror._lock:
+                    mirror.requests.append(self.path)
+                    mirror.in_flight += 1
+                    mirror.peak = max(mirror.peak, mirror.in_flight)
+                try:
+                    time.sleep(delay)
+                    super().do_GET()
+                finally:
+                    with mirror._lock:
+                        mirror.in_flight -= 1
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(Handler, directory=str(root)))
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/debian"
+
+    def __enter__(self) -> "_Mirror":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _deb_body(name: str) -> bytes:
+    return (f"!<arch>\n{name}\n".encode() * 2000)[: 50_000 + len(name)]
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Dict[str, PackageRecord]:
+    """A mirror tree (tmp_path/mirror/debian) with a Packages index and one .deb per package."""
+
+    base = tmp_path / "mirror" / "debian"
+    stanzas = []
+    for name, (version, arch) in PACKAGES.items():
+        filename = f"pool/main/{name[0]}/{name}/{name}_{version.split(':')[-1]}_{arch}.deb"
+        body = _deb_body(name)
+        deb = base / filename
+        deb.parent.mkdir(parents=True, exist_ok=True)
+        deb.write_bytes(body)
+        stanzas.append(
+            f"Package: {name}\nVersion: {version}\nArchitecture: {arch}\nFilename: {filename}\n"
+            f"Size: {len(body)}\nSHA256: {hashlib.sha256(body).hexdigest()}\n"
+        )
+    packages = base / "dists/stable/main/binary-amd64/Packages"
+    packages.parent.mkdir(parents=True)
+    packages.write_text("\n".join(stanzas), encoding="utf-8")
+
+    cache = open_cache(str(packages), cache_dir=str(tmp_path / "index-cache"))
+    try:
+        return {name: cache.versions(name)[0] for name in PACKAGES}
+    finally:
+        cache.close()
+
+
+@pytest.fixture
+def mirror(tmp_path: Path, repo: Dict[str, PackageRecord]) -> Iterator[_Mirror]:
+    with _Mirror(tmp_path / "mirror") as m:
+        yield m
+
+
+def test_fetches_in_parallel(tmp_path: Path, repo: Dict[str, PackageRecord], mirror: _Mirror) -> None:
+    archives = tmp_path / "archives"
+    result = fetch_debs(repo.values(), mirror=mirror.url, archives_dir=str(archives), jobs=4)
+
+    assert sorted(result.fetched) == sorted(PACKAGES)
+    assert not result.failed and not result.cached
+    assert result.bytes_fetched == sum(r.size for r in repo.values())
+    assert mirror.peak > 1
+    for rec in repo.values():
+        assert (archives / archive_name(rec)).read_bytes() == _deb_body(rec.name)
+    assert not list((archives / "partial").iterdir())
+
+
+def test_rejects_corrupted_deb(tmp_path: Path, repo: Dict[str, PackageRecord], mirror: _Mirror) -> None:
+    rec = repo["alpha"]
+    deb = tmp_path / "mirror" / "debian" / rec.filename
+    body = bytearray(deb.read_bytes())
+    body[100] ^= 0xFF  # same size, different hash
+    deb.write_bytes(bytes(body))
+
+    archives = tmp_path / "archives"
+    result = fetch_debs(repo.values(), mirror=mirror.url, archives_dir=str(archives), jobs=4)
+
+    assert [name for name, _ in result.failed] == ["alpha"]
+    assert "SHA256 mismatch" in result.failed[0][1]
+    assert "alpha" not in result.fetched
+    assert not (archives / archive_name(rec)).exists()
+    assert not list((archives / "partial").iterdir())
+
+
+def test_skips_already_cached(tmp_path: Path, repo: Dict[str, PackageRecord], mirror: _Mirror) -> None:
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    for name in ("alpha", "bravo"):
+        (archives / archive_name(repo[name])).write_bytes(_deb_body(name))
+    # Right size, wrong content: must be fetched again.
+    stale = repo["charlie"]
+    (archives / archive_name(stale)).write_bytes(b"\0" * stale.size)
+
+    result = fetch_debs(repo.values(), mirror=mirror.url, archives_dir=str(archives), jobs=4)
+
+    assert sorted(result.cached) == ["alpha", "bravo"]
+    assert sorted(result.fetched) == sorted(set(PACKAGES) - {"alpha", "bravo"})
+    fetched_paths = " ".join(mirror.requests)
+    assert "/alpha/" not in fetched_paths and "/bravo/" not in fetched_paths
+    assert (archives / archive_name(stale)).read_bytes() == _deb_body("charlie")
+
+
+def test_archive_name_quotes_epoch(tmp_path: Path, repo: Dict[str, PackageRecord], mirror: _Mirror) -> None:
+    assert archive_name(repo["bravo"]) == "bravo_2%3a3.4-5_amd64.deb"
+    assert archive_name(repo["delta"]) == "delta_1%3a1.1+dfsg-2_amd64.deb"
+    assert archive_name(repo["alpha"]) == "alpha_1.0-1_amd64.deb"
+    assert archive_name(PackageRecord(name="golf", version="1:2")) == "golf_1%3a2_all.deb"
+
+    archives = tmp_path / "archives"
+    fetch_debs([repo["bravo"]], mirror=mirror.url, archives_dir=str(archives))
+    assert [p.name for p in archives.glob("*.deb")] == ["bravo_2%3a3.4-5_amd64.deb"]
@@ -4,15 +4,28 @@ A real GUI (Wayland/GTK/Qt) should:
 - Collect user config choices
 - Write them into the shared state file under state['config']
 - Call blackfong_installer.main.run(...)
-- Display progress using log tailing or step callbacks (future)
+- Display progress from structured events (blackfong_installer.lib.events):
+  in-process via subscribe(on_event), or out-of-process by starting the
+  installer with --events-socket PATH and reading follow_events(PATH)
 
 This module exists to document the integration boundary.
 """
 
 from __future__ import annotations
 
+from typing import Any, Callable, Dict, Optional
+
+from blackfong_installer.lib.events import subscribe
 from blackfong_installer.main import run
 
 
-def run_from_gui(*, state_path: str, log_path: str) -> None:
-    run(state_path=state_path, log_path=log_path)
+def run_from_gui(
+    *, state_path: str, log_path: str, on_event: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> None:
+    # on_event runs on the emitting (installer) thread; hand events to the UI loop from there.
+    unsubscribe = subscribe(on_event) if on_event is not None else None
+    try:
+        run(state_path=state_path, log_path=log_path)
+    finally:
+        if unsubscribe is not None:
+            unsubscribe()